@@ -0,0 +1,267 @@
+import asyncio
+import functools
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import STAGE_SECONDS
+from poller import AdaptivePoller, PollMetrics
+from retry import ShardCursor
+from shards import list_shards, read_page, start_position
+
+# Put on a table's queue once its readers are done so the writer can finish
+_DONE = object()
+
+
+class TablePipeline:
+    """Shard readers and a sink writer for one table, joined by a bounded queue
+
+    Readers block on queue.put() when the writer falls behind, which is what
+    keeps memory bounded. concurrency caps how many get_records calls this
+    table can have in flight at once, whatever its shard count.
+
+    Pages are tagged with their shard's generation. When the sink rejects a
+    page the writer bumps the generation, drops the shard's queued pages and
+    has its reader start over at the rejected page. A
+    shard only counts as finished once the writer has taken its last page.
+    """
+
+    def __init__(self, engine, config):
+        self.engine = engine
+        self.name = config['table_name']
+        self.stream_arn = config['stream_arn']
+        self.bucket_name = config['bucket_name']
+        self.prefix = config['prefix']
+        self.sink = config['sink']
+        self.dedup = config.get('dedup')
+        self.poller_options = config.get('poller') or {}
+
+        self.calls = asyncio.Semaphore(config.get('concurrency', 4))
+        self.queue = asyncio.Queue(maxsize=config.get('queue_size', 16))
+        self.metrics = PollMetrics(self.name)
+
+        self.shards = {}
+        self.pending = {}
+        self.finished = set()
+        self.readers = {}
+        self.positions = {}      # shard_id -> (iterator type, sequence number) after the last page sunk
+        self.generations = {}    # shard_id -> bumped every time the shard is rewound
+
+    async def discover(self, initial=False):
+        """Pick up new shards and start readers for the ones whose parent is drained"""
+        checkpointed = {}
+        if self.engine.checkpoints:
+            checkpointed = await self.engine.call(self.engine.checkpoints.get_all, self.stream_arn)
+        shards = await self.engine.call(list_shards, self.engine.dynamodb_client, self.stream_arn)
+
+        for shard in shards:
+            shard_id = shard['ShardId']
+            if shard_id in self.shards:
+                continue
+            self.shards[shard_id] = shard
+            position = start_position(shard, checkpointed, initial)
+            if position is None:
+                self.finished.add(shard_id)
+            else:
+                self.pending[shard_id] = position
+        self.schedule()
+
+    def schedule(self):
+        if self.engine.stop_event.is_set():
+            return
+        for shard_id in list(self.pending):
+            parent_id = self.shards[shard_id].get('ParentShardId')
+            if parent_id in self.shards and parent_id not in self.finished:
+                continue
+            self.positions[shard_id] = self.pending.pop(shard_id)
+            self.readers[shard_id] = asyncio.create_task(self.read_shard(shard_id))
+
+    async def read_shard(self, shard_id):
+        """Read a shard until it is closed or the engine is stopped"""
+        engine = self.engine
+        poller = AdaptivePoller(**self.poller_options)
+        generation = self.generations.setdefault(shard_id, 0)
+        cursor = ShardCursor(self.stream_arn, shard_id, *self.positions[shard_id])
+        drained = False
+        try:
+            print(f"\nWatching shard {shard_id} for {self.name} records...")
+
+            while not engine.stop_event.is_set():
+                if self.generations[shard_id] != generation:
+                    # The writer lost a page, read again from the last one it kept
+                    generation = self.generations[shard_id]
+                    cursor = ShardCursor(self.stream_arn, shard_id, *self.positions[shard_id])
+                if cursor.drained:
+                    # The writer marks the shard finished once everything before this is sunk
+                    await self.queue.put((shard_id, generation, None))
+                    if self.generations[shard_id] == generation:
+                        drained = True
+                        break
+                    continue
+                try:
+                    async with self.calls:
+                        if cursor.stale:
+                            await engine.call(cursor.refresh, engine.dynamodb_client)
+                        response = await engine.call(read_page, engine.dynamodb_client,
+                                                     cursor.iterator, poller.limit, self.name)
+                except Exception as e:
+                    delay = cursor.failed(e)
+                    print(f"Error reading shard {shard_id} for {self.name}, "
+                          f"retrying in {delay:.2f}s: {e}")
+                    if delay:
+                        await engine.pause(delay)
+                    continue
+
+                records = response['Records']
+                if records:
+                    await self.queue.put((shard_id, generation, records))
+                cursor.advance(response)
+                self.metrics.observe(shard_id, records)
+                self.metrics.maybe_report()
+
+                delay = poller.next_delay(len(records))
+                if not cursor.drained and delay:
+                    await engine.pause(delay)
+        except Exception as e:
+            print(f"Shard {shard_id} for {self.name} stopped: {e}")
+        finally:
+            self.readers.pop(shard_id, None)
+            if not drained:
+                # Stay registered so children keep waiting; discovery resumes
+                # the shard after the last page that reached the sink
+                self.pending[shard_id] = self.positions[shard_id]
+
+    def add_page(self, shard_id, records):
+        # Runs on the executor, the sink does its own locking and stage timing
+        if self.dedup:
+            with STAGE_SECONDS.time(stage='dedup'):
+                records = self.dedup.filter(self.stream_arn, shard_id, records)
+        added = 0
+        try:
+            for record in records:
+                self.sink.add(record, self.bucket_name, self.prefix,
+                              position=(self.stream_arn, shard_id))
+                added += 1
+        finally:
+            if self.dedup:
+                self.dedup.accepted(self.stream_arn, shard_id, records[:added])
+        self.sink.flush_due()
+
+    async def write(self):
+        """Move pages from the queue into the sink until the readers are done"""
+        while True:
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout=5)
+            except asyncio.TimeoutError:
+                # Nothing arriving, but age-based flushes still have to happen
+                await self.engine.call(self.sink.flush_due)
+                continue
+            if item is _DONE:
+                return
+            shard_id, generation, records = item
+            if generation != self.generations.get(shard_id):
+                continue  # queued before a rewind, the reader sends it again
+            if records is None:
+                print(f"Shard {shard_id} for {self.name} is drained")
+                self.finished.add(shard_id)
+                self.metrics.drained(shard_id)
+                self.schedule()
+                continue
+            try:
+                await self.engine.call(self.add_page, shard_id, records)
+            except Exception as e:
+                self.rewind(shard_id, records)
+                print(f"Error writing {self.name} records from shard {shard_id}, "
+                      f"reading again from {self.positions[shard_id]}: {e}")
+                continue
+            self.positions[shard_id] = ('AFTER_SEQUENCE_NUMBER',
+                                        records[-1]['dynamodb']['SequenceNumber'])
+
+    def rewind(self, shard_id, records):
+        """Have a shard read again from the start of a page the sink rejected"""
+        # Every earlier page of the shard is in the sink, later ones get dropped
+        self.positions[shard_id] = ('AT_SEQUENCE_NUMBER', records[0]['dynamodb']['SequenceNumber'])
+        self.generations[shard_id] += 1
+        if shard_id not in self.readers:
+            # Its reader is gone (drained or stopped), start a new one
+            self.pending[shard_id] = self.positions[shard_id]
+            self.schedule()
+
+
+class AsyncStreamEngine:
+    """Multiplex every table/shard reader and sink writer on one event loop
+
+    boto3 calls are blocking, so they run on a ThreadPoolExecutor whose size
+    (max_calls) is the global cap on concurrent AWS calls.
+    """
+
+    def __init__(self, dynamodb_client, pipelines, checkpoints=None, max_calls=32,
+                 discovery_interval=60):
+        self.dynamodb_client = dynamodb_client
+        self.pipeline_configs = pipelines
+        self.checkpoints = checkpoints
+        self.max_calls = max_calls
+        self.discovery_interval = discovery_interval
+        self.executor = None
+        self.stop_event = None
+        self.pipelines = []
+
+    async def call(self, func, *args, **kwargs):
+        """Run a blocking call on the bounded executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def pause(self, delay):
+        """Sleep for delay seconds, returning early if we are stopped"""
+        try:
+            await asyncio.wait_for(self.stop_event.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+    def stop(self):
+        self.stop_event.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_calls, thread_name_prefix='aws')
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(signum, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass  # not on the main thread, or no signal support
+
+        self.pipelines = [TablePipeline(self, config) for config in self.pipeline_configs]
+        writers = [asyncio.create_task(pipeline.write()) for pipeline in self.pipelines]
+        try:
+            initial = True
+            while not self.stop_event.is_set():
+                for pipeline in self.pipelines:
+                    try:
+                        await pipeline.discover(initial)
+                    except Exception as e:
+                        print(f"Error discovering shards for {pipeline.name}: {e}")
+                initial = False
+                await self.pause(self.discovery_interval)
+        finally:
+            await self.drain(writers)
+
+    async def drain(self, writers):
+        """Let in-flight pages reach the sinks, then flush them"""
+        print("Stopping, draining in-flight batches...")
+        for pipeline in self.pipelines:
+            readers = list(pipeline.readers.values())
+            if readers:
+                await asyncio.gather(*readers, return_exceptions=True)
+            await pipeline.queue.put(_DONE)
+        await asyncio.gather(*writers, return_exceptions=True)
+
+        for sink in {id(pipeline.sink): pipeline.sink for pipeline in self.pipelines}.values():
+            await self.call(sink.flush)
+        self.executor.shutdown(wait=True)
+
+
+def run_engine(dynamodb_client, pipelines, **kwargs):
+    """Run the asyncio engine until SIGTERM/SIGINT"""
+    engine = AsyncStreamEngine(dynamodb_client, pipelines, **kwargs)
+    asyncio.run(engine.run())
+    return engine
@@ -0,0 +1,149 @@
+import argparse
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import boto3
+
+from checkpoint import open_checkpoint_store
+from clients import get_s3_client
+from poller import MAX_LIMIT, record_timestamp
+from registry import DEFAULTS
+from retry import ShardCursor, classify
+from shards import is_closed, list_shards
+from sink import S3BatchWriter, make_record_format
+
+
+def drain_shard(dynamodb_client, stream_arn, shard, handle_records, cutoff,
+                max_empty_polls=5, max_errors=5):
+    """Read a shard from TRIM_HORIZON as fast as get_records allows
+
+    Stops when a closed shard runs out, or when an open shard reaches records
+    written after cutoff (epoch seconds) or keeps returning empty pages, i.e.
+    we have caught up with its tip. Returns the number of records read.
+    """
+    shard_id = shard['ShardId']
+    closed = is_closed(shard)
+    cursor = ShardCursor(stream_arn, shard_id, 'TRIM_HORIZON')
+    count = 0
+    empty_polls = 0
+    errors = 0
+
+    while not cursor.drained:
+        try:
+            if cursor.stale:
+                cursor.refresh(dynamodb_client)
+            response = dynamodb_client.get_records(ShardIterator=cursor.iterator, Limit=MAX_LIMIT)
+            errors = 0
+        except Exception as e:
+            # Throttles are expected at full speed and never count towards giving up
+            if classify(e) != 'throttle':
+                errors += 1
+                if errors >= max_errors:
+                    raise
+            delay = cursor.failed(e)
+            print(f"Error reading shard {shard_id}, retrying in {delay:.2f}s: {e}")
+            time.sleep(delay)
+            continue
+
+        records = response['Records']
+        handle_records(shard_id, records)
+        count += len(records)
+        cursor.advance(response)
+
+        if records:
+            empty_polls = 0
+            created = record_timestamp(records[-1])
+            if created is not None and created >= cutoff:
+                break
+        elif not closed:
+            empty_polls += 1
+            if empty_polls >= max_empty_polls:
+                break
+    return count
+
+
+def backfill(dynamodb_client, stream_arn, handle_records, workers=8, max_empty_polls=5):
+    """Drain every shard of a stream up to now, parents before children"""
+    cutoff = time.time()
+    shards = {shard['ShardId']: shard for shard in list_shards(dynamodb_client, stream_arn)}
+    finished = set()
+    totals = {}
+    start = time.perf_counter()
+
+    def ready(shard_id):
+        parent_id = shards[shard_id].get('ParentShardId')
+        return parent_id not in shards or parent_id in finished
+
+    pending = set(shards)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        while pending or running:
+            for shard_id in sorted(pending):
+                if ready(shard_id):
+                    pending.discard(shard_id)
+                    future = executor.submit(drain_shard, dynamodb_client, stream_arn,
+                                             shards[shard_id], handle_records, cutoff,
+                                             max_empty_polls)
+                    running[future] = shard_id
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                shard_id = running.pop(future)
+                try:
+                    totals[shard_id] = future.result()
+                except Exception as e:
+                    print(f"Shard {shard_id} failed: {e}")
+                    totals[shard_id] = 0
+                # Children run even if a parent failed, so one bad shard can't stall the rest
+                finished.add(shard_id)
+
+    elapsed = time.perf_counter() - start
+    records = sum(totals.values())
+    rate = records / elapsed if elapsed else 0.0
+    print(f"Backfilled {records} records from {len(shards)} shards in {elapsed:.1f}s "
+          f"({rate:.0f} records/sec)")
+    return records, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a table stream from TRIM_HORIZON into the lake')
+    parser.add_argument('table_name', help='e.g. Customer or Order')
+    parser.add_argument('--stream-arn', help='defaults to the table\'s latest stream')
+    parser.add_argument('--bucket', default=DEFAULTS['bucket_name'])
+    parser.add_argument('--prefix', help='defaults to the lower-cased table name plus "s"')
+    parser.add_argument('--format', default='ndjson', choices=['ndjson', 'parquet'])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='save checkpoints so final.py resumes right after the backfill '
+                             '(only when the live consumer is not running)')
+    parser.add_argument('--checkpoint-table',
+                        help='DynamoDB table to checkpoint in, as given to final.py '
+                             '(implies --checkpoint), instead of checkpoints.db')
+    args = parser.parse_args()
+
+    stream_arn = args.stream_arn
+    if not stream_arn:
+        stream_arn = boto3.resource('dynamodb').Table(args.table_name).latest_stream_arn
+    prefix = args.prefix or f"{args.table_name.lower()}s"
+
+    checkpoints = None
+    if args.checkpoint or args.checkpoint_table:
+        checkpoints = open_checkpoint_store(boto3.resource('dynamodb'), args.checkpoint_table)
+    sink = S3BatchWriter(get_s3_client(), make_record_format(args.format),
+                         on_flush=checkpoints.save if checkpoints else None)
+
+    def handle_records(shard_id, records):
+        for record in records:
+            sink.add(record, args.bucket, prefix, position=(stream_arn, shard_id))
+        sink.flush_due()
+
+    try:
+        backfill(boto3.client('dynamodbstreams'), stream_arn, handle_records, workers=args.workers)
+    finally:
+        sink.flush()
+        if checkpoints:
+            checkpoints.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import argparse
+import json
+import random
+import time
+from decimal import Decimal
+
+import convert
+
+
+def legacy_convert(d):
+    """insert.py's original convert_floats_to_decimals, kept here as the baseline"""
+    if isinstance(d, dict):
+        return {k: legacy_convert(v) for k, v in d.items()}
+    elif isinstance(d, list):
+        return [legacy_convert(i) for i in d]
+    elif isinstance(d, float):
+        return Decimal(str(d))
+    else:
+        return d
+
+
+def make_orders(count, seed=7):
+    """Orders shaped like insert.py's orders_data"""
+    rng = random.Random(seed)
+    statuses = ['Pending', 'Shipped', 'Delivered', 'Cancelled']
+    orders = []
+    for i in range(count):
+        items = [
+            {'ItemID': f"ITEM{rng.randint(1, 999):03d}",
+             'Quantity': rng.randint(1, 5),
+             'Price': round(rng.uniform(5, 200), 2)}
+            for _ in range(rng.randint(1, 4))
+        ]
+        orders.append({
+            'OrderId': f"ORD{i:08d}",
+            'CustomerId': f"CUST{rng.randint(1, 99999):05d}",
+            'OrderDate': '2024-11-28T14:30:00Z',
+            'OrderTotal': round(sum(item['Price'] * item['Quantity'] for item in items), 2),
+            'OrderStatus': rng.choice(statuses),
+            'Items': items
+        })
+    return orders
+
+
+def timed(name, func, count):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:>40}: {elapsed:7.3f}s ({elapsed / count * 1e6:6.2f} us/record)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='float -> Decimal conversion on nested order items')
+    parser.add_argument('--records', type=int, default=100_000)
+    args = parser.parse_args()
+    n = args.records
+
+    orders = make_orders(n)
+    decimal_orders = [legacy_convert(order) for order in orders]
+    lines = [json.dumps(order) for order in orders]
+
+    # Both paths must agree before we compare their speed
+    assert [convert.floats_to_decimals(order) for order in orders[:1000]] == decimal_orders[:1000]
+    assert [convert.loads(line) for line in lines[:1000]] == decimal_orders[:1000]
+
+    print(f"{n} orders")
+    timed('recursive copy, items with floats', lambda: [legacy_convert(o) for o in orders], n)
+    timed('copy-on-write, items with floats', lambda: [convert.floats_to_decimals(o) for o in orders], n)
+    timed('recursive copy, float-free items', lambda: [legacy_convert(o) for o in decimal_orders], n)
+    timed('copy-on-write, float-free items', lambda: [convert.floats_to_decimals(o) for o in decimal_orders], n)
+    timed('json.loads + recursive copy', lambda: [legacy_convert(json.loads(line)) for line in lines], n)
+    timed('loads(parse_float=Decimal)', lambda: [convert.loads(line) for line in lines], n)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import argparse
+import datetime
+import json
+import random
+import time
+from decimal import Decimal
+
+import encoder
+
+
+class DecimalEncoder(json.JSONEncoder):
+    """final.py's encoder, the baseline"""
+    def default(self, obj):
+        if isinstance(obj, float):
+            return Decimal(str(obj))
+        elif isinstance(obj, Decimal):
+            return float(obj)
+        elif isinstance(obj, datetime.datetime):
+            return obj.isoformat()
+        return super(DecimalEncoder, self).default(obj)
+
+
+def typed_order(rng, i, status):
+    items = [
+        {'M': {'ItemID': {'S': f"ITEM{rng.randint(1, 999):03d}"},
+               'Quantity': {'N': str(rng.randint(1, 5))},
+               'Price': {'N': f"{rng.uniform(5, 200):.2f}"}}}
+        for _ in range(rng.randint(1, 4))
+    ]
+    return {
+        'OrderId': {'S': f"ORD{i:08d}"},
+        'CustomerId': {'S': f"CUST{rng.randint(1, 99999):05d}"},
+        'OrderDate': {'S': '2024-11-28T14:30:00Z'},
+        'OrderTotal': {'N': f"{rng.uniform(10, 900):.2f}"},
+        'OrderStatus': {'S': status},
+        'Items': {'L': items}
+    }
+
+
+def make_records(count, seed=7):
+    """MODIFY records for the Order table, as get_records returns them"""
+    rng = random.Random(seed)
+    created = datetime.datetime(2024, 11, 28, 14, 30, tzinfo=datetime.timezone.utc)
+    records = []
+    for i in range(count):
+        new_image = typed_order(rng, i, 'Shipped')
+        old_image = dict(new_image, OrderStatus={'S': 'Pending'})
+        records.append({
+            'eventID': f"{rng.getrandbits(128):032x}",
+            'eventName': 'MODIFY',
+            'eventVersion': '1.1',
+            'eventSource': 'aws:dynamodb',
+            'awsRegion': 'ap-south-1',
+            'dynamodb': {
+                'ApproximateCreationDateTime': created + datetime.timedelta(seconds=i),
+                'Keys': {'OrderId': new_image['OrderId'], 'CustomerId': new_image['CustomerId']},
+                'NewImage': new_image,
+                'OldImage': old_image,
+                'SequenceNumber': str(100000000021053503235 + i),
+                'SizeBytes': 400,
+                'StreamViewType': 'NEW_AND_OLD_IMAGES'
+            }
+        })
+    return records
+
+
+def measure(name, encode, records):
+    start = time.perf_counter()
+    written = sum(len(encode(record)) for record in records)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>24}: {elapsed / len(records) * 1e6:7.2f} us/record, "
+          f"{written / len(records):7.1f} bytes/record")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream record serialization cost and size')
+    parser.add_argument('--records', type=int, default=100_000)
+    args = parser.parse_args()
+
+    records = make_records(args.records)
+    print(f"{args.records} Order MODIFY records")
+    measure('indent=2 DecimalEncoder',
+            lambda record: json.dumps(record, indent=2, cls=DecimalEncoder).encode('utf-8'), records)
+    measure('compact', encoder.get_encoder('compact'), records)
+    measure('compact + unmarshal', encoder.get_encoder('compact', unmarshal=True), records)
+    if encoder.orjson is not None:
+        measure('orjson', encoder.get_encoder('orjson'), records)
+        measure('orjson + unmarshal', encoder.get_encoder('orjson', unmarshal=True), records)
+    else:
+        print('orjson is not installed, skipping')
+
+
+if __name__ == '__main__':
+    main()
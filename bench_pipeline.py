@@ -0,0 +1,113 @@
+import argparse
+import datetime
+import gzip
+import json
+import statistics
+import threading
+import time
+
+from encoder import get_encoder
+from fakeaws import FakeS3Client, FakeStreamsClient, FakeTable
+from final import process_stream
+from multipart import StreamingS3Writer, zstandard
+from percentiles import percentile
+from sink import S3BatchWriter
+
+BUCKET = 'quarkstail-datalake-s3-bucket'
+
+
+def delivered_lags(s3_client):
+    """End-to-end lag of every record: when its object landed minus when it was written"""
+    lags = []
+    for (bucket, key), body in s3_client.objects.items():
+        landed = s3_client.put_times[(bucket, key)]
+        if key.endswith('.gz'):
+            body = gzip.decompress(body)
+        elif key.endswith('.zst'):
+            body = zstandard.ZstdDecompressor().decompressobj().decompress(body)
+        for line in body.splitlines():
+            created = json.loads(line)['dynamodb']['ApproximateCreationDateTime']
+            lags.append(landed - datetime.datetime.fromisoformat(created).timestamp())
+    return lags
+
+
+def run(args):
+    streams_client = FakeStreamsClient(shard_count=args.shards, rate=args.rate,
+                                       record_size=args.record_size, latency=args.latency)
+    s3_client = FakeS3Client(latency=args.s3_latency)
+    if args.stream_uploads:
+        sink = StreamingS3Writer(s3_client, get_encoder(), compression=args.stream_uploads,
+                                 max_records=args.max_records, max_age=args.max_age)
+    else:
+        sink = S3BatchWriter(s3_client, get_encoder(), max_records=args.max_records,
+                             max_age=args.max_age)
+    stop_event = threading.Event()
+    poller_options = {'min_interval': args.min_interval, 'max_interval': args.max_interval}
+
+    threads = []
+    for stream_arn in streams_client.streams:
+        table_name = stream_arn.split('table/', 1)[1].split('/', 1)[0]
+        table = FakeTable(table_name, stream_arn)
+        thread = threading.Thread(
+            target=process_stream,
+            args=(streams_client, table, BUCKET, f"{table_name.lower()}s", sink),
+            kwargs={'stop_event': stop_event, 'poller_options': poller_options,
+                    'max_workers': args.shards}
+        )
+        thread.start()
+        threads.append(thread)
+
+    start = time.perf_counter()
+    time.sleep(args.duration)
+    stop_event.set()
+    for thread in threads:
+        thread.join()
+    sink.flush()
+    elapsed = time.perf_counter() - start
+
+    lags = delivered_lags(s3_client)
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'config': vars(args),
+        'records': len(lags),
+        'records_per_sec': len(lags) / elapsed,
+        'lag_p50_ms': percentile(lags, 0.50) * 1000,
+        'lag_p99_ms': percentile(lags, 0.99) * 1000,
+        'lag_mean_ms': statistics.mean(lags) * 1000 if lags else 0.0,
+        's3_requests': s3_client.requests,
+        's3_bytes': s3_client.bytes_written,
+        'stream_calls': dict(streams_client.calls)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark process_stream against in-process fakes')
+    parser.add_argument('--shards', type=int, default=4, help='shards per table')
+    parser.add_argument('--rate', type=float, default=200, help='records/sec written per shard')
+    parser.add_argument('--record-size', type=int, default=400)
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds added to stream calls')
+    parser.add_argument('--s3-latency', type=float, default=0.02, help='seconds added to each PUT')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--max-records', type=int, default=5000)
+    parser.add_argument('--max-age', type=float, default=1)
+    parser.add_argument('--stream-uploads', choices=['gzip', 'zstd'],
+                        help='use StreamingS3Writer instead of S3BatchWriter')
+    parser.add_argument('--min-interval', type=float, default=0.5)
+    parser.add_argument('--max-interval', type=float, default=15)
+    parser.add_argument('--results', default='bench_results.jsonl',
+                        help='each run is appended here so regressions show up')
+    args = parser.parse_args()
+
+    result = run(args)
+    print(f"{result['records']} records in {args.duration:.0f}s: "
+          f"{result['records_per_sec']:.0f} records/sec, "
+          f"lag p50 {result['lag_p50_ms']:.0f} ms, p99 {result['lag_p99_ms']:.0f} ms, "
+          f"{result['s3_requests']} S3 requests, "
+          f"{result['stream_calls']['get_records']} get_records calls")
+
+    with open(args.results, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    main()
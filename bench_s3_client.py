@@ -0,0 +1,75 @@
+import argparse
+import statistics
+import time
+
+import boto3
+from botocore.stub import Stubber
+
+import clients
+
+PUT_RESPONSE = {'ETag': '"0123456789abcdef"'}
+
+
+def stub_responses(s3_client, count):
+    """Answer the next count put_object calls locally instead of going to S3"""
+    stubber = Stubber(s3_client)
+    for _ in range(count):
+        stubber.add_response('put_object', PUT_RESPONSE)
+    stubber.activate()
+
+
+def put_record(s3_client, bucket_name, key, body):
+    s3_client.put_object(Bucket=bucket_name, Key=key, Body=body, ContentType='application/json')
+
+
+def client_per_record(bucket_name, records, stub):
+    """What final.py used to do: build a new client for every record"""
+    timings = []
+    for i in range(records):
+        start = time.perf_counter()
+        s3_client = boto3.client('s3')
+        if stub:
+            stub_responses(s3_client, 1)
+        put_record(s3_client, bucket_name, f"bench/{i}.json", b'{}')
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def shared_client(bucket_name, records, stub):
+    """Reuse the pooled client from clients.py"""
+    if stub:
+        stub_responses(clients.get_s3_client(), records)
+    timings = []
+    for i in range(records):
+        start = time.perf_counter()
+        s3_client = clients.get_s3_client()
+        put_record(s3_client, bucket_name, f"bench/{i}.json", b'{}')
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    p99 = timings[int(len(timings) * 0.99) - 1]
+    print(f"{name:>18}: mean {statistics.mean(timings) * 1000:8.3f} ms/record, "
+          f"p50 {statistics.median(timings) * 1000:8.3f} ms, p99 {p99 * 1000:8.3f} ms")
+    return statistics.mean(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-record S3 upload latency, new client vs shared client')
+    parser.add_argument('--records', type=int, default=200)
+    parser.add_argument('--bucket', help='Upload to this bucket instead of a stubbed S3 response')
+    args = parser.parse_args()
+
+    stub = args.bucket is None
+    bucket_name = args.bucket or 'quarkstail-datalake-s3-bucket'
+    print(f"Uploading {args.records} records ({'stubbed' if stub else bucket_name})")
+
+    before = report('client per record', client_per_record(bucket_name, args.records, stub))
+    after = report('shared client', shared_client(bucket_name, args.records, stub))
+    print(f"{'speedup':>18}: {before / after:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
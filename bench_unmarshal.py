@@ -0,0 +1,63 @@
+import argparse
+import random
+import time
+
+from boto3.dynamodb.types import TypeDeserializer
+
+import encoder
+from bench_encoder import typed_order
+from unmarshal import SCHEMAS, Unmarshaller, compile_decoder, generic_value
+
+
+def make_images(count, seed=7):
+    """Typed Order NewImages; the benchmark cycles over these"""
+    rng = random.Random(seed)
+    statuses = ['Pending', 'Shipped', 'Delivered', 'Cancelled']
+    return [typed_order(rng, i, rng.choice(statuses)) for i in range(count)]
+
+
+def measure(name, decode, images, records):
+    start = time.perf_counter()
+    for i in range(records):
+        decode(images[i % len(images)])
+    elapsed = time.perf_counter() - start
+    print(f"{name:>28}: {elapsed:6.2f}s, {elapsed / records * 1e6:6.2f} us/record, "
+          f"{records / elapsed:9.0f} records/sec")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Typed image unmarshalling vs boto3 TypeDeserializer')
+    parser.add_argument('--records', type=int, default=1_000_000)
+    parser.add_argument('--distinct', type=int, default=10_000,
+                        help='distinct images to cycle through, keeps memory flat')
+    args = parser.parse_args()
+
+    images = make_images(args.distinct)
+    deserializer = TypeDeserializer()
+
+    def boto3_image(image):
+        return {name: deserializer.deserialize(value) for name, value in image.items()}
+
+    decimal_decoder = Unmarshaller().decoder('Order')
+    # Both sides must produce the same rows before their speed means anything
+    for image in images:
+        assert decimal_decoder(image) == boto3_image(image)
+
+    print(f"{args.records} Order images ({args.distinct} distinct)")
+    baseline = measure('boto3 TypeDeserializer', boto3_image, images, args.records)
+    timings = [
+        ('generic_value', lambda image: {name: generic_value(value) for name, value in image.items()}),
+        ('encoder.plain_image (JSON)', encoder.plain_image),
+        ('compiled, Decimal', decimal_decoder),
+        ('compiled, native numbers', compile_decoder(SCHEMAS['Order'], 'native')),
+        ('compiled, flattened', compile_decoder(SCHEMAS['Order'], 'native', flatten=True)),
+        ('inferred, Decimal', Unmarshaller(schemas={}).decoder('Order', images[0])),
+    ]
+    for name, decode in timings:
+        elapsed = measure(name, decode, images, args.records)
+        print(f"{'':>28}  {baseline / elapsed:.1f}x TypeDeserializer")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+import convert
+
+# BatchWriteItem accepts at most 25 put/delete requests per call
+BATCH_SIZE = 25
+
+
+def read_items(path):
+    """Stream items from a JSONL file, parsing numbers straight to Decimal"""
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield convert.loads(line)
+
+
+def batches(items, key_names, size=BATCH_SIZE):
+    """Group items into batches, keeping only the last write per key in each batch"""
+    batch = {}
+    for item in items:
+        # BatchWriteItem rejects two writes to the same key in one request
+        batch[tuple(item[name] for name in key_names)] = item
+        if len(batch) == size:
+            yield list(batch.values())
+            batch = {}
+    if batch:
+        yield list(batch.values())
+
+
+def write_batch(dynamodb, table_name, items, max_retries=10, base_delay=0.05, max_delay=5):
+    """Write up to 25 items, retrying UnprocessedItems with backoff; return consumed WCU"""
+    request = {table_name: [{'PutRequest': {'Item': item}} for item in items]}
+    consumed = 0.0
+    attempt = 0
+    while request:
+        response = dynamodb.batch_write_item(
+            RequestItems=request,
+            ReturnConsumedCapacity='TOTAL'
+        )
+        for capacity in response.get('ConsumedCapacity', []):
+            consumed += capacity.get('CapacityUnits', 0)
+
+        request = response.get('UnprocessedItems') or {}
+        if request:
+            if attempt >= max_retries:
+                left = sum(len(writes) for writes in request.values())
+                raise RuntimeError(f"{left} items still unprocessed after {attempt} retries")
+            # Full jitter keeps the workers from retrying in lockstep
+            time.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+            attempt += 1
+    return consumed
+
+
+def bulk_load(dynamodb, table_name, items, workers=8):
+    """Write every item through a thread pool of batch writers and report throughput"""
+    table = dynamodb.Table(table_name)
+    key_names = [key['AttributeName'] for key in table.key_schema]
+
+    # Bound the batches in flight so the file is streamed, not loaded into memory
+    in_flight = threading.BoundedSemaphore(workers * 2)
+    lock = threading.Lock()
+    totals = {'items': 0, 'wcu': 0.0, 'failed': 0}
+
+    def write(batch):
+        try:
+            consumed = write_batch(dynamodb, table_name, batch)
+            with lock:
+                totals['items'] += len(batch)
+                totals['wcu'] += consumed
+        except Exception as e:
+            print(f"Error writing batch to {table_name}: {e}")
+            with lock:
+                totals['failed'] += len(batch)
+        finally:
+            in_flight.release()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch in batches(items, key_names):
+            in_flight.acquire()
+            executor.submit(write, batch)
+    elapsed = time.perf_counter() - start
+
+    rate = totals['items'] / elapsed if elapsed else 0.0
+    print(f"Loaded {totals['items']} items into {table_name} in {elapsed:.1f}s "
+          f"({rate:.0f} items/sec), {totals['wcu']:.0f} WCU consumed, "
+          f"{totals['failed']} items failed")
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk load a JSONL file into a DynamoDB table')
+    parser.add_argument('table_name', help='e.g. Customer or Order')
+    parser.add_argument('path', help='JSONL file with one item per line')
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    dynamodb = boto3.resource('dynamodb')
+    bulk_load(dynamodb, args.table_name, read_items(args.path), workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
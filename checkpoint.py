@@ -0,0 +1,141 @@
+import datetime
+import sqlite3
+import threading
+
+
+def sequence_key(sequence_number):
+    """Sequence numbers are decimal strings longer than a 64-bit int, compare them as ints"""
+    return int(sequence_number)
+
+
+class SQLiteCheckpointStore:
+    """Keep the last durably written SequenceNumber per (stream ARN, shard) in a local SQLite file"""
+
+    def __init__(self, path='checkpoints.db'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS checkpoints (
+                       stream_arn TEXT NOT NULL,
+                       shard_id TEXT NOT NULL,
+                       sequence_number TEXT NOT NULL,
+                       updated_at TEXT NOT NULL,
+                       PRIMARY KEY (stream_arn, shard_id)
+                   )"""
+            )
+
+    def get(self, stream_arn, shard_id):
+        """Return the checkpointed sequence number for a shard, or None"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT sequence_number FROM checkpoints WHERE stream_arn = ? AND shard_id = ?",
+                (stream_arn, shard_id)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_all(self, stream_arn):
+        """Return {shard_id: sequence_number} for every checkpointed shard of a stream"""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT shard_id, sequence_number FROM checkpoints WHERE stream_arn = ?",
+                (stream_arn,)
+            ).fetchall()
+        return dict(rows)
+
+    def save(self, positions):
+        """Write {(stream_arn, shard_id): sequence_number} in a single transaction"""
+        if not positions:
+            return
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        rows = [(stream_arn, shard_id, sequence_number, now)
+                for (stream_arn, shard_id), sequence_number in positions.items()]
+        with self.lock, self.connection:
+            self.connection.executemany(
+                """INSERT INTO checkpoints (stream_arn, shard_id, sequence_number, updated_at)
+                   VALUES (?, ?, ?, ?)
+                   ON CONFLICT (stream_arn, shard_id) DO UPDATE SET
+                       sequence_number = excluded.sequence_number,
+                       updated_at = excluded.updated_at""",
+                rows
+            )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def create_checkpoint_table(dynamodb, table_name='StreamCheckpoints'):
+    """Create the DynamoDB table used by DynamoDBCheckpointStore if it does not exist"""
+    try:
+        table = dynamodb.create_table(
+            TableName=table_name,
+            KeySchema=[
+                {'AttributeName': 'StreamArn', 'KeyType': 'HASH'},
+                {'AttributeName': 'ShardId', 'KeyType': 'RANGE'}
+            ],
+            AttributeDefinitions=[
+                {'AttributeName': 'StreamArn', 'AttributeType': 'S'},
+                {'AttributeName': 'ShardId', 'AttributeType': 'S'}
+            ],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        table.meta.client.get_waiter('table_exists').wait(TableName=table_name)
+    except Exception as e:
+        table = dynamodb.Table(table_name)
+    return table
+
+
+class DynamoDBCheckpointStore:
+    """Keep checkpoints in a DynamoDB table so several hosts can share them"""
+
+    def __init__(self, table):
+        self.table = table
+
+    def get(self, stream_arn, shard_id):
+        response = self.table.get_item(
+            Key={'StreamArn': stream_arn, 'ShardId': shard_id},
+            ConsistentRead=True
+        )
+        item = response.get('Item')
+        return item['SequenceNumber'] if item else None
+
+    def get_all(self, stream_arn):
+        checkpoints = {}
+        kwargs = {
+            'KeyConditionExpression': 'StreamArn = :arn',
+            'ExpressionAttributeValues': {':arn': stream_arn},
+            'ConsistentRead': True
+        }
+        while True:
+            response = self.table.query(**kwargs)
+            for item in response['Items']:
+                checkpoints[item['ShardId']] = item['SequenceNumber']
+            if 'LastEvaluatedKey' not in response:
+                return checkpoints
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def save(self, positions):
+        if not positions:
+            return
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        # batch_writer groups these into 25-item BatchWriteItem calls
+        with self.table.batch_writer() as batch:
+            for (stream_arn, shard_id), sequence_number in positions.items():
+                batch.put_item(Item={
+                    'StreamArn': stream_arn,
+                    'ShardId': shard_id,
+                    'SequenceNumber': sequence_number,
+                    'UpdatedAt': now
+                })
+
+    def close(self):
+        pass
+
+
+def open_checkpoint_store(dynamodb, table_name=None, path='checkpoints.db'):
+    """Checkpoints in DynamoDB table_name (created if needed), or in a local SQLite file without one"""
+    if table_name:
+        return DynamoDBCheckpointStore(create_checkpoint_table(dynamodb, table_name))
+    return SQLiteCheckpointStore(path)
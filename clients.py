@@ -0,0 +1,190 @@
+import io
+import os
+import shutil
+import threading
+import uuid
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+# Sized for a worker per shard plus the sink flushing in parallel
+S3_CONFIG = Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    connect_timeout=5,
+    read_timeout=30,
+    retries={'max_attempts': 5, 'mode': 'adaptive'}
+)
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_client(service_name, config=None, **kwargs):
+    """Return a client shared by every thread, creating it on first use"""
+    key = (service_name, tuple(sorted(kwargs.items())))
+    client = _clients.get(key)
+    if client is None:
+        # The default boto3 session is not thread-safe, so build clients one at a time
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = boto3.client(service_name, config=config, **kwargs)
+    return client
+
+
+def get_s3_client(**kwargs):
+    """Return the shared, connection-pooled S3 client
+
+    Setting DATALAKE_LOCAL_DIR swaps S3 for a LocalS3Client rooted there.
+    """
+    local_dir = os.environ.get('DATALAKE_LOCAL_DIR')
+    if local_dir:
+        return LocalS3Client(local_dir)
+    return get_client('s3', config=S3_CONFIG, **kwargs)
+
+
+class _Paginator:
+    def __init__(self, method):
+        self.method = method
+
+    def paginate(self, **kwargs):
+        while True:
+            page = self.method(**kwargs)
+            yield page
+            if not page.get('IsTruncated'):
+                return
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+
+class LocalS3Client:
+    """A stand-in for the parts of the S3 client the lake uses, backed by a local directory
+
+    Objects live at root/bucket/key, so the same code paths can be run and
+    inspected without AWS.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def _missing(self, operation, key):
+        return ClientError(
+            {'Error': {'Code': 'NoSuchKey', 'Message': f"{key} does not exist"}},
+            operation
+        )
+
+    def put_object(self, Bucket, Key, Body=b'', **kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        elif hasattr(Body, 'read'):
+            Body = Body.read()
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so readers never see a partial object
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(Body)
+        os.replace(temp_path, path)
+        return {'ETag': f'"{len(Body):x}"'}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise self._missing('GetObject', Key)
+        with open(path, 'rb') as f:
+            if Range:
+                # Only the bytes=start-end form is supported
+                start, _, end = Range.split('=', 1)[1].partition('-')
+                f.seek(int(start))
+                data = f.read(int(end) - int(start) + 1) if end else f.read()
+            else:
+                data = f.read()
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data)}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise self._missing('HeadObject', Key)
+        return {'ContentLength': os.path.getsize(path)}
+
+    def list_objects_v2(self, Bucket, Prefix='', ContinuationToken=None, StartAfter=None,
+                        MaxKeys=1000, **kwargs):
+        bucket_root = os.path.join(self.root, Bucket)
+        keys = []
+        for directory, _, files in os.walk(bucket_root):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                key = os.path.relpath(os.path.join(directory, name), bucket_root)
+                key = key.replace(os.sep, '/')
+                if key.startswith(Prefix):
+                    keys.append(key)
+        keys.sort()
+
+        after = ContinuationToken or StartAfter
+        if after:
+            keys = [key for key in keys if key > after]
+        page = keys[:MaxKeys]
+        response = {
+            'KeyCount': len(page),
+            'Contents': [{'Key': key, 'Size': os.path.getsize(self._path(Bucket, key))}
+                         for key in page],
+            'IsTruncated': len(keys) > MaxKeys
+        }
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        try:
+            os.remove(self._path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        for obj in Delete['Objects']:
+            self.delete_object(Bucket, obj['Key'])
+        return {'Deleted': [{'Key': obj['Key']} for obj in Delete['Objects']]}
+
+    def _parts_dir(self, upload_id):
+        # Outside every bucket directory so listings never see parts
+        return os.path.join(self.root, '.multipart', upload_id)
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._parts_dir(upload_id))
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body=b'', **kwargs):
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        with open(os.path.join(self._parts_dir(UploadId), f"{PartNumber:05d}"), 'wb') as f:
+            f.write(Body)
+        return {'ETag': f'"{PartNumber}-{len(Body):x}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        parts_dir = self._parts_dir(UploadId)
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            for part in sorted(MultipartUpload['Parts'], key=lambda part: part['PartNumber']):
+                with open(os.path.join(parts_dir, f"{part['PartNumber']:05d}"), 'rb') as part_file:
+                    shutil.copyfileobj(part_file, f)
+        os.replace(temp_path, path)
+        shutil.rmtree(parts_dir, ignore_errors=True)
+        return {'Bucket': Bucket, 'Key': Key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        shutil.rmtree(self._parts_dir(UploadId), ignore_errors=True)
+        return {}
+
+    def get_paginator(self, operation_name):
+        if operation_name != 'list_objects_v2':
+            raise NotImplementedError(operation_name)
+        return _Paginator(self.list_objects_v2)
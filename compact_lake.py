@@ -0,0 +1,286 @@
+import argparse
+import datetime
+import hashlib
+import io
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from checkpoint import sequence_key
+from clients import get_s3_client
+from lake_index import LakeIndex, index_key
+from metrics import BYTES_WRITTEN, RECORDS_WRITTEN
+from multipart import CODECS
+from registry import DEFAULTS
+from sink import PARTITION_SCHEMES, NdjsonFormat, event_time, make_record_format
+
+# eventIDs are hex, so listing one sub-prefix per digit splits a prefix evenly
+HEX_DIGITS = '0123456789abcdef'
+MANIFEST_DIR = '_compaction'
+DELETE_BATCH = 1000
+
+
+def is_event_object(key, prefix):
+    """True for the prefix/{eventID}.json objects script.py and the old final.py wrote"""
+    name = key[len(prefix) + 1:]
+    return key.startswith(f"{prefix}/") and '/' not in name and name.endswith('.json')
+
+
+def list_keys(s3_client, bucket_name, prefix, workers=16):
+    """List every per-event object under a prefix, paginating one sub-prefix per hex digit in parallel"""
+    def list_part(digit):
+        keys = []
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{prefix}/{digit}"):
+            keys.extend(obj['Key'] for obj in page.get('Contents', [])
+                        if is_event_object(obj['Key'], prefix))
+        return keys
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        parts = list(executor.map(list_part, HEX_DIGITS))
+    return sorted(key for keys in parts for key in keys)
+
+
+def fetch_record(s3_client, bucket_name, key):
+    """Return the stream record stored at key, or None if it is gone already"""
+    try:
+        body = s3_client.get_object(Bucket=bucket_name, Key=key)['Body'].read()
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return None
+        raise
+    record = json.loads(body)
+    stream = record.get('dynamodb', {})
+    created = stream.get('ApproximateCreationDateTime')
+    # DecimalEncoder wrote the datetime as an ISO string
+    if isinstance(created, str):
+        stream['ApproximateCreationDateTime'] = datetime.datetime.fromisoformat(created)
+    return record
+
+
+def sort_key(record):
+    stream = record['dynamodb']
+    return event_time(record), sequence_key(stream.get('SequenceNumber', '0'))
+
+
+class Compactor:
+    """Merge a prefix's per-event JSON objects into sorted, compressed files per time partition
+
+    Keys are compacted chunk_size at a time in key order. Each chunk is
+    tracked by a manifest under prefix/_compaction/ that moves from pending
+    (outputs being written) to verified (outputs read back and checked,
+    originals being deleted) to done. An interrupted run is picked up from
+    the manifests: pending outputs are removed and the chunk redone, and
+    verified chunks finish deleting their originals, so every event ends up
+    in exactly one merged file. With an indexer every merged file gets a
+    lake index entry, written before the originals go.
+    """
+
+    def __init__(self, s3_client, bucket_name, prefix, format_name='ndjson', compression='gzip',
+                 partition='hour', chunk_size=50000, fetch_workers=32, list_workers=16,
+                 indexer=None):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix.rstrip('/')
+        self.format_name = format_name
+        record_format = make_record_format(format_name)
+        if not hasattr(record_format, 'encode_record'):
+            record_format = NdjsonFormat(record_format)
+        self.format = record_format
+        # Parquet compresses its own pages
+        self.codec = CODECS['none' if format_name == 'parquet' else compression]
+        self.extension = record_format.extension + self.codec.extension
+        self.partition = partition
+        self.chunk_size = chunk_size
+        self.fetch_workers = fetch_workers
+        self.list_workers = list_workers
+        self.indexer = indexer
+
+    def manifest_key(self, chunk_id):
+        return f"{self.prefix}/{MANIFEST_DIR}/{chunk_id}.json"
+
+    def save_manifest(self, manifest):
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=self.manifest_key(manifest['chunk_id']),
+                                  Body=json.dumps(manifest, indent=2), ContentType='application/json')
+
+    def load_manifests(self):
+        manifests = []
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=f"{self.prefix}/{MANIFEST_DIR}/"):
+            for obj in page.get('Contents', []):
+                body = self.s3_client.get_object(Bucket=self.bucket_name, Key=obj['Key'])['Body'].read()
+                manifests.append(json.loads(body))
+        return manifests
+
+    def delete_keys(self, keys):
+        batches = [keys[i:i + DELETE_BATCH] for i in range(0, len(keys), DELETE_BATCH)]
+
+        def delete_batch(batch):
+            response = self.s3_client.delete_objects(
+                Bucket=self.bucket_name, Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True})
+            errors = response.get('Errors', [])
+            if errors:
+                raise RuntimeError(f"Could not delete {len(errors)} objects, first: {errors[0]}")
+
+        with ThreadPoolExecutor(max_workers=min(8, len(batches)) or 1) as executor:
+            list(executor.map(delete_batch, batches))
+
+    def recover(self):
+        """Finish or roll back chunks an earlier run left behind"""
+        for manifest in self.load_manifests():
+            if manifest['status'] == 'pending':
+                print(f"Rolling back unfinished chunk {manifest['chunk_id']}")
+                self.delete_keys([key for output in manifest['outputs']
+                                  for key in (output['key'], index_key(self.prefix, output['key']))])
+                self.s3_client.delete_object(Bucket=self.bucket_name,
+                                             Key=self.manifest_key(manifest['chunk_id']))
+            elif manifest['status'] == 'verified':
+                print(f"Finishing deletes for chunk {manifest['chunk_id']}")
+                self.finish(manifest)
+
+    def encode(self, records):
+        """Return the compressed body of one output file"""
+        body = self.format.build([self.format.encode_record(record)[0] for record in records])
+        codec = self.codec()
+        return codec.compress(body) + codec.flush()
+
+    def count_records(self, body):
+        """Count the records in an output body, to check it round-trips"""
+        if self.format_name == 'parquet':
+            import pyarrow.parquet as pq
+            return pq.read_metadata(io.BytesIO(body)).num_rows
+        if self.codec is CODECS['gzip']:
+            import gzip
+            body = gzip.decompress(body)
+        elif self.codec is CODECS['zstd']:
+            import zstandard
+            body = zstandard.ZstdDecompressor().decompressobj().decompress(body)
+        return body.count(b'\n')
+
+    def output_key(self, timestamp, chunk_id):
+        # Named after the chunk, so redoing it overwrites instead of duplicating
+        return (f"{self.prefix}/{timestamp.strftime(PARTITION_SCHEMES[self.partition])}"
+                f"{timestamp:%Y%m%dT%H%M%S}-{chunk_id}{self.extension}")
+
+    def compact_chunk(self, keys, executor):
+        records = list(executor.map(lambda key: fetch_record(self.s3_client, self.bucket_name, key), keys))
+        sources = [key for key, record in zip(keys, records) if record is not None]
+        records = sorted((record for record in records if record is not None), key=sort_key)
+        if not records:
+            return 0
+        chunk_id = hashlib.sha1('\n'.join(sources).encode('utf-8')).hexdigest()[:16]
+
+        partitions = {}
+        for record in records:
+            timestamp = event_time(record)
+            partition = timestamp.strftime(PARTITION_SCHEMES[self.partition])
+            partitions.setdefault(partition, []).append(record)
+
+        outputs = []
+        bodies = []
+        groups = list(partitions.values())
+        for partition_records in groups:
+            body = self.encode(partition_records)
+            sequence_numbers = [record['dynamodb'].get('SequenceNumber', '0') for record in partition_records]
+            outputs.append({
+                'key': self.output_key(event_time(partition_records[0]), chunk_id),
+                'records': len(partition_records),
+                'bytes': len(body),
+                'md5': hashlib.md5(body).hexdigest(),
+                'first_event_time': event_time(partition_records[0]).isoformat(),
+                'last_event_time': event_time(partition_records[-1]).isoformat(),
+                'min_sequence_number': min(sequence_numbers, key=sequence_key),
+                'max_sequence_number': max(sequence_numbers, key=sequence_key)
+            })
+            bodies.append(body)
+
+        manifest = {
+            'chunk_id': chunk_id,
+            'status': 'pending',
+            'bucket_name': self.bucket_name,
+            'prefix': self.prefix,
+            'format': self.format_name,
+            'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'records': len(records),
+            'sources': sources,
+            'outputs': outputs
+        }
+        self.save_manifest(manifest)
+
+        def upload(output, body, partition_records):
+            self.s3_client.put_object(Bucket=self.bucket_name, Key=output['key'], Body=body,
+                                      ContentType=self.format.content_type)
+            self.verify(output)
+            if self.indexer:
+                self.indexer.write(self.bucket_name, self.prefix, output['key'], output['records'],
+                                   output['bytes'], self.indexer.stats(*partition_records))
+
+        list(executor.map(upload, outputs, bodies, groups))
+        manifest['status'] = 'verified'
+        self.save_manifest(manifest)
+        self.finish(manifest)
+
+        for output in outputs:
+            RECORDS_WRITTEN.inc(output['records'], prefix=self.prefix)
+            BYTES_WRITTEN.inc(output['bytes'], prefix=self.prefix)
+        print(f"Compacted {len(sources)} objects into {len(outputs)} files (chunk {chunk_id})")
+        return len(sources)
+
+    def verify(self, output):
+        """Read an output back and check it holds exactly what was written"""
+        body = self.s3_client.get_object(Bucket=self.bucket_name, Key=output['key'])['Body'].read()
+        if hashlib.md5(body).hexdigest() != output['md5']:
+            raise RuntimeError(f"{output['key']} does not match what was uploaded")
+        count = self.count_records(body)
+        if count != output['records']:
+            raise RuntimeError(f"{output['key']} holds {count} records, expected {output['records']}")
+
+    def finish(self, manifest):
+        self.delete_keys(manifest['sources'])
+        manifest['status'] = 'done'
+        manifest['finished_at'] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        self.save_manifest(manifest)
+
+    def run(self):
+        """Compact everything under the prefix; returns the number of objects merged"""
+        start = time.perf_counter()
+        self.recover()
+        keys = list_keys(self.s3_client, self.bucket_name, self.prefix, self.list_workers)
+        print(f"Found {len(keys)} objects under {self.bucket_name}/{self.prefix}/")
+
+        compacted = 0
+        with ThreadPoolExecutor(max_workers=self.fetch_workers) as executor:
+            for i in range(0, len(keys), self.chunk_size):
+                compacted += self.compact_chunk(keys[i:i + self.chunk_size], executor)
+
+        elapsed = time.perf_counter() - start
+        print(f"Compacted {compacted} objects under {self.prefix}/ in {elapsed:.1f}s")
+        return compacted
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge per-event JSON objects into partitioned files')
+    parser.add_argument('prefix', help='e.g. customers or orders')
+    parser.add_argument('--bucket', default=DEFAULTS['bucket_name'])
+    parser.add_argument('--format', default='ndjson', choices=['ndjson', 'parquet'])
+    parser.add_argument('--compression', default='gzip', choices=sorted(CODECS),
+                        help='for NDJSON; Parquet uses its own compression')
+    parser.add_argument('--partition', default='hour', choices=sorted(PARTITION_SCHEMES))
+    parser.add_argument('--chunk-size', type=int, default=50000,
+                        help='objects merged per pass, bounds memory')
+    parser.add_argument('--fetch-workers', type=int, default=32)
+    parser.add_argument('--no-index', action='store_true',
+                        help="don't write lake index entries for the merged files")
+    args = parser.parse_args()
+
+    s3_client = get_s3_client()
+    compactor = Compactor(s3_client, args.bucket, args.prefix, args.format, args.compression,
+                          args.partition, args.chunk_size, args.fetch_workers,
+                          indexer=None if args.no_index else LakeIndex(s3_client))
+    compactor.run()
+
+
+if __name__ == '__main__':
+    main()
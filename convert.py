@@ -0,0 +1,102 @@
+import json
+from decimal import Decimal
+
+# What we do with a value of a given type, resolved once per type
+_SCALAR, _FLOAT, _DICT, _LIST, _TUPLE, _SET = range(6)
+
+_kinds = {
+    float: _FLOAT,
+    dict: _DICT,
+    list: _LIST,
+    tuple: _TUPLE,
+    set: _SET,
+    str: _SCALAR,
+    int: _SCALAR,
+    bool: _SCALAR,
+    bytes: _SCALAR,
+    Decimal: _SCALAR,
+    type(None): _SCALAR,
+}
+
+
+def _kind(cls):
+    kind = _kinds.get(cls)
+    if kind is None:
+        # Subclasses (OrderedDict, numpy floats, ...) are classified once and cached
+        for base, base_kind in ((float, _FLOAT), (dict, _DICT), (list, _LIST),
+                                (tuple, _TUPLE), (set, _SET)):
+            if issubclass(cls, base):
+                kind = base_kind
+                break
+        else:
+            kind = _SCALAR
+        _kinds[cls] = kind
+    return kind
+
+
+def _children(node, kind):
+    if kind == _DICT:
+        return iter(node.items())
+    if kind == _SET:
+        return ((value, value) for value in node)
+    return enumerate(node)
+
+
+def _rebuild(node, kind, changes):
+    if kind == _DICT:
+        copy = dict(node)
+        copy.update(changes)
+        return copy
+    if kind == _SET:
+        return {changes.get(value, value) for value in node}
+    copy = list(node)
+    for index, value in changes.items():
+        copy[index] = value
+    return copy if kind == _LIST else tuple(copy)
+
+
+def floats_to_decimals(obj):
+    """Return obj with every float replaced by a Decimal
+
+    Containers without floats are returned as-is rather than copied, and the
+    walk uses an explicit stack so deeply nested items can't hit the recursion
+    limit.
+    """
+    kind = _kind(type(obj))
+    if kind == _FLOAT:
+        return Decimal(str(obj))
+    if kind == _SCALAR:
+        return obj
+
+    # Frame: [node, kind, child iterator, changes or None, key in parent]
+    stack = [[obj, kind, _children(obj, kind), None, None]]
+    while True:
+        frame = stack[-1]
+        for key, value in frame[2]:
+            kind = _kinds.get(type(value))
+            if kind is None:
+                kind = _kind(type(value))
+            if kind == _SCALAR:
+                continue
+            if kind == _FLOAT:
+                if frame[3] is None:
+                    frame[3] = {}
+                frame[3][key] = Decimal(str(value))
+                continue
+            stack.append([value, kind, _children(value, kind), None, key])
+            break
+        else:
+            node, kind, _, changes, key = stack.pop()
+            result = node if changes is None else _rebuild(node, kind, changes)
+            if not stack:
+                return result
+            if result is not node:
+                parent = stack[-1]
+                if parent[3] is None:
+                    parent[3] = {}
+                parent[3][key] = result
+
+
+def loads(text):
+    """Parse JSON straight to Decimal so no float objects are ever built"""
+    return json.loads(text, parse_float=Decimal)
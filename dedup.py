@@ -0,0 +1,168 @@
+import collections
+import sqlite3
+import threading
+import time
+
+from cache import LRUCache
+from metrics import REGISTRY
+
+DEDUP_LOOKUPS = REGISTRY.counter(
+    'datalake_dedup_lookups_total',
+    'Stream records checked for replays, by result (hit/miss) and where a hit was found',
+    ('result', 'tier'))
+
+# Records older than the stream's 24 hour retention can never be replayed
+DEFAULT_RETENTION = 24 * 60 * 60
+# Zero-padded so SQLite compares sequence numbers as text in numeric order
+SEQUENCE_WIDTH = 40
+
+
+def record_key(record):
+    """Return the dedup key of a stream record; SequenceNumber is as unique per shard as eventID"""
+    return record['dynamodb']['SequenceNumber'].zfill(SEQUENCE_WIDTH)
+
+
+class Deduplicator:
+    """Drop stream records that were already handed to the sink
+
+    Keys are (stream_arn, shard_id, sequence number). filter() only looks
+    keys up; they are remembered through accepted() once the sink has taken
+    the records, so a page the sink rejects is let through again when it is
+    retried. Recently accepted keys live in an LRU/TTL cache; keys whose
+    records have reached S3 are also written to a SQLite file so replays
+    after a restart (e.g. from TRIM_HORIZON) are caught too. Nothing goes to
+    disk before the sink reports a successful upload through committed(), so
+    a crash can only cause a duplicate, never a lost record.
+    """
+
+    def __init__(self, path='dedup.db', max_entries=200000, ttl=3600,
+                 retention=DEFAULT_RETENTION):
+        self.cache = LRUCache(max_entries, ttl)
+        self.retention = retention
+        self.lock = threading.Lock()
+        self.pending = collections.defaultdict(collections.deque)   # (arn, shard) -> keys not in S3 yet
+        self.high_water = {}     # (arn, shard) -> highest key on disk, None when the shard has none
+        self.hits = 0
+        self.misses = 0
+        self.last_pruned = 0.0
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS seen (
+                       stream_arn TEXT NOT NULL,
+                       shard_id TEXT NOT NULL,
+                       record_key TEXT NOT NULL,
+                       seen_at REAL NOT NULL,
+                       PRIMARY KEY (stream_arn, shard_id, record_key)
+                   ) WITHOUT ROWID"""
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS seen_at ON seen (seen_at)")
+
+    def _high_water(self, shard):
+        # Called with self.lock held
+        if shard not in self.high_water:
+            row = self.connection.execute(
+                "SELECT MAX(record_key) FROM seen WHERE stream_arn = ? AND shard_id = ?", shard
+            ).fetchone()
+            self.high_water[shard] = row[0]
+        return self.high_water[shard]
+
+    def _on_disk(self, shard, keys):
+        # Called with self.lock held; pages past everything stored skip the query
+        high_water = self._high_water(shard)
+        if high_water is None:
+            return set()
+        keys = [key for key in keys if key <= high_water]
+        found = set()
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.connection.execute(
+                f"SELECT record_key FROM seen WHERE stream_arn = ? AND shard_id = ? "
+                f"AND record_key IN ({','.join('?' * len(chunk))})",
+                shard + tuple(chunk)
+            ).fetchall()
+            found.update(row[0] for row in rows)
+        return found
+
+    def filter(self, stream_arn, shard_id, records):
+        """Return the records of a page that have not been seen before, in order"""
+        if not records:
+            return records
+        shard = (stream_arn, shard_id)
+        keys = [record_key(record) for record in records]
+        cached = [(shard, key) in self.cache for key in keys]
+
+        with self.lock:
+            on_disk = self._on_disk(shard, [key for key, hit in zip(keys, cached) if not hit])
+            fresh = []
+            memory_hits = disk_hits = 0
+            for record, key, hit in zip(records, keys, cached):
+                if hit:
+                    memory_hits += 1
+                elif key in on_disk:
+                    disk_hits += 1
+                else:
+                    fresh.append(record)
+            self.hits += memory_hits + disk_hits
+            self.misses += len(fresh)
+
+        if memory_hits:
+            DEDUP_LOOKUPS.inc(memory_hits, result='hit', tier='memory')
+        if disk_hits:
+            DEDUP_LOOKUPS.inc(disk_hits, result='hit', tier='disk')
+        if fresh:
+            DEDUP_LOOKUPS.inc(len(fresh), result='miss', tier='')
+        return fresh
+
+    def accepted(self, stream_arn, shard_id, records):
+        """Remember the keys of records the sink has buffered, so replays of them are dropped"""
+        if not records:
+            return
+        shard = (stream_arn, shard_id)
+        with self.lock:
+            pending = self.pending[shard]
+            for record in records:
+                key = record_key(record)
+                # Keep pending in sequence order for committed()
+                if not pending or key > pending[-1]:
+                    pending.append(key)
+                self.cache.put((shard, key))
+
+    def committed(self, positions):
+        """Persist every key up to the written position of each shard; pass as the sink's on_flush"""
+        now = time.time()
+        rows = []
+        with self.lock:
+            for shard, sequence_number in positions.items():
+                last = sequence_number.zfill(SEQUENCE_WIDTH)
+                pending = self.pending.get(shard)
+                # A shard's records are buffered, and so flushed, in sequence order
+                written = False
+                while pending and pending[0] <= last:
+                    rows.append(shard + (pending.popleft(), now))
+                    written = True
+                if written and last > (self._high_water(shard) or ''):
+                    self.high_water[shard] = last
+            if not rows:
+                return
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO seen (stream_arn, shard_id, record_key, seen_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                if now - self.last_pruned >= 3600:
+                    self.connection.execute("DELETE FROM seen WHERE seen_at < ?",
+                                            (now - self.retention,))
+                    self.last_pruned = now
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        print(f"Dedup: {self.hits} replayed records dropped, {self.misses} passed "
+              f"({rate:.1f}% hit rate)")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,166 @@
+import base64
+import datetime
+import json
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib encoder is used without it
+    orjson = None
+
+IMAGE_FIELDS = ('Keys', 'NewImage', 'OldImage')
+# Integers orjson can write; anything else stays a Decimal
+INT64_RANGE = range(-2 ** 63, 2 ** 64)
+
+
+def json_default(obj):
+    """default= hook for json.dumps: Decimals, datetimes, bytes and sets as plain JSON values"""
+    # In the record encoders, only reached for values we did not expect in a stream record
+    if isinstance(obj, Decimal):
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, (bytes, bytearray)):
+        return base64.b64encode(obj).decode('ascii')
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class _Inexact(Exception):
+    """A Decimal reached a fast encoder, which can only write it approximately"""
+
+
+def _fast_default(obj):
+    if isinstance(obj, Decimal):
+        raise _Inexact
+    return json_default(obj)
+
+
+def exact_json(value):
+    """Compact JSON text like json.dumps, with Decimals written digit for digit"""
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, dict):
+        return '{' + ','.join(json.dumps(str(key)) + ':' + exact_json(item)
+                              for key, item in value.items()) + '}'
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return '[' + ','.join(exact_json(item) for item in value) + ']'
+    return json.dumps(value, default=json_default)
+
+
+def _number(text):
+    """An int or float when it holds the number exactly, else a Decimal"""
+    if '.' in text or 'e' in text or 'E' in text:
+        # Up to 15 significant digits survive a float; exponents may be out of its range
+        if len(text) <= 15 and 'e' not in text and 'E' not in text:
+            return float(text)
+        return Decimal(text)
+    value = int(text)
+    return value if value in INT64_RANGE else Decimal(text)
+
+
+def plain_value(typed):
+    """Turn a DynamoDB typed value such as {'N': '30'} into a plain JSON value"""
+    (tag, value), = typed.items()
+    if tag == 'S':
+        return value
+    if tag == 'N':
+        return _number(value)
+    if tag == 'M':
+        return {name: plain_value(item) for name, item in value.items()}
+    if tag == 'L':
+        return [plain_value(item) for item in value]
+    if tag == 'BOOL':
+        return value
+    if tag == 'NULL':
+        return None
+    if tag == 'SS':
+        return list(value)
+    if tag == 'NS':
+        return [_number(item) for item in value]
+    if tag == 'B':
+        return base64.b64encode(value).decode('ascii') if isinstance(value, bytes) else value
+    if tag == 'BS':
+        return [base64.b64encode(item).decode('ascii') if isinstance(item, bytes) else item
+                for item in value]
+    raise ValueError(f"Unknown DynamoDB type {tag}")
+
+
+def plain_image(image):
+    """Unmarshal a whole NewImage/OldImage/Keys map"""
+    return {name: plain_value(value) for name, value in image.items()}
+
+
+class RecordEncoder:
+    """Serialize stream records to compact, single-line JSON bytes
+
+    The only non-JSON value in a record from get_records is
+    ApproximateCreationDateTime, so it is converted up front instead of going
+    through a default() hook for every object. With unmarshal=True the typed
+    Keys/NewImage/OldImage maps are turned into plain values in the same pass.
+
+    Numbers a float or 64-bit int can't hold come out of plain_value as
+    Decimals; records holding one are written by exact_json instead, so the
+    lake gets the same digits DynamoDB had.
+    """
+
+    name = 'compact'
+
+    def __init__(self, unmarshal=False, image_decoder=None):
+        self.unmarshal = unmarshal
+        self.image_decoder = image_decoder or plain_image
+
+    def prepare(self, record):
+        """Return a shallow copy of the record that json can encode directly"""
+        stream = record.get('dynamodb')
+        if stream is None:
+            return record
+        stream = dict(stream)
+        created = stream.get('ApproximateCreationDateTime')
+        if isinstance(created, datetime.datetime):
+            stream['ApproximateCreationDateTime'] = created.isoformat()
+        if self.unmarshal:
+            for field in IMAGE_FIELDS:
+                if field in stream:
+                    stream[field] = self.image_decoder(stream[field])
+        record = dict(record)
+        record['dynamodb'] = stream
+        return record
+
+    def encode(self, record):
+        record = self.prepare(record)
+        try:
+            return json.dumps(record, separators=(',', ':'), default=_fast_default).encode('utf-8')
+        except _Inexact:
+            return exact_json(record).encode('utf-8')
+
+    def __call__(self, record):
+        return self.encode(record)
+
+
+class OrjsonRecordEncoder(RecordEncoder):
+    """Same output as RecordEncoder, serialized by orjson"""
+
+    name = 'orjson'
+
+    def encode(self, record):
+        record = self.prepare(record)
+        try:
+            return orjson.dumps(record, default=_fast_default)
+        except TypeError:
+            # A Decimal, or an int past 64 bits from a custom image_decoder
+            return exact_json(record).encode('utf-8')
+
+
+def get_encoder(backend='auto', unmarshal=False, image_decoder=None):
+    """Return a record encoder; 'auto' uses orjson when it is installed"""
+    if backend == 'auto':
+        backend = 'orjson' if orjson is not None else 'compact'
+    if backend == 'orjson':
+        if orjson is None:
+            raise ImportError("orjson is not installed, use backend='compact'")
+        return OrjsonRecordEncoder(unmarshal, image_decoder)
+    if backend == 'compact':
+        return RecordEncoder(unmarshal, image_decoder)
+    raise ValueError(f"Unknown encoder backend {backend}")
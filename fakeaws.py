@@ -0,0 +1,322 @@
+import datetime
+import io
+import random
+import threading
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+# Sequence numbers are 21+ digit strings in DynamoDB Streams
+SEQUENCE_BASE = 100000000000000000000
+
+
+def _error(code, operation, message=''):
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+
+def synthetic_image(table_name, rng, index, record_size):
+    """A typed NewImage shaped like insert.py's Customer/Order items"""
+    if table_name == 'Order':
+        items = [
+            {'M': {'ItemID': {'S': f"ITEM{rng.randint(1, 999):03d}"},
+                   'Quantity': {'N': str(rng.randint(1, 5))},
+                   'Price': {'N': f"{rng.uniform(5, 200):.2f}"}}}
+            for _ in range(rng.randint(1, 4))
+        ]
+        image = {
+            'OrderId': {'S': f"ORD{index:08d}"},
+            'CustomerId': {'S': f"CUST{rng.randint(1, 99999):05d}"},
+            'OrderDate': {'S': '2024-11-28T14:30:00Z'},
+            'OrderTotal': {'N': f"{rng.uniform(10, 900):.2f}"},
+            'OrderStatus': {'S': rng.choice(['Pending', 'Shipped', 'Delivered', 'Cancelled'])},
+            'Items': {'L': items}
+        }
+        keys = {'OrderId': image['OrderId'], 'CustomerId': image['CustomerId']}
+    else:
+        image = {
+            'CustomerId': {'S': f"CUST{index:08d}"},
+            'Name': {'S': 'Jane Doe'},
+            'Email': {'S': 'jane.doe@example.com'},
+            'Phone': {'S': '+1234567890'},
+            'Address': {'M': {'Street': {'S': '123 Main St'}, 'City': {'S': 'Springfield'},
+                              'State': {'S': 'IL'}, 'ZIP': {'S': '62704'}}},
+            'IsPrimeMember': {'BOOL': rng.random() < 0.5}
+        }
+        keys = {'CustomerId': image['CustomerId']}
+
+    # Pad up to the requested record size
+    padding = record_size - 300
+    if padding > 0:
+        image['Notes'] = {'S': 'x' * padding}
+    return keys, image
+
+
+class _FakeShard:
+    def __init__(self, table_name, shard_id, parent_id, rate, record_size, seed):
+        self.table_name = table_name
+        self.shard_id = shard_id
+        self.parent_id = parent_id
+        self.rate = rate
+        self.record_size = record_size
+        self.rng = random.Random(seed)
+        self.records = []
+        self.started = time.time()
+        self.base = SEQUENCE_BASE + seed * 10 ** 9
+        self.closed_at = None    # record count once the shard is closed
+
+    def produce(self, now):
+        """Append the records that have been 'written' by now"""
+        due = int((now - self.started) * self.rate)
+        if self.closed_at is not None:
+            due = min(due, self.closed_at)
+        while len(self.records) < due:
+            index = len(self.records)
+            created = self.started + index / self.rate
+            keys, image = synthetic_image(self.table_name, self.rng, index, self.record_size)
+            self.records.append({
+                'eventID': f"{self.rng.getrandbits(128):032x}",
+                'eventName': 'INSERT',
+                'eventVersion': '1.1',
+                'eventSource': 'aws:dynamodb',
+                'awsRegion': 'ap-south-1',
+                'eventSourceARN': f"arn:aws:dynamodb:ap-south-1:000000000000:table/{self.table_name}/stream/fake",
+                'dynamodb': {
+                    'ApproximateCreationDateTime': datetime.datetime.fromtimestamp(
+                        created, datetime.timezone.utc),
+                    'Keys': keys,
+                    'NewImage': image,
+                    'SequenceNumber': str(self.base + index),
+                    'SizeBytes': self.record_size,
+                    'StreamViewType': 'NEW_AND_OLD_IMAGES'
+                }
+            })
+
+    def index_after(self, sequence_number):
+        return int(sequence_number) - self.base + 1
+
+    def sequence_range(self):
+        sequence_range = {'StartingSequenceNumber': str(self.base)}
+        if self.closed_at is not None:
+            sequence_range['EndingSequenceNumber'] = str(self.base + max(self.closed_at - 1, 0))
+        return sequence_range
+
+
+class FakeStreamsClient:
+    """In-process stand-in for the dynamodbstreams client
+
+    Every table gets shard_count open shards that produce synthetic
+    Customer/Order INSERT records at rate records/sec each. latency seconds
+    are added to every call to mimic the network, and fail() makes the next
+    calls of an operation raise.
+    """
+
+    def __init__(self, tables=('Customer', 'Order'), shard_count=2, rate=100,
+                 record_size=400, latency=0.0, page_size=100):
+        self.latency = latency
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        self.calls = {'describe_stream': 0, 'get_shard_iterator': 0, 'get_records': 0}
+        self.failures = {}    # operation -> error codes its next calls raise
+        self.streams = {}
+        self.seed = seed = 0
+        for table_name in tables:
+            stream_arn = f"arn:aws:dynamodb:ap-south-1:000000000000:table/{table_name}/stream/fake"
+            shards = []
+            for i in range(shard_count):
+                seed += 1
+                shards.append(_FakeShard(table_name, f"shardId-{table_name}-{i:04d}", None,
+                                         rate, record_size, seed))
+            self.streams[stream_arn] = shards
+        self.seed = seed
+
+    def split(self, stream_arn, shard_id, children=1):
+        """Close a shard where it is now and open children that carry on after it
+
+        Returns the new shard ids, as a real stream does when it rolls a shard over.
+        """
+        shards = self.streams[stream_arn]
+        with self.lock:
+            parent = self._shard(stream_arn, shard_id)
+            parent.produce(time.time())
+            parent.closed_at = len(parent.records)
+            added = []
+            for i in range(children):
+                self.seed += 1
+                child = _FakeShard(parent.table_name, f"{shard_id}-{i}", shard_id, parent.rate,
+                                   parent.record_size, self.seed)
+                shards.append(child)
+                added.append(child.shard_id)
+        return added
+
+    def fail(self, name, *codes):
+        """Have the next calls of operation name raise ClientErrors with these codes, in order"""
+        with self.lock:
+            self.failures.setdefault(name, []).extend(codes)
+
+    def _call(self, name):
+        with self.lock:
+            self.calls[name] += 1
+            codes = self.failures.get(name)
+            code = codes.pop(0) if codes else None
+        if code:
+            operation = ''.join(part.title() for part in name.split('_'))
+            raise _error(code, operation)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _shard(self, stream_arn, shard_id):
+        for shard in self.streams.get(stream_arn, []):
+            if shard.shard_id == shard_id:
+                return shard
+        raise _error('ResourceNotFoundException', 'GetShardIterator', shard_id)
+
+    def describe_stream(self, StreamArn, ExclusiveStartShardId=None, Limit=None):
+        self._call('describe_stream')
+        shards = self.streams.get(StreamArn)
+        if shards is None:
+            raise _error('ResourceNotFoundException', 'DescribeStream', StreamArn)
+        start = 0
+        if ExclusiveStartShardId:
+            start = [shard.shard_id for shard in shards].index(ExclusiveStartShardId) + 1
+        page = shards[start:start + (Limit or self.page_size)]
+        description = {
+            'StreamArn': StreamArn,
+            'StreamStatus': 'ENABLED',
+            'Shards': [
+                dict({'ShardId': shard.shard_id,
+                      'SequenceNumberRange': shard.sequence_range()},
+                     **({'ParentShardId': shard.parent_id} if shard.parent_id else {}))
+                for shard in page
+            ]
+        }
+        if start + len(page) < len(shards):
+            description['LastEvaluatedShardId'] = page[-1].shard_id
+        return {'StreamDescription': description}
+
+    def get_shard_iterator(self, StreamArn, ShardId, ShardIteratorType, SequenceNumber=None):
+        self._call('get_shard_iterator')
+        shard = self._shard(StreamArn, ShardId)
+        with self.lock:
+            shard.produce(time.time())
+            if ShardIteratorType == 'TRIM_HORIZON':
+                position = 0
+            elif ShardIteratorType == 'LATEST':
+                position = len(shard.records)
+            elif ShardIteratorType == 'AFTER_SEQUENCE_NUMBER':
+                position = shard.index_after(SequenceNumber)
+            elif ShardIteratorType == 'AT_SEQUENCE_NUMBER':
+                position = shard.index_after(SequenceNumber) - 1
+            else:
+                raise _error('ValidationException', 'GetShardIterator', ShardIteratorType)
+        return {'ShardIterator': f"{StreamArn}|{ShardId}|{position}"}
+
+    def get_records(self, ShardIterator, Limit=1000):
+        self._call('get_records')
+        stream_arn, shard_id, position = ShardIterator.rsplit('|', 2)
+        shard = self._shard(stream_arn, shard_id)
+        position = int(position)
+        with self.lock:
+            shard.produce(time.time())
+            records = shard.records[position:position + Limit]
+            drained = shard.closed_at is not None and position + len(records) >= shard.closed_at
+        response = {'Records': records}
+        # A closed shard has no next iterator once it has been read to the end
+        if not drained:
+            response['NextShardIterator'] = f"{stream_arn}|{shard_id}|{position + len(records)}"
+        return response
+
+
+class FakeTable:
+    """Just enough of a boto3 Table for final.process_stream"""
+
+    def __init__(self, name, latest_stream_arn):
+        self.name = name
+        self.latest_stream_arn = latest_stream_arn
+
+
+class FakeS3Client:
+    """In-memory S3 that counts requests and records when each object landed"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.objects = {}       # (bucket, key) -> body
+        self.put_times = {}     # (bucket, key) -> time.time() of the PUT
+        self.uploads = {}       # upload id -> {part number: body}
+        self.requests = 0
+        self.bytes_written = 0
+
+    def put_object(self, Bucket, Key, Body=b'', **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        elif hasattr(Body, 'read'):
+            Body = Body.read()
+        with self.lock:
+            self.requests += 1
+            self.bytes_written += len(Body)
+            self.objects[(Bucket, Key)] = Body
+            self.put_times[(Bucket, Key)] = time.time()
+        return {'ETag': f'"{len(Body):x}"'}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = uuid.uuid4().hex
+        with self.lock:
+            self.requests += 1
+            self.uploads[upload_id] = {}
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body=b'', **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.requests += 1
+            self.bytes_written += len(Body)
+            self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': f'"{PartNumber}-{len(Body):x}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        with self.lock:
+            self.requests += 1
+            parts = self.uploads.pop(UploadId)
+            self.objects[(Bucket, Key)] = b''.join(
+                parts[part['PartNumber']] for part in sorted(MultipartUpload['Parts'],
+                                                             key=lambda part: part['PartNumber']))
+            self.put_times[(Bucket, Key)] = time.time()
+        return {'Bucket': Bucket, 'Key': Key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        with self.lock:
+            self.requests += 1
+            self.uploads.pop(UploadId, None)
+        return {}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        with self.lock:
+            self.requests += 1
+            if (Bucket, Key) not in self.objects:
+                raise _error('NoSuchKey', 'GetObject', Key)
+            body = self.objects[(Bucket, Key)]
+        if Range:
+            start, _, end = Range.split('=', 1)[1].partition('-')
+            body = body[int(start):int(end) + 1 if end else None]
+        return {'Body': io.BytesIO(body), 'ContentLength': len(body)}
+
+    def list_objects_v2(self, Bucket, Prefix='', ContinuationToken=None, MaxKeys=1000, **kwargs):
+        with self.lock:
+            self.requests += 1
+            keys = sorted(key for bucket, key in self.objects
+                          if bucket == Bucket and key.startswith(Prefix))
+        if ContinuationToken:
+            keys = [key for key in keys if key > ContinuationToken]
+        page = keys[:MaxKeys]
+        response = {
+            'KeyCount': len(page),
+            'Contents': [{'Key': key, 'Size': len(self.objects[(Bucket, key)])} for key in page],
+            'IsTruncated': len(keys) > MaxKeys
+        }
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
@@ -1,10 +1,25 @@
 import boto3
 import json
-import time
 from decimal import Decimal
 import datetime
 from tzlocal import get_localzone
 import threading
+import signal
+import argparse
+import logging
+from shards import ShardConsumer
+from sink import S3BatchWriter, make_record_format
+from clients import get_s3_client
+from checkpoint import open_checkpoint_store
+from async_engine import run_engine
+from multiproc import GzipNdjsonFormat, ProcessPipeline
+from metrics import STAGE_SECONDS, start_http_server
+from dedup import Deduplicator
+from multipart import StreamingS3Writer
+from registry import DEFAULT_CONFIG, PipelineRegistry, load_config
+from lake_index import LakeIndex
+
+logger = logging.getLogger(__name__)
 
 class DecimalEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -21,105 +36,214 @@ def tzlocal():
     return local_timezone
 
 
-def upload_to_s3(record, bucket_name, prefix):
-    """Upload record to specified S3 bucket"""
-    try:
-        s3_client = boto3.client('s3')
-        record_json = json.dumps(record, indent=2, cls=DecimalEncoder)
-        s3_key = f"{prefix}/{record['eventID']}.json"
-        
-        response = s3_client.put_object(
-            Bucket=bucket_name,
-            Key=s3_key,
-            Body=record_json,
-            ContentType='application/json'
-        )
-        print(f"Successfully uploaded to {bucket_name}/{s3_key}")
-    except Exception as e:
-        print(f"Error uploading to S3: {e}")
-
-def process_stream(dynamodb_client, table, bucket_name, prefix):
+def process_stream(dynamodb_client, table, bucket_name, prefix, sink,
+                   max_workers=8, stop_event=None, poller_options=None,
+                   checkpoints=None, pipeline=None, dedup=None):
     """Process DynamoDB stream records for a specific table"""
     print(f"Processing stream for {table.name}")
     
     # Get the stream ARN
     stream_arn = table.latest_stream_arn
     
-    # Describe the stream to get shard information
-    stream_description = dynamodb_client.describe_stream(
-        StreamArn=stream_arn
-    )
-    
-    # Get the first shard
-    shard_id = stream_description['StreamDescription']['Shards'][0]['ShardId']
+    def handle_records(shard_id, records):
+        if dedup:
+            # Replays after an iterator retry or restart never reach S3 twice
+            with STAGE_SECONDS.time(stage='dedup'):
+                records = dedup.filter(stream_arn, shard_id, records)
+        if pipeline:
+            # Decode/serialize/compress on the process pool, in shard order
+            pipeline.submit(shard_id, records, bucket_name, prefix,
+                            position=(stream_arn, shard_id),
+                            accepted=(lambda page: dedup.accepted(stream_arn, shard_id, page))
+                            if dedup else None)
+            records = []
+        
+        debug = logger.isEnabledFor(logging.DEBUG)
+        added = 0
+        try:
+            for record in records:
+                if debug:
+                    logger.debug('%s stream record (%s): %s', table.name, shard_id, record)
+                # The sink checkpoints (stream, shard) once the record is in S3;
+                # it times its own serialize/build/put_object stages
+                sink.add(record, bucket_name, prefix, position=(stream_arn, shard_id))
+                added += 1
+        finally:
+            if dedup:
+                # Only what the sink took; the rest is let through when the page is retried
+                dedup.accepted(stream_arn, shard_id, records[:added])
+        
+        # Age-based flushes are driven by the polling loop
+        sink.flush_due()
     
-    # Get shard iterator
-    shard_iterator = dynamodb_client.get_shard_iterator(
-        StreamArn=stream_arn,
-        ShardId=shard_id,
-        ShardIteratorType='LATEST'
+    # Run a worker per shard, following parent -> child lineage
+    consumer = ShardConsumer(
+        dynamodb_client,
+        stream_arn,
+        handle_records,
+        name=table.name,
+        max_workers=max_workers,
+        stop_event=stop_event,
+        poller_options=poller_options,
+        checkpoints=checkpoints,
+        # A drained shard's last pages would otherwise wait in the pool until shutdown
+        on_drained=pipeline.finish if pipeline else None
     )
-    
-    iterator = shard_iterator['ShardIterator']
     print(f"\nWatching stream for {table.name} records...")
-    
-    while True:  # Continuous processing
-        try:
-            response = dynamodb_client.get_records(ShardIterator=iterator, Limit=10)
-            print(response)
-            
-            if response['Records']:
-                for record in response['Records']:
-                    print(f"\n{table.name} Stream Record:")
-                    print(f'\n{record}\n\n')
-                    upload_to_s3(record, bucket_name, prefix)
-            
-            # Update iterator
-            iterator = response['NextShardIterator']
-            time.sleep(15)
-        
-        except Exception as e:
-            print(f"Error processing stream for {table.name}: {e}")
-            time.sleep(30)  # Wait before retrying
+    consumer.run()
 
 def main():
+    parser = argparse.ArgumentParser(description='Copy DynamoDB stream records into the S3 datalake')
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads',
+                        help='a thread per table, or every table/shard on one event loop')
+    parser.add_argument('--config', default=DEFAULT_CONFIG,
+                        help='YAML or TOML file listing the tables to consume')
+    parser.add_argument('--max-calls', type=int,
+                        help='concurrent AWS calls for the asyncio engine '
+                             '(defaults to max_calls in the config)')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='transform and compress pages on this many worker processes '
+                             '(threads engine, writes gzipped NDJSON)')
+    parser.add_argument('--metrics-port', type=int, default=9102,
+                        help='serve Prometheus metrics on localhost at this port, 0 to disable')
+    parser.add_argument('--stream-uploads', choices=['gzip', 'zstd'],
+                        help='compress NDJSON straight into multipart uploads instead of '
+                             'buffering whole batches in memory')
+    parser.add_argument('--compact', action='store_true',
+                        help='write only the latest image per key in each batch '
+                             '(not with --processes or --stream-uploads, which write '
+                             'records as they arrive)')
+    parser.add_argument('--checkpoint-table',
+                        help='keep checkpoints in this DynamoDB table (created if missing) so '
+                             'several hosts can share them, instead of the local checkpoints.db')
+    parser.add_argument('--dedup-db', default='dedup.db',
+                        help='SQLite file of record keys already in S3, empty to disable dedup')
+    parser.add_argument('--log-level', default='INFO',
+                        help='DEBUG logs every get_records response and record')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=args.log_level.upper(),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+    
     # Initialize AWS clients
     dynamodb = boto3.resource('dynamodb')
     dynamodb_client = boto3.client('dynamodbstreams')
+    # Resume every shard after the last record that reached S3
+    checkpoints = open_checkpoint_store(dynamodb, args.checkpoint_table)
+    stop_event = threading.Event()
+    dedup = Deduplicator(args.dedup_db) if args.dedup_db else None
     
-    # Define tables and their corresponding S3 bucket details
-    tables_config = [
-        {
-            'table_name': 'Customer',
-            'bucket_name': 'quarkstail-datalake-s3-bucket',
-            'prefix': 'customers'
-        },
-        {
-            'table_name': 'Order',
-            'bucket_name': 'quarkstail-datalake-s3-bucket',
-            'prefix': 'orders'
-        }
-    ]
+    def on_flush(positions):
+        if dedup:
+            dedup.committed(positions)
+        checkpoints.save(positions)
     
-    # Create and start threads for each table's stream processing
-    threads = []
-    for config in tables_config:
-        table = dynamodb.Table(config['table_name'])
-        thread = threading.Thread(
-            target=process_stream, 
-            args=(
-                dynamodb_client, 
-                table, 
-                config['bucket_name'], 
-                config['prefix']
+    config = load_config(args.config)
+    tables_config = config['tables']
+    # Per-object stats next to the lake, so query.py can skip objects
+    lake_index = LakeIndex(get_s3_client())
+    
+    pipeline = None
+    if args.processes:
+        # Every table goes through the process pool as gzipped NDJSON
+        # Records are encoded on the pool, so entries only carry counts and times
+        pipeline_index = lake_index if any(table['index'] for table in tables_config) else None
+        if args.stream_uploads:
+            # Pages arrive as gzip members already
+            pipeline_sink = StreamingS3Writer(get_s3_client(), GzipNdjsonFormat(),
+                                              compression='none', on_flush=on_flush,
+                                              indexer=pipeline_index)
+        else:
+            pipeline_sink = S3BatchWriter(get_s3_client(), GzipNdjsonFormat(),
+                                          on_flush=on_flush, indexer=pipeline_index)
+        pipeline = ProcessPipeline(pipeline_sink, workers=args.processes)
+    
+    def make_sink(table_config):
+        """Build a table's sink from its batch size, format and partition settings"""
+        if pipeline:
+            return pipeline.sink
+        if table_config['format'] == 'ndjson' and args.stream_uploads:
+            return StreamingS3Writer(
+                get_s3_client(),
+                make_record_format('ndjson', table_config['table_name'], table_config['unmarshal']),
+                compression=args.stream_uploads,
+                max_records=table_config['max_records'],
+                max_age=table_config['max_age'],
+                on_flush=on_flush,
+                partition=table_config['partition'],
+                indexer=lake_index if table_config['index'] else None
             )
+        return S3BatchWriter(
+            get_s3_client(),
+            make_record_format(table_config['format'], table_config['table_name'],
+                               table_config['unmarshal']),
+            max_bytes=table_config['max_bytes'],
+            max_records=table_config['max_records'],
+            max_age=table_config['max_age'],
+            on_flush=on_flush,
+            compact=args.compact or table_config['compact'],
+            partition=table_config['partition'],
+            indexer=lake_index if table_config['index'] else None
+        )
+    
+    if args.engine == 'asyncio':
+        # The asyncio engine reads the config once; edits need a restart
+        pipelines = [
+            dict(table_config,
+                 stream_arn=dynamodb.Table(table_config['table_name']).latest_stream_arn,
+                 sink=make_sink(table_config),
+                 dedup=dedup)
+            for table_config in tables_config
+        ]
+        try:
+            # Returns once SIGTERM/Ctrl+C has drained and flushed everything
+            run_engine(dynamodb_client, pipelines, checkpoints=checkpoints,
+                       max_calls=args.max_calls or config['max_calls'])
+        finally:
+            checkpoints.close()
+            if dedup:
+                dedup.report()
+                dedup.close()
+        return
+    
+    def run_table(client, table, table_config, sink, table_stop_event):
+        process_stream(
+            client,
+            table,
+            table_config['bucket_name'],
+            table_config['prefix'],
+            sink,
+            max_workers=table_config['max_workers'],
+            stop_event=table_stop_event,
+            poller_options=table_config.get('poller'),
+            checkpoints=checkpoints,
+            pipeline=pipeline,
+            dedup=dedup
         )
-        thread.start()
-        threads.append(thread)
     
-    # Wait for all threads to complete (which they won't unless an error occurs)
-    for thread in threads:
-        thread.join()
+    # A consumer thread per table, following edits to the config file
+    registry = PipelineRegistry(args.config, dynamodb, dynamodb_client, make_sink, run_table,
+                                stop_event=stop_event)
+    
+    # Stop the shard workers on SIGTERM as well as Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    
+    try:
+        # Returns once stopped, after every table's sink has been flushed
+        registry.run()
+    except KeyboardInterrupt:
+        stop_event.set()
+    finally:
+        # Write out whatever is still in the process pool
+        if pipeline:
+            pipeline.close()
+            pipeline.sink.flush()
+        checkpoints.close()
+        if dedup:
+            dedup.report()
+            dedup.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -4,6 +4,7 @@ import time
 from decimal import Decimal
 import datetime
 from tzlocal import get_localzone
+from convert import floats_to_decimals
 
 # Custom JSON encoder for Decimal and datetime serialization
 class DecimalEncoder(json.JSONEncoder):
@@ -16,14 +17,8 @@ class DecimalEncoder(json.JSONEncoder):
 
 
 def convert_floats_to_decimals(d):
-    if isinstance(d, dict):  # If it's a dictionary, process each key-value pair
-        return {k: convert_floats_to_decimals(v) for k, v in d.items()}
-    elif isinstance(d, list):  # If it's a list, process each element
-        return [convert_floats_to_decimals(i) for i in d]
-    elif isinstance(d, float):  # If it's a float, convert it to Decimal
-        return Decimal(str(d))
-    else:
-        return d
+    # Only dicts/lists that actually hold floats are copied
+    return floats_to_decimals(d)
     
     
 
@@ -32,6 +27,38 @@ def tzlocal():
     return local_timezone
 
 
+# Serves "all orders of a customer", newest first, without scanning Order
+ORDER_INDEX = 'CustomerOrders'
+ORDER_INDEX_SPEC = {
+    'IndexName': ORDER_INDEX,
+    'KeySchema': [
+        {'AttributeName': 'CustomerId', 'KeyType': 'HASH'},
+        {'AttributeName': 'OrderDate', 'KeyType': 'RANGE'}
+    ],
+    'Projection': {'ProjectionType': 'ALL'},
+    'ProvisionedThroughput': {
+        'ReadCapacityUnits': 5,
+        'WriteCapacityUnits': 5
+    }
+}
+
+
+def ensure_order_index(table):
+    """Add the CustomerOrders index to an Order table created before it existed"""
+    indexes = table.global_secondary_indexes or []
+    if any(index['IndexName'] == ORDER_INDEX for index in indexes):
+        return
+    table.meta.client.update_table(
+        TableName=table.name,
+        AttributeDefinitions=[
+            {'AttributeName': 'CustomerId', 'AttributeType': 'S'},
+            {'AttributeName': 'OrderDate', 'AttributeType': 'S'}
+        ],
+        GlobalSecondaryIndexUpdates=[{'Create': ORDER_INDEX_SPEC}]
+    )
+    print(f"Creating index {ORDER_INDEX} on {table.name}, it backfills in the background")
+
+
 def create_table(dynamodb):
     try:
         table1 = dynamodb.create_table(
@@ -64,8 +91,10 @@ def create_table(dynamodb):
                 ],
                 AttributeDefinitions=[
                     {'AttributeName': 'OrderId', 'AttributeType': 'S'}, 
-                    {'AttributeName': 'CustomerId', 'AttributeType': 'S'} 
+                    {'AttributeName': 'CustomerId', 'AttributeType': 'S'},
+                    {'AttributeName': 'OrderDate', 'AttributeType': 'S'}
                 ],
+                GlobalSecondaryIndexes=[ORDER_INDEX_SPEC],
                 ProvisionedThroughput={
                 'ReadCapacityUnits': 5,
                 'WriteCapacityUnits': 5
@@ -78,6 +107,7 @@ def create_table(dynamodb):
         table2.meta.client.get_waiter('table_exists').wait(TableName='Order')
     except Exception as e:
         table2 = dynamodb.Table('Order')
+        ensure_order_index(table2)
         
     print(f"Tables are ready!!")
     return table1,table2
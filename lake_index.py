@@ -0,0 +1,183 @@
+import datetime
+import json
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from botocore.exceptions import ClientError
+
+from checkpoint import sequence_key
+from encoder import exact_json, plain_image
+from sink import event_time
+
+INDEX_DIR = '_index'
+TYPE_TAGS = {'S', 'N', 'B', 'BOOL', 'NULL', 'M', 'L', 'SS', 'NS', 'BS'}
+SCALARS = (str, int, float, Decimal, bool)
+
+
+def is_typed(image):
+    """True for DynamoDB-typed images, False for ones the sink already unmarshalled"""
+    return all(isinstance(value, dict) and len(value) == 1 and next(iter(value)) in TYPE_TAGS
+               for value in image.values())
+
+
+def record_image(record):
+    """The plain NewImage of a record, or its Keys for REMOVE events"""
+    stream = record.get('dynamodb', {})
+    image = stream.get('NewImage') or stream.get('Keys') or {}
+    return plain_image(image) if is_typed(image) else image
+
+
+def scalar_columns(image):
+    """Yield (column, value) for every scalar attribute, with nested maps one level deep as Parent.Child"""
+    for name, value in image.items():
+        if isinstance(value, dict):
+            for child, child_value in value.items():
+                if isinstance(child_value, SCALARS):
+                    yield f"{name}.{child}", child_value
+        elif isinstance(value, SCALARS):
+            yield name, value
+
+
+def index_key(prefix, key):
+    """Where the index entry of a data object lives: prefix/_index/<path under prefix>.json"""
+    return f"{prefix}/{INDEX_DIR}/{key[len(prefix) + 1:]}.json"
+
+
+class ObjectStats:
+    """Row count, time and sequence ranges and per-column min/max of the records in one object
+
+    Key attributes need no range of their own, they are columns like any other.
+
+    The ranges are only used to rule objects out, so they may be wider than
+    the object really is (e.g. when a compacted-away image was observed).
+    A column whose values can't be ordered gets None and is never pruned on.
+    """
+
+    def __init__(self):
+        self.records = 0
+        self.first_event_time = None
+        self.last_event_time = None
+        self.min_sequence_number = None
+        self.max_sequence_number = None
+        self.columns = {}        # column -> [min, max], or None
+
+    def observe(self, record):
+        stream = record.get('dynamodb', {})
+        self.records += 1
+        timestamp = event_time(record)
+        self._time_range(timestamp, timestamp)
+        sequence_number = stream.get('SequenceNumber')
+        if sequence_number:
+            self._sequence_range(sequence_number, sequence_number)
+        for column, value in scalar_columns(record_image(record)):
+            self._column_range(column, value, value)
+
+    def merge(self, other):
+        self.records += other.records
+        if other.first_event_time:
+            self._time_range(other.first_event_time, other.last_event_time)
+        if other.min_sequence_number:
+            self._sequence_range(other.min_sequence_number, other.max_sequence_number)
+        for column, bounds in other.columns.items():
+            if bounds is None:
+                self.columns[column] = None
+            else:
+                self._column_range(column, *bounds)
+
+    def _time_range(self, first, last):
+        if self.first_event_time is None or first < self.first_event_time:
+            self.first_event_time = first
+        if self.last_event_time is None or last > self.last_event_time:
+            self.last_event_time = last
+
+    def _sequence_range(self, low, high):
+        if self.min_sequence_number is None or sequence_key(low) < sequence_key(self.min_sequence_number):
+            self.min_sequence_number = low
+        if self.max_sequence_number is None or sequence_key(high) > sequence_key(self.max_sequence_number):
+            self.max_sequence_number = high
+
+    def _column_range(self, column, low, high):
+        if column not in self.columns:
+            self.columns[column] = [low, high]
+            return
+        bounds = self.columns[column]
+        if bounds is None:
+            return
+        try:
+            if low < bounds[0]:
+                bounds[0] = low
+            if high > bounds[1]:
+                bounds[1] = high
+        except TypeError:
+            self.columns[column] = None
+
+    def to_dict(self):
+        return {
+            'first_event_time': self.first_event_time.isoformat() if self.first_event_time else None,
+            'last_event_time': self.last_event_time.isoformat() if self.last_event_time else None,
+            'min_sequence_number': self.min_sequence_number,
+            'max_sequence_number': self.max_sequence_number,
+            'columns': self.columns
+        }
+
+
+class LakeIndex:
+    """Per-object index entries written next to the lake, used by query.py to skip objects
+
+    Every data object prefix/<path> gets an entry at prefix/_index/<path>.json
+    once it is in S3. Entries are only an optimisation: an object without
+    one (or with complete=False, e.g. pages encoded on a process pool) is
+    still read, just never pruned on its columns.
+    """
+
+    def __init__(self, s3_client):
+        self.s3_client = s3_client
+
+    def stats(self, *records):
+        """Stats of some records, for a sink to merge into its buffer's"""
+        stats = ObjectStats()
+        for record in records:
+            stats.observe(record)
+        return stats
+
+    def write(self, bucket_name, prefix, key, records, size, stats=None, complete=True,
+              first_event_time=None):
+        """Record one newly written object; errors are printed, the object is already safe"""
+        entry = {
+            'key': key,
+            'records': records,
+            'bytes': size,
+            'complete': complete and stats is not None,
+            'indexed_at': datetime.datetime.now(datetime.timezone.utc).isoformat()
+        }
+        if stats is not None:
+            entry.update(stats.to_dict())
+        if not entry.get('first_event_time') and first_event_time:
+            entry['first_event_time'] = first_event_time.isoformat()
+        try:
+            self.s3_client.put_object(Bucket=bucket_name, Key=index_key(prefix, key),
+                                      Body=exact_json(entry),
+                                      ContentType='application/json')
+        except Exception as e:
+            print(f"Error indexing {bucket_name}/{key}: {e}")
+
+    def load(self, bucket_name, prefix, partition='', workers=16):
+        """Return {object key: entry} for every indexed object under prefix/partition"""
+        keys = []
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{prefix}/{INDEX_DIR}/{partition}"):
+            keys.extend(obj['Key'] for obj in page.get('Contents', []))
+
+        def fetch(key):
+            try:
+                body = self.s3_client.get_object(Bucket=bucket_name, Key=key)['Body'].read()
+            except ClientError as e:
+                if e.response['Error']['Code'] == 'NoSuchKey':
+                    return None
+                raise
+            # Column bounds are compared with filter values, so keep them exact
+            return json.loads(body, parse_float=Decimal)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            entries = [entry for entry in executor.map(fetch, keys) if entry is not None]
+        return {entry['key']: entry for entry in entries}
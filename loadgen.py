@@ -0,0 +1,383 @@
+import argparse
+import contextlib
+import datetime
+import json
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import boto3
+
+from metrics import REGISTRY, RETRIES, error_reason, start_http_server
+from percentiles import percentile
+from retry import THROTTLE_CODES, Backoff
+
+# BatchWriteItem accepts at most 25 put/delete requests per call
+BATCH_SIZE = 25
+
+# Share of operations of each kind; the rest of the generator falls back to
+# new_order when a kind has nothing to act on yet
+DEFAULT_MIX = {
+    'new_order': 0.45,
+    'order_status': 0.30,
+    'customer_update': 0.10,
+    'new_customer': 0.05,
+    'delete_order': 0.10,
+}
+STATUS_TRANSITIONS = {
+    'Pending': ['Shipped', 'Shipped', 'Shipped', 'Cancelled'],
+    'Shipped': ['Delivered'],
+}
+FIRST_NAMES = ['Jane', 'John', 'Alice', 'Bob', 'Eve', 'Carlos', 'Priya', 'Wei', 'Fatima', 'Olga']
+LAST_NAMES = ['Doe', 'Smith', 'Johnson', 'Brown', 'White', 'Garcia', 'Patel', 'Chen', 'Khan', 'Ivanova']
+ADDRESSES = [
+    ('Springfield', 'IL', '62704'),
+    ('Greenwood', 'IN', '46142'),
+    ('Dallas', 'TX', '75201'),
+    ('Phoenix', 'AZ', '85001'),
+    ('Austin', 'TX', '73301'),
+]
+
+BATCH_SECONDS = REGISTRY.histogram(
+    'datalake_loadgen_batch_seconds',
+    'BatchWriteItem batches by loadgen: service time, and time since the batch was due', ('kind',))
+OPERATIONS = REGISTRY.counter(
+    'datalake_loadgen_operations_total', 'Writes sent by loadgen', ('table', 'operation'))
+
+
+class Workload:
+    """Seeded stream of Customer/Order writes shaped like insert.py's items
+
+    Orders go to customers picked with a skew towards the first ones
+    (hot_skew=1 is uniform), walk Pending -> Shipped -> Delivered or get
+    Cancelled, and are eventually deleted once finished. Only open orders
+    (up to max_open_orders) and recently finished ones are kept in memory.
+    """
+
+    def __init__(self, seed=1, customers=1000, mix=None, hot_skew=3.0, max_open_orders=100000):
+        self.rng = random.Random(seed)
+        self.mix = mix or DEFAULT_MIX
+        self.kinds = list(self.mix)
+        self.weights = [self.mix[kind] for kind in self.kinds]
+        self.hot_skew = hot_skew
+        self.max_open_orders = max_open_orders
+        self.initial_customers = customers
+        self.customers = []      # customer items, index is popularity rank
+        self.open_orders = []    # order items not Delivered/Cancelled yet
+        self.finished = deque(maxlen=max_open_orders)
+        self.next_order = 0
+
+    def new_customer(self):
+        city, state, zip_code = self.rng.choice(ADDRESSES)
+        first, last = self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+        item = {
+            'CustomerId': f"CUST{len(self.customers):08d}",
+            'Name': f"{first} {last}",
+            'Email': f"{first.lower()}.{last.lower()}{len(self.customers)}@example.com",
+            'Phone': f"+1{self.rng.randint(2000000000, 9999999999)}",
+            'Address': {
+                'Street': f"{self.rng.randint(1, 999)} {self.rng.choice(['Main St', 'Oak Ave', 'Pine Rd', 'Maple Dr'])}",
+                'City': city,
+                'State': state,
+                'ZIP': zip_code
+            },
+            'IsPrimeMember': self.rng.random() < 0.3
+        }
+        self.customers.append(item)
+        return 'Customer', 'new_customer', {'PutRequest': {'Item': item}}
+
+    def customer_update(self):
+        index = self.hot_customer()
+        item = dict(self.customers[index])
+        if self.rng.random() < 0.5:
+            item['IsPrimeMember'] = not item['IsPrimeMember']
+        else:
+            item['Phone'] = f"+1{self.rng.randint(2000000000, 9999999999)}"
+        self.customers[index] = item
+        return 'Customer', 'customer_update', {'PutRequest': {'Item': item}}
+
+    def hot_customer(self):
+        # u ** skew piles up near 0, so low ranks are the hot customers
+        return int(len(self.customers) * self.rng.random() ** self.hot_skew)
+
+    def new_order(self):
+        customer = self.customers[self.hot_customer()]
+        items = []
+        for _ in range(self.rng.randint(1, 4)):
+            price = Decimal(f"{min(self.rng.lognormvariate(3.5, 0.8), 2000):.2f}")
+            items.append({'ItemID': f"ITEM{self.rng.randint(1, 999):03d}",
+                          'Quantity': self.rng.randint(1, 5), 'Price': price})
+        order = {
+            'OrderId': f"ORD{self.next_order:010d}",
+            'CustomerId': customer['CustomerId'],
+            'OrderDate': datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'OrderTotal': sum(item['Price'] * item['Quantity'] for item in items),
+            'OrderStatus': 'Pending',
+            'Items': items
+        }
+        self.next_order += 1
+        if len(self.open_orders) < self.max_open_orders:
+            self.open_orders.append(order)
+        return 'Order', 'new_order', {'PutRequest': {'Item': order}}
+
+    def order_status(self):
+        index = self.rng.randrange(len(self.open_orders))
+        order = dict(self.open_orders[index])
+        order['OrderStatus'] = self.rng.choice(STATUS_TRANSITIONS[order['OrderStatus']])
+        if order['OrderStatus'] in STATUS_TRANSITIONS:
+            self.open_orders[index] = order
+        else:
+            # Swap-remove keeps picking a random open order O(1)
+            self.open_orders[index] = self.open_orders[-1]
+            self.open_orders.pop()
+            self.finished.append(order)
+        return 'Order', 'order_status', {'PutRequest': {'Item': order}}
+
+    def delete_order(self):
+        order = self.finished.popleft()
+        key = {'OrderId': order['OrderId'], 'CustomerId': order['CustomerId']}
+        return 'Order', 'delete_order', {'DeleteRequest': {'Key': key}}
+
+    def seed_operations(self):
+        """Put the initial customers, before the timed run starts"""
+        for _ in range(self.initial_customers - len(self.customers)):
+            yield self.new_customer()
+
+    def next_operation(self):
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        if kind == 'new_customer' or not self.customers:
+            return self.new_customer()
+        if kind == 'order_status' and self.open_orders:
+            return self.order_status()
+        if kind == 'delete_order' and self.finished:
+            return self.delete_order()
+        if kind == 'customer_update':
+            return self.customer_update()
+        return self.new_order()
+
+    def next_batch(self, operations, size=BATCH_SIZE):
+        """Group operations into one BatchWriteItem request, keeping the last write per key
+
+        Returns the request items and how many writes of each (table, kind)
+        they hold; operations superseded by a later one on the same key are
+        not counted.
+        """
+        writes = {}
+        for table_name, kind, request in operations:
+            item = request.get('PutRequest', {}).get('Item') or request['DeleteRequest']['Key']
+            key = (table_name, item.get('OrderId'), item['CustomerId'])
+            # BatchWriteItem rejects two writes to the same key in one request
+            writes[key] = (table_name, kind, request)
+            if len(writes) == size:
+                break
+        request_items = {}
+        counts = {}
+        for table_name, kind, request in writes.values():
+            request_items.setdefault(table_name, []).append(request)
+            counts[(table_name, kind)] = counts.get((table_name, kind), 0) + 1
+        return request_items, counts
+
+
+def write_requests(dynamodb, request_items, max_retries=10):
+    """Send one BatchWriteItem, retrying throttles and UnprocessedItems; returns the retries it took"""
+    backoff = Backoff(0.05, 5)
+    retries = 0
+    while request_items:
+        try:
+            response = dynamodb.batch_write_item(RequestItems=request_items)
+            request_items = response.get('UnprocessedItems') or {}
+            reason = 'unprocessed'
+        except Exception as e:
+            reason = error_reason(e)
+            if reason not in THROTTLE_CODES:
+                raise
+        if request_items:
+            if retries >= max_retries:
+                left = sum(len(writes) for writes in request_items.values())
+                raise RuntimeError(f"{left} writes still unprocessed after {retries} retries")
+            RETRIES.inc(operation='batch_write_item', reason=reason)
+            time.sleep(backoff.next_delay())
+            retries += 1
+    return retries
+
+
+class LoadGenerator:
+    """Drive a Workload at a target rate of operations per second
+
+    Batches are sent on a fixed schedule (open loop) from a pool of
+    workers, so a slow table shows up as latency rather than as a lower
+    send rate hiding it. Latency is measured both as service time and from
+    when each batch was due, which includes any time spent waiting for a
+    free worker.
+    """
+
+    def __init__(self, dynamodb, workload, rate, batch_size=BATCH_SIZE, workers=16, max_retries=10):
+        self.dynamodb = dynamodb
+        self.workload = workload
+        self.rate = rate
+        self.batch_size = batch_size
+        self.workers = workers
+        self.max_retries = max_retries
+        self.service_times = []
+        self.due_latencies = []
+        self.operations = {}     # (table, kind) -> count
+        self.retries = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def seed(self):
+        """Write the initial customers as fast as the workers allow"""
+        operations = self.workload.seed_operations()
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                request_items, counts = self.workload.next_batch(operations, self.batch_size)
+                if not request_items:
+                    break
+                futures.append(executor.submit(write_requests, self.dynamodb, request_items,
+                                               self.max_retries))
+        for future in futures:
+            future.result()
+        print(f"Seeded {len(self.workload.customers)} customers")
+
+    def send(self, request_items, counts, due):
+        started = time.perf_counter()
+        try:
+            retries = write_requests(self.dynamodb, request_items, self.max_retries)
+        except Exception as e:
+            print(f"Error writing batch: {e}")
+            with self.lock:
+                self.failed += sum(counts.values())
+            return
+        finished = time.perf_counter()
+        BATCH_SECONDS.observe(finished - started, kind='service')
+        BATCH_SECONDS.observe(finished - due, kind='due')
+        with self.lock:
+            self.service_times.append(finished - started)
+            self.due_latencies.append(finished - due)
+            self.retries += retries
+            for (table_name, kind), count in counts.items():
+                self.operations[(table_name, kind)] = self.operations.get((table_name, kind), 0) + count
+        for (table_name, kind), count in counts.items():
+            OPERATIONS.inc(count, table=table_name, operation=kind)
+
+    def run(self, duration):
+        """Send load for duration seconds and return what was achieved"""
+        interval = self.batch_size / self.rate
+        # Enough for the workers plus one batch each waiting, so a stalled table can't pile up memory
+        in_flight = threading.BoundedSemaphore(self.workers * 2)
+        operations = iter(self.workload.next_operation, None)
+
+        def send(request_items, counts, due):
+            try:
+                self.send(request_items, counts, due)
+            finally:
+                in_flight.release()
+
+        start = time.perf_counter()
+        due = start
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='loadgen') as executor:
+            while due < start + duration:
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                request_items, counts = self.workload.next_batch(operations, self.batch_size)
+                in_flight.acquire()
+                executor.submit(send, request_items, counts, due)
+                due += interval
+        elapsed = time.perf_counter() - start
+
+        sent = sum(self.operations.values())
+        return {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'target_ops_per_sec': self.rate,
+            'ops_per_sec': sent / elapsed,
+            'operations': {f"{table_name}.{kind}": count
+                           for (table_name, kind), count in sorted(self.operations.items())},
+            'batches': len(self.service_times),
+            'retries': self.retries,
+            'failed': self.failed,
+            'service_p50_ms': percentile(self.service_times, 0.50) * 1000,
+            'service_p99_ms': percentile(self.service_times, 0.99) * 1000,
+            'latency_p50_ms': percentile(self.due_latencies, 0.50) * 1000,
+            'latency_p90_ms': percentile(self.due_latencies, 0.90) * 1000,
+            'latency_p99_ms': percentile(self.due_latencies, 0.99) * 1000,
+            'latency_max_ms': max(self.due_latencies, default=0.0) * 1000,
+        }
+
+
+def parse_mix(text):
+    """'new_order=0.6,order_status=0.4' -> weights for those kinds"""
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        if kind.strip() not in DEFAULT_MIX:
+            raise ValueError(f"Unknown operation {kind!r}, expected one of {', '.join(DEFAULT_MIX)}")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic Customer/Order traffic at a target rate')
+    parser.add_argument('--rate', type=float, default=100, help='target operations per second')
+    parser.add_argument('--duration', type=float, default=60, help='seconds of load')
+    parser.add_argument('--customers', type=int, default=1000, help='customers written before the run')
+    parser.add_argument('--mix', type=parse_mix,
+                        help='operation weights, e.g. new_order=0.5,order_status=0.3,delete_order=0.2 '
+                             f"(default {','.join(f'{k}={v}' for k, v in DEFAULT_MIX.items())})")
+    parser.add_argument('--hot-skew', type=float, default=3.0,
+                        help='how strongly orders favour a few customers, 1 is uniform')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=16, help='batches in flight')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--endpoint-url', help='DynamoDB Local or a moto server, e.g. http://localhost:8000')
+    parser.add_argument('--region', help='needed with --endpoint-url if no default region is configured')
+    parser.add_argument('--moto', action='store_true', help='run against an in-process moto mock')
+    parser.add_argument('--create-tables', action='store_true',
+                        help="create Customer and Order as insert.py does, if they don't exist")
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='serve Prometheus metrics on localhost at this port while running')
+    parser.add_argument('--results', default='loadgen_results.jsonl',
+                        help='each run is appended here')
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        if args.moto:
+            try:
+                from moto import mock_aws
+            except ImportError:
+                raise ImportError("moto is required for --moto: pip install moto")
+            stack.enter_context(mock_aws())
+        dynamodb = boto3.resource('dynamodb', endpoint_url=args.endpoint_url,
+                                  region_name=args.region or ('us-east-1' if args.moto else None))
+        if args.create_tables or args.moto:
+            from insert import create_table
+            create_table(dynamodb)
+        if args.metrics_port:
+            start_http_server(args.metrics_port)
+
+        workload = Workload(args.seed, args.customers, args.mix, args.hot_skew)
+        generator = LoadGenerator(dynamodb, workload, args.rate, args.batch_size, args.workers)
+        generator.seed()
+        result = generator.run(args.duration)
+
+    result['config'] = {name: value for name, value in vars(args).items() if name != 'mix'}
+    result['config']['mix'] = args.mix or DEFAULT_MIX
+    print(f"{sum(result['operations'].values())} operations in {args.duration:.0f}s: "
+          f"{result['ops_per_sec']:.0f}/{args.rate:.0f} ops/sec, "
+          f"latency p50 {result['latency_p50_ms']:.1f} ms, p90 {result['latency_p90_ms']:.1f} ms, "
+          f"p99 {result['latency_p99_ms']:.1f} ms, max {result['latency_max_ms']:.1f} ms "
+          f"(service p50 {result['service_p50_ms']:.1f} ms), "
+          f"{result['retries']} retries, {result['failed']} failed")
+    for name, count in result['operations'].items():
+        print(f"  {name}: {count}")
+
+    with open(args.results, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import json
+import threading
+
+import boto3
+from boto3.dynamodb.conditions import Key
+
+from cache import LRUCache
+from encoder import json_default
+from insert import ORDER_INDEX
+from metrics import REGISTRY
+from parquet_sink import table_name
+from shards import ShardConsumer
+
+CACHE_LOOKUPS = REGISTRY.counter(
+    'datalake_lookup_cache_total', 'Read-through cache lookups by cache and result',
+    ('cache', 'result'))
+CACHE_INVALIDATIONS = REGISTRY.counter(
+    'datalake_lookup_invalidations_total', 'Cache entries dropped by stream events', ('cache',))
+
+
+def customer_orders_page(order_table, customer_id, limit=50, start_key=None, since=None,
+                         until=None, newest_first=True):
+    """Return one page of a customer's orders from the CustomerOrders index
+
+    since/until bound OrderDate (ISO strings). Pass the returned next key back
+    as start_key for the following page; it is None after the last one.
+    """
+    condition = Key('CustomerId').eq(customer_id)
+    if since and until:
+        condition = condition & Key('OrderDate').between(since, until)
+    elif since:
+        condition = condition & Key('OrderDate').gte(since)
+    elif until:
+        condition = condition & Key('OrderDate').lte(until)
+
+    kwargs = {
+        'IndexName': ORDER_INDEX,
+        'KeyConditionExpression': condition,
+        'ScanIndexForward': not newest_first,
+        'Limit': limit
+    }
+    if start_key:
+        kwargs['ExclusiveStartKey'] = start_key
+    response = order_table.query(**kwargs)
+    return response['Items'], response.get('LastEvaluatedKey')
+
+
+def iter_customer_orders(order_table, customer_id, page_size=100, **kwargs):
+    """Yield every order of a customer, a page at a time under the hood"""
+    start_key = None
+    while True:
+        items, start_key = customer_orders_page(order_table, customer_id, page_size,
+                                                start_key, **kwargs)
+        yield from items
+        if start_key is None:
+            return
+
+
+class _ReadThroughCache:
+    """An LRU/TTL cache that never stores a value read before an invalidation of its key
+
+    Each invalidation bumps a per-key generation; a load only fills the
+    cache if the generation is unchanged when it finishes, so a slow read
+    racing a stream event can't put stale data back. For loads that are
+    only eventually consistent (GSI queries), refill_delay also keeps a key
+    out of the cache for that many seconds after an invalidation, while the
+    index may still return the old data.
+    """
+
+    def __init__(self, name, max_size, ttl, refill_delay=0):
+        self.name = name
+        self.entries = LRUCache(max_size, ttl)
+        self.generations = LRUCache(max_size * 4)
+        self.settling = LRUCache(max_size * 4, refill_delay) if refill_delay else None
+        self.lock = threading.Lock()
+
+    def get(self, key, load):
+        value = self.entries.get(key)
+        if value is not None:
+            CACHE_LOOKUPS.inc(cache=self.name, result='hit')
+            return value
+        CACHE_LOOKUPS.inc(cache=self.name, result='miss')
+
+        generation = self.generations.get(key, 0)
+        value = load()
+        with self.lock:
+            settling = self.settling is not None and key in self.settling
+            if value is not None and self.generations.get(key, 0) == generation and not settling:
+                self.entries.put(key, value)
+        return value
+
+    def invalidate(self, key):
+        with self.lock:
+            self.generations.put(key, self.generations.get(key, 0) + 1)
+            self.entries.pop(key)
+            if self.settling is not None:
+                self.settling.put(key)
+        CACHE_INVALIDATIONS.inc(cache=self.name)
+
+
+class CustomerLookup:
+    """Customers and their orders, served from memory for hot customers
+
+    Reads go to DynamoDB on a miss (Customer by key with a consistent read,
+    orders through the CustomerOrders index) and are cached for up to ttl
+    seconds. Stream events for either table drop the affected entries, fed
+    in through invalidate() by whatever reads the streams in the same
+    process, or read by follow(). Until an event arrives a cached entry can
+    be stale: with follow() that is the stream's own delay plus up to the
+    poller's max_interval (15 seconds by default, tunable through
+    poller_options), and never longer than ttl. The index lags the table, so
+    a customer's orders are not cached again until order_refill_delay
+    seconds after their last invalidation. Customers with more than
+    max_cached_orders orders are always queried.
+    """
+
+    def __init__(self, dynamodb=None, max_size=10000, ttl=300, max_cached_orders=500,
+                 order_refill_delay=5):
+        dynamodb = dynamodb or boto3.resource('dynamodb')
+        self.customer_table = dynamodb.Table('Customer')
+        self.order_table = dynamodb.Table('Order')
+        self.max_cached_orders = max_cached_orders
+        self.customers = _ReadThroughCache('customer', max_size, ttl)
+        self.orders = _ReadThroughCache('customer_orders', max_size, ttl, order_refill_delay)
+
+    def get_customer(self, customer_id):
+        def load():
+            return self.customer_table.get_item(Key={'CustomerId': customer_id},
+                                                ConsistentRead=True).get('Item')
+        return self.customers.get(customer_id, load)
+
+    def get_orders(self, customer_id):
+        """Return every order of a customer, newest first"""
+        uncached = []
+
+        def load():
+            orders = []
+            pages = iter_customer_orders(self.order_table, customer_id)
+            for order in pages:
+                orders.append(order)
+                if len(orders) > self.max_cached_orders:
+                    # Too many to keep in memory, read the rest without caching them
+                    orders.extend(pages)
+                    uncached.append(orders)
+                    return None
+            return orders
+        orders = self.orders.get(customer_id, load)
+        return uncached[0] if orders is None else orders
+
+    def invalidate(self, records):
+        """Drop the cache entries a page of stream records makes stale"""
+        for record in records:
+            name = table_name(record)
+            keys = record.get('dynamodb', {}).get('Keys', {})
+            customer_id = keys.get('CustomerId', {}).get('S')
+            if customer_id is None:
+                continue
+            if name == 'Customer':
+                self.customers.invalidate(customer_id)
+            elif name == 'Order':
+                self.orders.invalidate(customer_id)
+
+    def follow(self, streams_client=None, stop_event=None, poller_options=None):
+        """Invalidate from the Customer and Order streams on background threads
+
+        Returns the stop event; the consumers start at LATEST since the
+        cache starts out empty. poller_options (as in pipelines.yaml) bound
+        how long an idle shard waits between polls, and so how stale an entry
+        can get.
+        """
+        streams_client = streams_client or boto3.client('dynamodbstreams')
+        stop_event = stop_event or threading.Event()
+        for table in (self.customer_table, self.order_table):
+            consumer = ShardConsumer(streams_client, table.latest_stream_arn,
+                                     lambda shard_id, records: self.invalidate(records),
+                                     name=f"{table.name}-cache", stop_event=stop_event,
+                                     discovery_interval=30, poller_options=poller_options)
+            threading.Thread(target=consumer.run, name=f"invalidate-{table.name}",
+                             daemon=True).start()
+        return stop_event
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print a customer and their orders, newest first")
+    parser.add_argument('customer_id')
+    parser.add_argument('--limit', type=int, default=20, help='orders per page')
+    parser.add_argument('--since', help='only orders on or after this OrderDate')
+    args = parser.parse_args()
+
+    dynamodb = boto3.resource('dynamodb')
+    customer = dynamodb.Table('Customer').get_item(Key={'CustomerId': args.customer_id},
+                                                   ConsistentRead=True).get('Item')
+    print(json.dumps(customer, indent=2, default=json_default))
+
+    orders, next_key = customer_orders_page(dynamodb.Table('Order'), args.customer_id,
+                                            limit=args.limit, since=args.since)
+    print(json.dumps(orders, indent=2, default=json_default))
+    if next_key:
+        print(f"More orders after {next_key}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds, from encoding one record up to a throttled retry
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05,
+                   0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def error_reason(error):
+    """Return the AWS error code of an exception, or its class name"""
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+    return code or type(error).__name__
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.label_names)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+    def remove(self, **labels):
+        """Drop a series, e.g. once the shard it describes is gone"""
+        with self.lock:
+            self.values.pop(self._key(labels), None)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, value in self.samples():
+            lines.append(f"{name}{_label_text(self.label_names, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self.lock:
+            return self.values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def value(self, **labels):
+        with self.lock:
+            return self.values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # Per-bucket counts (last one is +Inf), then sum and count
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            states = [(key, list(state[0]), state[1], state[2]) for key, state in self.values.items()]
+        for key, counts, total, count in states:
+            cumulative = 0
+            names = self.label_names + ('le',)
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_label_text(names, key + (bound,))} {cumulative}")
+            labels = _label_text(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """Holds every metric and renders them in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, documentation, labels, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, documentation, labels, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._get(Counter, name, documentation, labels)
+
+    def gauge(self, name, documentation, labels=()):
+        return self._get(Gauge, name, documentation, labels)
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, documentation, labels, buckets=buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# The stream consumer's hot-path metrics
+STAGE_SECONDS = REGISTRY.histogram(
+    'datalake_stage_seconds',
+    'Time per call of each pipeline stage: get_records, dedup, serialize, build, put_object; '
+    'stages ending in _cpu are CPU seconds per page on the process pool',
+    ('stage',))
+RECORDS_READ = REGISTRY.counter(
+    'datalake_records_read_total', 'Stream records returned by get_records', ('table',))
+RECORDS_WRITTEN = REGISTRY.counter(
+    'datalake_records_written_total', 'Records written to S3', ('prefix',))
+BYTES_WRITTEN = REGISTRY.counter(
+    'datalake_bytes_written_total', 'Object bytes written to S3', ('prefix',))
+RECORDS_COMPACTED = REGISTRY.counter(
+    'datalake_records_compacted_total',
+    'Intermediate images dropped because a later change to the same key was in the batch',
+    ('prefix',))
+COMPACTION_RATIO = REGISTRY.gauge(
+    'datalake_compaction_ratio', 'Records received per record written in the last batch',
+    ('prefix',))
+SHARD_LAG = REGISTRY.gauge(
+    'datalake_shard_lag_seconds',
+    'Age of the newest record read from a shard, 0 when caught up (like MillisBehindLatest)',
+    ('table', 'shard'))
+RECORDS_DEAD_LETTERED = REGISTRY.counter(
+    'datalake_records_dead_lettered_total',
+    'Records parked under _dead_letter/ because their batch could not be built', ('prefix',))
+RETRIES = REGISTRY.counter(
+    'datalake_retries_total', 'Retried calls by operation and reason', ('operation', 'reason'))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would flood stdout
+
+
+def start_http_server(port, address='127.0.0.1', registry=REGISTRY):
+    """Serve /metrics on a daemon thread and return the server"""
+    handler = type('MetricsHandler', (_Handler,), {'registry': registry})
+    server = ThreadingHTTPServer((address, port), handler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    print(f"Serving metrics on http://{address}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,414 @@
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:  # only needed for zstd output
+    zstandard = None
+
+from checkpoint import sequence_key
+from metrics import BYTES_WRITTEN, RECORDS_WRITTEN, RETRIES, STAGE_SECONDS, error_reason
+from retry import Backoff
+from sink import (NdjsonFormat, _add_positions, _add_stats, _older_pending, event_time,
+                  partition_key, partition_path)
+
+# S3 rejects multipart parts under 5 MiB, except the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class GzipCodec:
+    extension = '.gz'
+
+    def __init__(self, level=6):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+
+class ZstdCodec:
+    extension = '.zst'
+
+    def __init__(self, level=3):
+        if zstandard is None:
+            raise ImportError("zstandard is required for zstd output: pip install zstandard")
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+
+class IdentityCodec:
+    """For items that are compressed already, e.g. GzipNdjsonFormat's gzip members"""
+
+    extension = ''
+
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+CODECS = {'gzip': GzipCodec, 'zstd': ZstdCodec, 'none': IdentityCodec}
+
+
+class MultipartUpload:
+    """Stream bytes into one S3 object, uploading parts in parallel as they fill up
+
+    Parts go to the shared executor; part_slots (a semaphore shared by every
+    upload of a writer) bounds how many filled parts can be waiting in
+    memory, and write() blocks until one frees up. Nothing is sent until the
+    first part fills, so small objects end up as a single put_object.
+    """
+
+    def __init__(self, s3_client, bucket_name, key, content_type, executor, part_slots,
+                 part_size=8 * 1024 * 1024, max_attempts=5):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.content_type = content_type
+        self.executor = executor
+        self.part_slots = part_slots
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.max_attempts = max_attempts
+        self.pending = bytearray()
+        self.upload_id = None
+        self.parts = []          # futures of {'PartNumber', 'ETag'} in part order
+        self.size = 0
+
+    def write(self, data):
+        self.pending += data
+        self.size += len(data)
+        if len(self.pending) >= self.part_size:
+            self._send_part()
+
+    def _send_part(self):
+        if self.upload_id is None:
+            self.upload_id = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket_name, Key=self.key, ContentType=self.content_type
+            )['UploadId']
+        body = bytes(self.pending)
+        self.pending = bytearray()
+        # Backpressure: wait for a slot instead of piling parts up in memory
+        self.part_slots.acquire()
+        future = self.executor.submit(self._upload_part, len(self.parts) + 1, body)
+        future.add_done_callback(lambda _: self.part_slots.release())
+        self.parts.append(future)
+
+    def _upload_part(self, part_number, body):
+        backoff = Backoff(0.2, 10)
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                with STAGE_SECONDS.time(stage='upload_part'):
+                    response = self.s3_client.upload_part(
+                        Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id,
+                        PartNumber=part_number, Body=body
+                    )
+                return {'PartNumber': part_number, 'ETag': response['ETag']}
+            except Exception as e:
+                RETRIES.inc(operation='upload_part', reason=error_reason(e))
+                if attempt == self.max_attempts:
+                    raise
+                time.sleep(backoff.next_delay())
+
+    def close(self):
+        """Upload what is left and finish the object"""
+        if self.upload_id is None:
+            with STAGE_SECONDS.time(stage='put_object'):
+                self.s3_client.put_object(Bucket=self.bucket_name, Key=self.key,
+                                          Body=bytes(self.pending),
+                                          ContentType=self.content_type)
+            self.pending = bytearray()
+            return
+        if self.pending or not self.parts:
+            self._send_part()
+        try:
+            parts = [future.result() for future in self.parts]
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except Exception:
+            self.abort()
+            raise
+
+    def abort(self):
+        for future in self.parts:
+            future.cancel()
+        if self.upload_id is not None:
+            try:
+                self.s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=self.key,
+                                                      UploadId=self.upload_id)
+            except Exception as e:
+                print(f"Error aborting upload of {self.key}: {e}")
+
+
+class _Stream:
+    def __init__(self, upload, codec, first_event_time, spill):
+        self.upload = upload
+        self.codec = codec
+        self.spill = spill
+        self.lock = threading.Lock()
+        self.records = 0
+        self.raw_size = 0
+        self.opened = time.monotonic()
+        self.first_event_time = first_event_time
+        self.positions = {}
+        self.oldest = {}
+        self.stats = None
+        self.unindexed = 0
+        self.closed = False
+
+
+class StreamingS3Writer:
+    """Drop-in for S3BatchWriter that compresses records straight into multipart uploads
+
+    Each bucket/prefix/partition has one open object at a time. Records are encoded
+    and compressed as they are added, and every full part is uploaded in the
+    background, so memory per writer stays under max_buffered_bytes however
+    big an object grows. An object is finished once it holds max_records,
+    max_object_bytes compressed or has been open for max_age seconds.
+
+    Record formats must produce independent byte items (NDJSON, or the gzip
+    members of GzipNdjsonFormat with compression='none'); Parquet needs the
+    whole batch and stays on S3BatchWriter.
+
+    The compressed bytes of each open object are also spilled to a
+    temporary file (in spill_dir). If an object fails, its shards stop being
+    checkpointed and it is uploaded again from the spill file on every
+    flush_due()/flush() until it gets through; then the shards are
+    checkpointed up to the newest object that reached S3 in the meantime.
+    Whatever is still failing at close() is replayed by a restart from the
+    last checkpoint.
+
+    With an indexer (lake_index.LakeIndex) every finished object also gets an
+    index entry, as with S3BatchWriter.
+    """
+
+    def __init__(self, s3_client, record_format, compression='gzip', level=None,
+                 part_size=8 * 1024 * 1024, max_buffered_bytes=64 * 1024 * 1024,
+                 max_object_bytes=512 * 1024 * 1024, max_records=1000000, max_age=60,
+                 upload_threads=8, on_flush=None, partition='hour', indexer=None, spill_dir=None):
+        self.s3_client = s3_client
+        if not hasattr(record_format, 'encode_record'):
+            record_format = NdjsonFormat(record_format)
+        if getattr(record_format, 'extension', '') == '.parquet':
+            raise ValueError("Parquet objects can't be streamed, use S3BatchWriter")
+        self.format = record_format
+        self.compression = compression
+        self.level = level
+        self.extension = record_format.extension + CODECS[compression].extension
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.max_object_bytes = max_object_bytes
+        self.max_records = max_records
+        self.max_age = max_age
+        self.on_flush = on_flush
+        self.partition = partition
+        self.indexer = indexer
+        self.spill_dir = spill_dir
+
+        self.executor = ThreadPoolExecutor(max_workers=upload_threads, thread_name_prefix='upload')
+        self.part_slots = threading.BoundedSemaphore(max(1, max_buffered_bytes // self.part_size))
+        self.streams = {}        # (bucket_name, prefix, partition) -> _Stream
+        self.closing = []        # streams taken out to be finished
+        self.failed = []         # (target, stream) of objects to upload again
+        self.failed_shards = set()
+        self.held_back = {}      # position -> newest sequence number not checkpointed while failed
+        self.lock = threading.Lock()
+        self.recover_lock = threading.Lock()
+
+    def _codec(self):
+        codec = CODECS[self.compression]
+        return codec() if self.level is None else codec(self.level)
+
+    def _stream(self, target, first_event_time):
+        # Called with self.lock held
+        stream = self.streams.get(target)
+        if stream is None:
+            bucket_name, prefix, _ = target
+            key = partition_key(prefix, first_event_time, self.extension, self.partition)
+            upload = MultipartUpload(self.s3_client, bucket_name, key, self.format.content_type,
+                                     self.executor, self.part_slots, self.part_size)
+            spill = tempfile.TemporaryFile(prefix='stream-', dir=self.spill_dir)
+            stream = self.streams[target] = _Stream(upload, self._codec(), first_event_time, spill)
+        return stream
+
+    def add(self, record, bucket_name, prefix, position=None):
+        """Encode, compress and stream out a record"""
+        started = time.perf_counter()
+        item, size = self.format.encode_record(record)
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage='serialize')
+        positions = None
+        if position is not None:
+            positions = {position: record['dynamodb']['SequenceNumber']}
+        stats = self.indexer.stats(record) if self.indexer else None
+        self.add_encoded(item, size, 1, bucket_name, prefix, event_time(record), positions, stats)
+
+    def add_encoded(self, item, size, count, bucket_name, prefix, first_event_time, positions=None,
+                    stats=None):
+        """Stream out an item the caller already encoded for this writer's format
+
+        The item goes in the partition of first_event_time, so items of several
+        records must not span partitions.
+        """
+        target = (bucket_name, prefix, partition_path(first_event_time, self.partition))
+        while True:
+            with self.lock:
+                stream = self._stream(target, first_event_time)
+            with stream.lock:
+                # Lost a race with a close, go round for the next object
+                if stream.closed:
+                    continue
+                self._write(stream, stream.codec.compress(item))
+                stream.records += count
+                stream.raw_size += size
+                if positions:
+                    _add_positions(stream, positions)
+                if self.indexer:
+                    _add_stats(stream, stats, count)
+                full = (stream.records >= self.max_records
+                        or stream.upload.size >= self.max_object_bytes)
+            break
+        if full:
+            self._close(target, stream)
+
+    def _write(self, stream, data):
+        # Called with stream.lock held
+        stream.spill.write(data)
+        stream.upload.write(data)
+
+    def flush_due(self):
+        """Finish every object that has been open for longer than max_age"""
+        now = time.monotonic()
+        with self.lock:
+            due = [(target, stream) for target, stream in self.streams.items()
+                   if now - stream.opened >= self.max_age]
+        for target, stream in due:
+            self._close(target, stream)
+        self._recover()
+
+    def flush(self):
+        """Finish every open object"""
+        with self.lock:
+            open_streams = list(self.streams.items())
+        for target, stream in open_streams:
+            self._close(target, stream)
+        self._recover()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            failed = list(self.failed)
+        for target, stream in failed:
+            print(f"Giving up on {target[0]}/{stream.upload.key}, {stream.records} records "
+                  f"are replayed from the last checkpoint on restart")
+            stream.spill.close()
+        self.executor.shutdown(wait=True)
+
+    def _close(self, target, stream):
+        with self.lock:
+            if self.streams.get(target) is stream:
+                del self.streams[target]
+                self.closing.append(stream)
+        with stream.lock:
+            if stream.closed:
+                return
+            stream.closed = True
+            bucket_name, prefix, _ = target
+            upload = stream.upload
+            try:
+                self._write(stream, stream.codec.flush())
+                upload.close()
+                print(f"Successfully uploaded {stream.records} records to {bucket_name}/{upload.key} "
+                      f"({stream.raw_size} bytes as {upload.size})")
+            except Exception as e:
+                print(f"Error uploading to S3: {e}; not checkpointing "
+                      f"{len(stream.positions)} shards until it is uploaded again")
+                RETRIES.inc(operation='put_object', reason=error_reason(e))
+                with self.lock:
+                    self.closing.remove(stream)
+                    self.failed.append((target, stream))
+                    self.failed_shards.update(stream.positions)
+                return
+        stream.spill.close()
+
+        with self.lock:
+            self.closing.remove(stream)
+            positions = self._checkpointable(stream)
+        self._finished(target, stream, positions)
+
+    def _recover(self):
+        """Upload failed objects again from their spill files"""
+        # One thread at a time, the others carry on
+        if not self.recover_lock.acquire(blocking=False):
+            return
+        try:
+            with self.lock:
+                failed = list(self.failed)
+            for target, stream in failed:
+                bucket_name = target[0]
+                upload = MultipartUpload(self.s3_client, bucket_name, stream.upload.key,
+                                         self.format.content_type, self.executor, self.part_slots,
+                                         self.part_size)
+                try:
+                    stream.spill.seek(0)
+                    while True:
+                        data = stream.spill.read(self.part_size)
+                        if not data:
+                            break
+                        upload.write(data)
+                    upload.close()
+                except Exception as e:
+                    print(f"Error uploading {bucket_name}/{upload.key} again, will retry: {e}")
+                    RETRIES.inc(operation='put_object', reason=error_reason(e))
+                    continue
+                print(f"Successfully uploaded {stream.records} records to {bucket_name}/{upload.key} "
+                      f"on retry")
+                stream.upload = upload
+                stream.spill.close()
+                with self.lock:
+                    self.failed.remove((target, stream))
+                    self.failed_shards = {position for _, failed_stream in self.failed
+                                          for position in failed_stream.positions}
+                    positions = self._checkpointable(stream)
+                self._finished(target, stream, positions)
+        finally:
+            self.recover_lock.release()
+
+    def _checkpointable(self, stream):
+        # Called with self.lock held; shards with an object still missing, or with
+        # older records in another partition's open object, are held back
+        pending = list(self.streams.values()) + self.closing
+        positions = {}
+        for position, sequence_number in stream.positions.items():
+            held = self.held_back.pop(position, sequence_number)
+            newest = max(held, sequence_number, key=sequence_key)
+            if position in self.failed_shards or _older_pending(position, newest, pending):
+                self.held_back[position] = newest
+            else:
+                positions[position] = newest
+        return positions
+
+    def _finished(self, target, stream, positions):
+        bucket_name, prefix, _ = target
+        upload = stream.upload
+        RECORDS_WRITTEN.inc(stream.records, prefix=prefix)
+        BYTES_WRITTEN.inc(upload.size, prefix=prefix)
+        if self.indexer:
+            self.indexer.write(bucket_name, prefix, upload.key, stream.records, upload.size,
+                               stream.stats, stream.unindexed == 0, stream.first_event_time)
+        if self.on_flush and positions:
+            try:
+                self.on_flush(positions)
+            except Exception as e:
+                print(f"Error saving checkpoints: {e}")
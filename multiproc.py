@@ -0,0 +1,204 @@
+import collections
+import datetime
+import itertools
+import marshal
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from encoder import get_encoder, plain_image
+from metrics import STAGE_SECONDS
+from sink import event_time, partition_path
+
+STAGES = ('pack', 'unpack', 'transform', 'serialize', 'compress', 'sink')
+
+
+def pack_page(records):
+    """Turn a get_records page into compact bytes for the worker process
+
+    marshal is much cheaper than pickle for plain dicts/lists/strings; the
+    only value it can't carry, ApproximateCreationDateTime, travels as epoch
+    seconds.
+    """
+    packed = []
+    for record in records:
+        stream = record.get('dynamodb')
+        created = stream.get('ApproximateCreationDateTime') if stream else None
+        if isinstance(created, datetime.datetime):
+            stream = dict(stream, ApproximateCreationDateTime=created.timestamp())
+            record = dict(record, dynamodb=stream)
+        packed.append(record)
+    return marshal.dumps(packed)
+
+
+def _gzip_member(data, level):
+    # Concatenated gzip members are still one valid gzip stream
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def transform_page(packed, unmarshal=True, level=6, backend='auto'):
+    """Worker side: decode, unmarshal, serialize and gzip one page
+
+    Returns the compressed NDJSON chunk, its record count and the CPU seconds
+    spent in each stage.
+    """
+    timings = {}
+    started = time.process_time()
+    records = marshal.loads(packed)
+    now = time.process_time()
+    timings['unpack'] = now - started
+
+    started = now
+    for record in records:
+        stream = record.get('dynamodb')
+        if not stream:
+            continue
+        created = stream.get('ApproximateCreationDateTime')
+        if isinstance(created, float):
+            stream['ApproximateCreationDateTime'] = datetime.datetime.fromtimestamp(
+                created, datetime.timezone.utc)
+        if unmarshal:
+            for field in ('Keys', 'NewImage', 'OldImage'):
+                if field in stream:
+                    stream[field] = plain_image(stream[field])
+    now = time.process_time()
+    timings['transform'] = now - started
+
+    started = now
+    encode = get_encoder(backend)
+    body = b''.join(encode(record) + b'\n' for record in records)
+    now = time.process_time()
+    timings['serialize'] = now - started
+
+    started = now
+    chunk = _gzip_member(body, level)
+    timings['compress'] = time.process_time() - started
+    return chunk, len(records), timings
+
+
+class GzipNdjsonFormat:
+    """Gzip-compressed NDJSON; items are gzip members, usually built by transform_page"""
+
+    extension = '.ndjson.gz'
+    content_type = 'application/x-ndjson'
+
+    def __init__(self, level=6):
+        self.level = level
+        self.encode = get_encoder()
+
+    def encode_record(self, record):
+        chunk = _gzip_member(self.encode(record) + b'\n', self.level)
+        return chunk, len(chunk)
+
+    def build(self, items):
+        return b''.join(items)
+
+
+class ProcessPipeline:
+    """Fan get_records pages out to a process pool, keeping order within each shard
+
+    Each shard is pinned to one single-process worker group, so its pages are
+    transformed in the order they were read. Finished pages are handed to the
+    sink by the shard's own thread, oldest first.
+    """
+
+    def __init__(self, sink, workers=4, unmarshal=True, level=6, max_in_flight=4):
+        self.sink = sink
+        self.unmarshal = unmarshal
+        self.level = level
+        self.max_in_flight = max_in_flight
+        self.groups = [ProcessPoolExecutor(max_workers=1) for _ in range(workers)]
+        self.assigned = {}                              # shard_id -> worker group
+        self.spread = itertools.count()
+        self.in_flight = collections.defaultdict(collections.deque)
+        self.lock = threading.Lock()
+        self.cpu = dict.fromkeys(STAGES, 0.0)
+        self.records = 0
+        self.started = time.monotonic()
+
+    def _group(self, shard_id):
+        with self.lock:
+            group = self.assigned.get(shard_id)
+            if group is None:
+                # Spread shards over the groups as they show up
+                group = self.assigned[shard_id] = self.groups[next(self.spread) % len(self.groups)]
+            return group
+
+    def submit(self, shard_id, records, bucket_name, prefix, position=None, accepted=None):
+        """Queue a page for transformation and hand any finished pages to the sink
+
+        accepted, if given, is called with the page once the sink has taken it.
+        A page spanning partitions goes to the pool as one piece per partition.
+        """
+        scheme = getattr(self.sink, 'partition', 'hour')
+        pieces = [list(piece) for _, piece in
+                  itertools.groupby(records, lambda record: partition_path(event_time(record), scheme))]
+        for number, piece in enumerate(pieces):
+            started = time.thread_time()
+            packed = pack_page(piece)
+            self._add_cpu('pack', time.thread_time() - started)
+
+            future = self._group(shard_id).submit(transform_page, packed, self.unmarshal, self.level)
+            positions = {position: piece[-1]['dynamodb']['SequenceNumber']} if position else None
+            # The whole page is accepted once its last piece is in the sink
+            last = number == len(pieces) - 1
+            self.in_flight[shard_id].append((future, bucket_name, prefix, event_time(piece[0]),
+                                             positions, records if accepted and last else None,
+                                             accepted if last else None))
+        self.collect(shard_id)
+
+    def collect(self, shard_id, wait=False):
+        """Pass finished pages to the sink in read order"""
+        pending = self.in_flight[shard_id]
+        while pending and (wait or pending[0][0].done() or len(pending) > self.max_in_flight):
+            future, bucket_name, prefix, first_event_time, positions, records, accepted = pending.popleft()
+            chunk, count, timings = future.result()
+            for stage, seconds in timings.items():
+                self._add_cpu(stage, seconds)
+                # Worker CPU time, not the wall time the in-process stages report
+                STAGE_SECONDS.observe(seconds, stage=f"{stage}_cpu")
+
+            started = time.thread_time()
+            self.sink.add_encoded(chunk, len(chunk), count, bucket_name, prefix,
+                                  first_event_time, positions)
+            self._add_cpu('sink', time.thread_time() - started)
+            if accepted:
+                accepted(records)
+            with self.lock:
+                self.records += count
+
+    def finish(self, shard_id):
+        """Hand a drained shard's last pages to the sink and forget the shard"""
+        self.collect(shard_id, wait=True)
+        with self.lock:
+            self.in_flight.pop(shard_id, None)
+            self.assigned.pop(shard_id, None)
+
+    def _add_cpu(self, stage, seconds):
+        with self.lock:
+            self.cpu[stage] += seconds
+
+    def report(self):
+        """Print CPU seconds per stage against wall time"""
+        elapsed = time.monotonic() - self.started
+        with self.lock:
+            cpu = dict(self.cpu)
+            records = self.records
+        total = sum(cpu.values())
+        stages = ', '.join(f"{stage} {seconds:.2f}s" for stage, seconds in cpu.items())
+        print(f"Process pipeline: {records} records in {elapsed:.1f}s wall, "
+              f"{total:.2f}s CPU ({stages})")
+        if elapsed:
+            # Far below workers x 100% means we are waiting on I/O, not CPU
+            print(f"CPU utilisation {total / elapsed * 100:.0f}% of one core "
+                  f"across {len(self.groups)} worker processes")
+
+    def close(self):
+        """Wait for every page in flight to reach the sink"""
+        for shard_id in list(self.in_flight):
+            self.collect(shard_id, wait=True)
+        for group in self.groups:
+            group.shutdown(wait=True)
+        self.report()
@@ -0,0 +1,257 @@
+import argparse
+import datetime
+import io
+from decimal import Decimal
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # only needed for the parquet output mode
+    pa = None
+    pq = None
+
+from encoder import exact_json, plain_image
+from registry import DEFAULTS
+from sink import event_time
+
+# Digits after the point of the money columns
+MONEY_SCALE = 2
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("pyarrow is required for parquet output: pip install pyarrow")
+
+
+# Decoders from a typed DynamoDB value to the Python value of a column. They
+# raise ValueError for anything the column can't hold as it is, and the
+# attribute is then kept in _extra instead
+def _typed(typed, tag):
+    """The value under a DynamoDB type tag; NULL is None, any other type is an error"""
+    if tag in typed:
+        return typed[tag]
+    if typed.get('NULL'):
+        return None
+    raise ValueError(f"expected type {tag}, got {', '.join(typed) or 'nothing'}")
+
+
+def _string(typed):
+    return _typed(typed, 'S')
+
+
+def _boolean(typed):
+    return _typed(typed, 'BOOL')
+
+
+def _integer(typed):
+    value = _typed(typed, 'N')
+    return None if value is None else int(value)
+
+
+def _decimal(typed):
+    value = _typed(typed, 'N')
+    if value is None:
+        return None
+    value = Decimal(value)
+    # Arrow refuses decimals with more digits than the column's scale
+    scaled = value.quantize(Decimal(1).scaleb(-MONEY_SCALE))
+    if scaled != value:
+        raise ValueError(f"{value} has more than {MONEY_SCALE} decimal places")
+    return scaled
+
+
+def _timestamp(typed):
+    value = _typed(typed, 'S')
+    if value is None:
+        return None
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _struct(fields):
+    def decode(typed):
+        value = _typed(typed, 'M')
+        if value is None:
+            return None
+        return {name: decoder(value[name]) if name in value else None
+                for name, decoder in fields.items()}
+    return decode
+
+
+def _list_of(decoder):
+    def decode(typed):
+        value = _typed(typed, 'L')
+        if value is None:
+            return None
+        return [decoder(item) for item in value]
+    return decode
+
+
+def table_schemas():
+    """Arrow schema and decoders for the Customer and Order tables created in insert.py"""
+    require_pyarrow()
+    money = pa.decimal128(12, MONEY_SCALE)
+    address = pa.struct([('Street', pa.string()), ('City', pa.string()),
+                         ('State', pa.string()), ('ZIP', pa.string())])
+    item = pa.struct([('ItemID', pa.string()), ('Quantity', pa.int64()), ('Price', money)])
+    return {
+        'Customer': [
+            ('CustomerId', pa.string(), _string),
+            ('Name', pa.string(), _string),
+            ('Email', pa.string(), _string),
+            ('Phone', pa.string(), _string),
+            ('Address', address, _struct({'Street': _string, 'City': _string,
+                                          'State': _string, 'ZIP': _string})),
+            ('IsPrimeMember', pa.bool_(), _boolean),
+        ],
+        'Order': [
+            ('OrderId', pa.string(), _string),
+            ('CustomerId', pa.string(), _string),
+            ('OrderDate', pa.timestamp('ms', tz='UTC'), _timestamp),
+            ('OrderTotal', money, _decimal),
+            ('OrderStatus', pa.string(), _string),
+            ('Items', pa.list_(item), _list_of(_struct({'ItemID': _string,
+                                                       'Quantity': _integer,
+                                                       'Price': _decimal}))),
+        ],
+    }
+
+
+def metadata_columns():
+    return [
+        ('event_id', pa.string()),
+        ('event_name', pa.string()),
+        ('sequence_number', pa.string()),
+        ('approximate_creation_time', pa.timestamp('ms', tz='UTC')),
+    ]
+
+
+def table_name(record):
+    """Pull the table name out of eventSourceARN (arn:...:table/Order/stream/...)"""
+    arn = record.get('eventSourceARN', '')
+    if '/table/' in arn or ':table/' in arn:
+        return arn.split('table/', 1)[1].split('/', 1)[0]
+    return None
+
+
+class ParquetFormat:
+    """Flatten stream records into typed columns and write them as Parquet
+
+    NewImage (or Keys for REMOVE events) is decoded into one column per known
+    attribute; attributes the schema doesn't know are kept as a JSON string in
+    the _extra column so nothing is dropped. So are known attributes whose
+    value doesn't fit their column (a wrong type, an unparseable date, money
+    that would need rounding), which are left null in the column.
+    """
+
+    extension = '.parquet'
+    content_type = 'application/vnd.apache.parquet'
+
+    def __init__(self, table=None, row_group_size=10000, compression='zstd'):
+        require_pyarrow()
+        self.table = table
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.schemas = table_schemas()
+        self.arrow_schemas = {}
+
+    def columns_for(self, name):
+        return self.schemas.get(name, [])
+
+    def arrow_schema(self, name):
+        schema = self.arrow_schemas.get(name)
+        if schema is None:
+            fields = metadata_columns()
+            fields += [(column, arrow_type) for column, arrow_type, _ in self.columns_for(name)]
+            fields.append(('_extra', pa.string()))
+            schema = self.arrow_schemas[name] = pa.schema(fields)
+        return schema
+
+    def encode_record(self, record):
+        """Return (table name, row) for a record and an estimate of its size"""
+        stream = record.get('dynamodb', {})
+        image = stream.get('NewImage') or stream.get('Keys') or {}
+        name = self.table or table_name(record)
+        columns = self.columns_for(name)
+
+        row = {
+            'event_id': record.get('eventID'),
+            'event_name': record.get('eventName'),
+            'sequence_number': stream.get('SequenceNumber'),
+            'approximate_creation_time': event_time(record),
+        }
+        known = {column for column, _, _ in columns}
+        extra = {attribute: value for attribute, value in image.items() if attribute not in known}
+        for column, _, decode in columns:
+            row[column] = None
+            if column not in image:
+                continue
+            try:
+                row[column] = decode(image[column])
+            except (ValueError, TypeError, ArithmeticError) as e:
+                print(f"Keeping {column} of {name} record {row['sequence_number']} in _extra: {e}")
+                extra[column] = image[column]
+        row['_extra'] = exact_json(plain_image(extra)) if extra else None
+        return (name, row), stream.get('SizeBytes', 256)
+
+    def build(self, items):
+        """Write the buffered rows as one Parquet file, row_group_size rows per group"""
+        name = items[0][0]
+        schema = self.arrow_schema(name)
+        table = pa.Table.from_pylist([row for _, row in items], schema=schema)
+        body = io.BytesIO()
+        pq.write_table(table, body, row_group_size=self.row_group_size,
+                       compression=self.compression)
+        return body.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write sample Order stream records as Parquet')
+    parser.add_argument('--bucket', default=DEFAULTS['bucket_name'])
+    parser.add_argument('--local-dir', help='Write to this directory instead of S3')
+    args = parser.parse_args()
+
+    from clients import LocalS3Client, get_s3_client
+    from sink import S3BatchWriter
+
+    s3_client = LocalS3Client(args.local_dir) if args.local_dir else get_s3_client()
+    sink = S3BatchWriter(s3_client, ParquetFormat())
+
+    created = datetime.datetime(2024, 11, 28, 14, 30, tzinfo=datetime.timezone.utc)
+    record = {
+        'eventID': 'a93b42f3a4dc744bf312201a52252af1',
+        'eventName': 'INSERT',
+        'eventSourceARN': 'arn:aws:dynamodb:ap-south-1:140023404813:table/Order/stream/2024-11-28T20:32:37.346',
+        'dynamodb': {
+            'ApproximateCreationDateTime': created,
+            'Keys': {'OrderId': {'S': 'ORD12350'}, 'CustomerId': {'S': 'CUST67895'}},
+            'NewImage': {
+                'OrderId': {'S': 'ORD12350'},
+                'CustomerId': {'S': 'CUST67895'},
+                'OrderDate': {'S': '2024-11-28T14:30:00Z'},
+                'OrderTotal': {'N': '199.99'},
+                'OrderStatus': {'S': 'Shipped'},
+                'Items': {'L': [
+                    {'M': {'ItemID': {'S': 'ITEM001'}, 'Quantity': {'N': '2'}, 'Price': {'N': '49.99'}}},
+                    {'M': {'ItemID': {'S': 'ITEM002'}, 'Quantity': {'N': '1'}, 'Price': {'N': '99.99'}}}
+                ]},
+                'GiftWrap': {'BOOL': True}
+            },
+            'SequenceNumber': '100000000021053503235',
+            'SizeBytes': 180,
+            'StreamViewType': 'NEW_AND_OLD_IMAGES'
+        }
+    }
+    sink.add(record, args.bucket, 'orders')
+    sink.flush()
+
+    # Read what was written back through the same client
+    listing = s3_client.list_objects_v2(Bucket=args.bucket, Prefix='orders/')
+    for obj in listing.get('Contents', []):
+        if obj['Key'].endswith('.parquet'):
+            body = s3_client.get_object(Bucket=args.bucket, Key=obj['Key'])['Body'].read()
+            print(obj['Key'])
+            print(pq.read_table(io.BytesIO(body)).to_pylist())
+
+
+if __name__ == '__main__':
+    main()
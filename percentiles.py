@@ -0,0 +1,6 @@
+def percentile(values, fraction):
+    """Nearest-rank percentile of some samples, e.g. fraction=0.99 for p99; 0.0 when there are none"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
@@ -0,0 +1,105 @@
+import random
+import threading
+import time
+
+from metrics import SHARD_LAG
+
+# get_records never returns more than 1000 records per call
+MAX_LIMIT = 1000
+
+
+class AdaptivePoller:
+    """Decide how long to wait before the next get_records call on a shard
+
+    Full pages are followed up immediately, pages with some records wait the
+    floor interval and empty pages back off exponentially (with jitter) up to
+    the ceiling interval.
+    """
+
+    def __init__(self, limit=MAX_LIMIT, min_interval=0.5, max_interval=15,
+                 multiplier=2, jitter=0.5):
+        self.limit = min(limit, MAX_LIMIT)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.empty_polls = 0
+
+    def next_delay(self, record_count):
+        """Return the number of seconds to wait after a page of record_count records"""
+        if record_count >= self.limit:
+            self.empty_polls = 0
+            return 0
+        if record_count:
+            self.empty_polls = 0
+            return self.min_interval
+
+        delay = min(self.max_interval, self.min_interval * self.multiplier ** self.empty_polls)
+        self.empty_polls += 1
+        # Spread idle shards out so they don't all poll at the same moment
+        return delay * (1 - self.jitter * random.random())
+
+
+def record_timestamp(record):
+    """Return ApproximateCreationDateTime as epoch seconds, or None"""
+    created = record.get('dynamodb', {}).get('ApproximateCreationDateTime')
+    if created is None:
+        return None
+    if isinstance(created, (int, float)):
+        return float(created)
+    return created.timestamp()
+
+
+class PollMetrics:
+    """Track records/sec and end-to-end lag for a stream consumer"""
+
+    def __init__(self, name, report_interval=60):
+        self.name = name
+        self.report_interval = report_interval
+        self.lock = threading.Lock()
+        self.total_records = 0
+        self.window_records = 0
+        self.window_started = time.monotonic()
+        self.lag = {}          # shard_id -> seconds behind the newest record we read
+        self.max_lag = 0.0
+
+    def observe(self, shard_id, records):
+        """Record a get_records page"""
+        now = time.time()
+        with self.lock:
+            self.total_records += len(records)
+            self.window_records += len(records)
+            if records:
+                created = record_timestamp(records[-1])
+                if created is not None:
+                    lag = max(0.0, now - created)
+                    self.lag[shard_id] = lag
+                    self.max_lag = max(self.max_lag, lag)
+            else:
+                # An empty page means we are caught up with this shard
+                self.lag[shard_id] = 0.0
+            lag = self.lag.get(shard_id)
+        if lag is not None:
+            SHARD_LAG.set(lag, table=self.name, shard=shard_id)
+
+    def drained(self, shard_id):
+        """Forget a shard that has been read to its end"""
+        with self.lock:
+            self.lag.pop(shard_id, None)
+        SHARD_LAG.remove(table=self.name, shard=shard_id)
+
+    def maybe_report(self):
+        """Print throughput and lag once per report_interval"""
+        with self.lock:
+            elapsed = time.monotonic() - self.window_started
+            if elapsed < self.report_interval:
+                return
+            rate = self.window_records / elapsed
+            lag = max(self.lag.values(), default=0.0)
+            max_lag = self.max_lag
+            self.window_records = 0
+            self.max_lag = 0.0
+            self.window_started = time.monotonic()
+
+        print(f"{self.name}: {rate:.1f} records/sec, lag {lag:.1f}s (max {max_lag:.1f}s), "
+              f"{self.total_records} records total")
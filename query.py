@@ -0,0 +1,449 @@
+import argparse
+import datetime
+import io
+import json
+import operator
+import re
+import time
+import zlib
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from decimal import Decimal
+
+try:
+    import zstandard
+except ImportError:  # only needed for .zst objects
+    zstandard = None
+
+from checkpoint import sequence_key
+from clients import get_s3_client
+from lake_index import LakeIndex, record_image
+from registry import DEFAULTS
+from sink import PARTITION_SCHEMES
+
+DATA_EXTENSIONS = ('.ndjson', '.ndjson.gz', '.ndjson.zst', '.parquet')
+METADATA_COLUMNS = ('event_id', 'event_name', 'sequence_number', 'approximate_creation_time')
+RANGE_SIZE = 8 * 1024 * 1024
+
+OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+FILTER_PATTERN = re.compile(r'^\s*([\w.]+)\s*(!=|<=|>=|=|<|>)\s*(.*?)\s*$')
+
+
+def parse_filter(text):
+    """Turn 'OrderStatus=Cancelled' into (column, operator, value text)"""
+    match = FILTER_PATTERN.match(text)
+    if not match:
+        raise ValueError(f"Can't parse filter {text!r}, expected column<op>value with op one of "
+                         f"{', '.join(OPERATORS)}")
+    return match.groups()
+
+
+def parse_time(text):
+    """An ISO date or datetime, taken as UTC unless it says otherwise"""
+    value = datetime.datetime.fromisoformat(text.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def coerce(text, like):
+    """Read a filter value as the type of the value it is compared with"""
+    if isinstance(like, bool):
+        return text.lower() == 'true'
+    if isinstance(like, int):
+        return int(text) if re.fullmatch(r'-?\d+', text) else float(text)
+    if isinstance(like, float):
+        return float(text)
+    if isinstance(like, Decimal):
+        return Decimal(text)
+    if isinstance(like, datetime.datetime):
+        return parse_time(text)
+    return text
+
+
+def column_value(row, column):
+    """Look a column up in a row, following dots into nested maps (Address.City)"""
+    value = row
+    for part in column.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def comparable(column, value, text):
+    """Return a row's value and the filter's value in a form that compares correctly"""
+    if column == 'sequence_number':
+        # Digit strings of varying length, so compare them as numbers
+        return sequence_key(value), sequence_key(text)
+    return value, coerce(text, value)
+
+
+def row_matches(row, filters):
+    for column, op, text in filters:
+        value = column_value(row, column)
+        if value is None:
+            return False
+        try:
+            if not OPERATORS[op](*comparable(column, value, text)):
+                return False
+        except (TypeError, ValueError, ArithmeticError):
+            return False
+    return True
+
+
+def row_time(row):
+    created = row.get('approximate_creation_time')
+    if isinstance(created, str):
+        return parse_time(created)
+    return created
+
+
+def rules_out(op, value, low, high):
+    """True when no value within [low, high] can satisfy `column op value`"""
+    if op == '=' and (value < low or value > high):
+        return True
+    if op == '!=' and low == high == value:
+        return True
+    if (op == '<' and low >= value) or (op == '<=' and low > value):
+        return True
+    if (op == '>' and high <= value) or (op == '>=' and high < value):
+        return True
+    return False
+
+
+def might_match(entry, filters, since=None, until=None):
+    """False when an index entry proves no row of its object can match"""
+    if since and entry.get('last_event_time') and parse_time(entry['last_event_time']) < since:
+        return False
+    if until and entry.get('first_event_time') and parse_time(entry['first_event_time']) >= until:
+        return False
+    if not entry.get('complete'):
+        return True
+
+    columns = entry.get('columns') or {}
+    for column, op, text in filters:
+        if column == 'sequence_number':
+            low, high = entry.get('min_sequence_number'), entry.get('max_sequence_number')
+            bounds = (low, high) if low and high else None
+        elif column in METADATA_COLUMNS:
+            continue
+        elif column in columns:
+            bounds = columns[column]
+        else:
+            # The index holds every scalar up to one map deep (Parent.Child), so
+            # for those absence means no record has it. Deeper paths aren't
+            # indexed, and != also matches the lists and maps that aren't
+            if column.count('.') <= 1 and op != '!=':
+                return False
+            continue
+        if bounds is None:
+            continue
+        low, high = bounds
+        try:
+            if column == 'sequence_number':
+                value, low, high = sequence_key(text), sequence_key(low), sequence_key(high)
+            else:
+                value = coerce(text, low)
+            if rules_out(op, value, low, high):
+                return False
+        except (TypeError, ValueError, ArithmeticError):
+            continue
+    return True
+
+
+def day_partitions(since, until, scheme):
+    """Listing prefixes under the table prefix that can hold events in [since, until)
+
+    Objects written before the sink split batches by partition sit under
+    their first record's partition, so the partition just before since (the
+    last hour of the previous day, with hourly partitions) is listed as well;
+    the index entries' event times prune what doesn't reach into the range.
+    """
+    if scheme == 'none' or not since or not until:
+        return ['']
+    days = []
+    before = since - datetime.timedelta(microseconds=1)
+    if before.date() != since.date():
+        days.append(before.strftime(PARTITION_SCHEMES[scheme]))
+    day = since.date()
+    while day < until.date() or (day == until.date() and until.time() != datetime.time(0)):
+        days.append(day.strftime(PARTITION_SCHEMES['day']))
+        day += datetime.timedelta(days=1)
+    return days
+
+
+def list_data_objects(s3_client, bucket_name, prefix, partition):
+    """Return {key: size} of the lake objects under prefix/partition, leaving out _index and friends"""
+    objects = {}
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{prefix}/{partition}"):
+        for obj in page.get('Contents', []):
+            path = obj['Key'][len(prefix) + 1:]
+            if any(part.startswith('_') for part in path.split('/')):
+                continue
+            if obj['Key'].endswith(DATA_EXTENSIONS):
+                objects[obj['Key']] = obj['Size']
+    return objects
+
+
+def get_range(s3_client, bucket_name, key, start, end):
+    response = s3_client.get_object(Bucket=bucket_name, Key=key, Range=f"bytes={start}-{end}")
+    return response['Body'].read()
+
+
+def read_ranges(s3_client, bucket_name, key, size, executor, range_size=RANGE_SIZE, read_ahead=4):
+    """Yield an object's bytes in order, range_size at a time, with up to read_ahead GETs in flight"""
+    pending = deque()
+    for start in range(0, size, range_size):
+        end = min(start + range_size, size) - 1
+        pending.append(executor.submit(get_range, s3_client, bucket_name, key, start, end))
+        if len(pending) >= read_ahead:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def decompress(chunks, key):
+    """Decompress a stream of chunks by the key's extension"""
+    if key.endswith('.gz'):
+        # GzipNdjsonFormat objects are many gzip members back to back
+        decompressor = zlib.decompressobj(31)
+        for chunk in chunks:
+            while chunk:
+                yield decompressor.decompress(chunk)
+                if not decompressor.eof:
+                    break
+                chunk = decompressor.unused_data
+                decompressor = zlib.decompressobj(31)
+    elif key.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError("zstandard is required to read .zst objects: pip install zstandard")
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        for chunk in chunks:
+            yield decompressor.decompress(chunk)
+    else:
+        yield from chunks
+
+
+def ndjson_rows(chunks):
+    """Yield a row per record line: the metadata columns plus the plain NewImage (or Keys)"""
+    tail = b''
+    for data in chunks:
+        lines = (tail + data).split(b'\n')
+        tail = lines.pop()
+        for line in lines:
+            if line:
+                yield _ndjson_row(json.loads(line))
+    if tail.strip():
+        yield _ndjson_row(json.loads(tail))
+
+
+def _ndjson_row(record):
+    stream = record.get('dynamodb', {})
+    row = {
+        'event_id': record.get('eventID'),
+        'event_name': record.get('eventName'),
+        'sequence_number': stream.get('SequenceNumber'),
+        'approximate_creation_time': stream.get('ApproximateCreationDateTime'),
+    }
+    row.update(record_image(record))
+    return row
+
+
+class S3RangeFile(io.RawIOBase):
+    """A read-only, seekable file over an S3 object; every read is one ranged GET"""
+
+    def __init__(self, s3_client, bucket_name, key, size):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def readinto(self, buffer):
+        end = min(self.position + len(buffer), self.size)
+        if end <= self.position:
+            return 0
+        data = get_range(self.s3_client, self.bucket_name, self.key, self.position, end - 1)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def parquet_rows(s3_client, bucket_name, key, size, columns=None):
+    """Yield rows of a Parquet object, reading the footer and only the wanted column chunks"""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("pyarrow is required to read Parquet objects: pip install pyarrow")
+    parquet = pq.ParquetFile(S3RangeFile(s3_client, bucket_name, key, size))
+    wanted = None
+    if columns:
+        wanted = [name for name in parquet.schema_arrow.names if name in columns]
+    for batch in parquet.iter_batches(columns=wanted):
+        yield from batch.to_pylist()
+
+
+class LakeQuery:
+    """Filter and project the rows of one table prefix, skipping objects the lake index rules out
+
+    Objects are listed per day partition (when a time range is given, plus
+    the partition just before it), pruned on their index entries, then decoded workers at a time: NDJSON
+    through ranged GETs read ahead concurrently and decompressed as they
+    arrive, Parquet through its footer and the needed column chunks only.
+    """
+
+    def __init__(self, s3_client, bucket_name, prefix, filters=(), select=None, since=None, until=None,
+                 partition='hour', workers=8, range_size=RANGE_SIZE):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix.rstrip('/')
+        self.filters = [parse_filter(text) if isinstance(text, str) else text for text in filters]
+        self.select = select
+        self.since = since
+        self.until = until
+        self.partition = partition
+        self.workers = workers
+        self.range_size = range_size
+        self.scanned = 0
+        self.pruned = 0
+        self.bytes_read = 0
+
+    def plan(self):
+        """Return [(key, size)] of the objects that may hold matching rows"""
+        objects = {}
+        entries = {}
+        index = LakeIndex(self.s3_client)
+        for partition in day_partitions(self.since, self.until, self.partition):
+            objects.update(list_data_objects(self.s3_client, self.bucket_name, self.prefix, partition))
+            entries.update(index.load(self.bucket_name, self.prefix, partition))
+
+        planned = []
+        for key, size in sorted(objects.items()):
+            entry = entries.get(key)
+            if entry is not None and not might_match(entry, self.filters, self.since, self.until):
+                self.pruned += 1
+                continue
+            planned.append((key, size))
+        return planned
+
+    def needed_columns(self):
+        if not self.select:
+            return None
+        columns = {column.split('.')[0] for column in self.select}
+        columns.update(column.split('.')[0] for column, _, _ in self.filters)
+        columns.add('approximate_creation_time')
+        return columns
+
+    def scan_object(self, key, size, range_executor):
+        """Return the matching, projected rows of one object"""
+        if key.endswith('.parquet'):
+            rows = parquet_rows(self.s3_client, self.bucket_name, key, size, self.needed_columns())
+        else:
+            chunks = read_ranges(self.s3_client, self.bucket_name, key, size, range_executor,
+                                 self.range_size)
+            rows = ndjson_rows(decompress(chunks, key))
+
+        matched = []
+        for row in rows:
+            if self.since or self.until:
+                created = row_time(row)
+                if created and ((self.since and created < self.since)
+                                or (self.until and created >= self.until)):
+                    continue
+            if not row_matches(row, self.filters):
+                continue
+            if self.select:
+                row = {column: column_value(row, column) for column in self.select}
+            matched.append(row)
+        return matched
+
+    def rows(self, limit=None):
+        """Yield matching rows, object by object as they finish"""
+        planned = self.plan()
+        returned = 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='scan') as executor, \
+                ThreadPoolExecutor(max_workers=self.workers * 4, thread_name_prefix='range') as ranges:
+            queue = deque(planned)
+            running = set()
+            while queue or running:
+                # Only keep workers' worth of objects in flight
+                while queue and len(running) < self.workers:
+                    key, size = queue.popleft()
+                    running.add(executor.submit(self.scan_object, key, size, ranges))
+                    self.scanned += 1
+                    self.bytes_read += size
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for row in future.result():
+                        yield row
+                        returned += 1
+                        if limit and returned >= limit:
+                            for other in running:
+                                other.cancel()
+                            return
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query a table prefix of the lake with simple filters')
+    parser.add_argument('prefix', help='e.g. orders or customers')
+    parser.add_argument('--bucket', default=DEFAULTS['bucket_name'])
+    parser.add_argument('--where', action='append', default=[],
+                        help='column<op>value, e.g. OrderStatus=Cancelled or Address.State=TX; '
+                             'ops are = != < <= > >=, repeat to AND them')
+    parser.add_argument('--select', help='comma-separated columns to print, default all')
+    parser.add_argument('--date', help='only events on this UTC day, e.g. 2024-11-28')
+    parser.add_argument('--since', help='only events at or after this ISO time')
+    parser.add_argument('--until', help='only events before this ISO time')
+    parser.add_argument('--partition', default=DEFAULTS['partition'], choices=sorted(PARTITION_SCHEMES),
+                        help='how the prefix is partitioned, as in pipelines.yaml')
+    parser.add_argument('--workers', type=int, default=8, help='objects decoded at once')
+    parser.add_argument('--limit', type=int)
+    args = parser.parse_args()
+
+    since = parse_time(args.since) if args.since else None
+    until = parse_time(args.until) if args.until else None
+    if args.date:
+        since = parse_time(args.date)
+        until = since + datetime.timedelta(days=1)
+
+    query = LakeQuery(get_s3_client(), args.bucket, args.prefix, args.where,
+                      select=args.select.split(',') if args.select else None,
+                      since=since, until=until, partition=args.partition, workers=args.workers)
+    start = time.perf_counter()
+    count = 0
+    for row in query.rows(args.limit):
+        print(json.dumps(row, default=str))
+        count += 1
+    elapsed = time.perf_counter() - start
+    print(f"{count} rows from {query.scanned} objects ({query.bytes_read} bytes), "
+          f"{query.pruned} pruned by the index, in {elapsed:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+import contextlib
+import os
+import threading
+
+try:
+    import yaml
+except ImportError:  # only needed for .yaml/.yml configs
+    yaml = None
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11, TOML configs need the tomli backport
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+from sink import PARTITION_SCHEMES
+
+# Next to this module, so scripts find it from any working directory
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pipelines.yaml')
+FORMATS = ('ndjson', 'parquet')
+# Keyword arguments of poller.AdaptivePoller a config's poller block may set
+POLLER_OPTIONS = ('limit', 'min_interval', 'max_interval', 'multiplier', 'jitter')
+
+# Used for any setting a config file leaves out
+DEFAULTS = {
+    'bucket_name': 'quarkstail-datalake-s3-bucket',
+    'format': 'ndjson',
+    'partition': 'hour',
+    'concurrency': 4,
+    'max_workers': 8,
+    'max_records': 5000,
+    'max_bytes': 8 * 1024 * 1024,
+    'max_age': 60,
+    'compact': False,
+    'unmarshal': False,
+    'index': True,
+    'poller': {}
+}
+
+
+def load_config(path=DEFAULT_CONFIG):
+    """Read a pipeline config from YAML or TOML and fill in defaults
+
+    Returns {'max_calls', 'reload_interval', 'tables': [table config, ...]};
+    each table config carries every key of DEFAULTS plus table_name and prefix.
+    A table's poller block is merged over the one in defaults, key by key.
+    """
+    with open(path, 'rb') as f:
+        if path.endswith('.toml'):
+            if tomllib is None:
+                raise ImportError("tomli is required for TOML configs on Python < 3.11: pip install tomli")
+            raw = tomllib.load(f)
+        else:
+            if yaml is None:
+                raise ImportError("PyYAML is required for YAML configs: pip install pyyaml")
+            raw = yaml.safe_load(f) or {}
+
+    defaults = dict(DEFAULTS, **raw.get('defaults', {}))
+    tables = []
+    seen = set()
+    for entry in raw.get('tables', []):
+        config = dict(defaults, **entry)
+        config['poller'] = dict(defaults.get('poller') or {}, **(entry.get('poller') or {}))
+        name = config.get('table_name')
+        if not name:
+            raise ValueError(f"{path}: every table needs a table_name")
+        if name in seen:
+            raise ValueError(f"{path}: {name} is listed twice")
+        if config['format'] not in FORMATS:
+            raise ValueError(f"{path}: {name} has unknown format {config['format']!r}")
+        if config['partition'] not in PARTITION_SCHEMES:
+            raise ValueError(f"{path}: {name} has unknown partition {config['partition']!r}")
+        unknown = set(config['poller']) - set(POLLER_OPTIONS)
+        if unknown:
+            raise ValueError(f"{path}: {name} has unknown poller options {sorted(unknown)}, "
+                             f"expected some of {', '.join(POLLER_OPTIONS)}")
+        config.setdefault('prefix', f"{name.lower()}s")
+        seen.add(name)
+        tables.append(config)
+
+    return {
+        'max_calls': raw.get('max_calls', 32),
+        'reload_interval': raw.get('reload_interval', 30),
+        'tables': tables
+    }
+
+
+def table_config(table_name, path=DEFAULT_CONFIG):
+    """Return one table's config, or the defaults if the file is missing or does not list it"""
+    if os.path.exists(path):
+        for config in load_config(path)['tables']:
+            if config['table_name'] == table_name:
+                return config
+    return dict(DEFAULTS, table_name=table_name, prefix=f"{table_name.lower()}s")
+
+
+class LimitedClient:
+    """Wrap a client so every call holds a slot of each semaphore while it runs
+
+    Semaphores are always taken in the same order (per table, then global),
+    so callers can't deadlock each other.
+    """
+
+    def __init__(self, client, *limits):
+        self.client = client
+        self.limits = limits
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            with contextlib.ExitStack() as stack:
+                for limit in self.limits:
+                    stack.enter_context(limit)
+                return attribute(*args, **kwargs)
+        return call
+
+
+class _Running:
+    def __init__(self, config, thread, stop_event, sink):
+        self.config = config
+        self.thread = thread
+        self.stop_event = stop_event
+        self.sink = sink
+
+
+class PipelineRegistry:
+    """Run one stream consumer per configured table and follow changes to the config file
+
+    The file is checked every reload_interval seconds. New tables are
+    started, removed ones are stopped and flushed, and tables whose settings
+    changed are restarted; untouched tables keep running. Every table's
+    stream calls share one global semaphore of max_calls slots, and each
+    table is held to its own concurrency on top of that.
+
+    run_table(client, table, config, sink, stop_event) runs a table's
+    consumer until stop_event is set; make_sink(config) builds its sink.
+    """
+
+    def __init__(self, path, dynamodb, streams_client, make_sink, run_table, stop_event=None):
+        self.path = path
+        self.dynamodb = dynamodb
+        self.streams_client = streams_client
+        self.make_sink = make_sink
+        self.run_table = run_table
+        self.stop_event = stop_event or threading.Event()
+        self.running = {}        # table_name -> _Running
+        self.call_limit = None
+        self.max_calls = None
+        self.mtime = None
+        self.lock = threading.Lock()
+
+    def run(self):
+        """Start every table, then reload the config when it changes until stopped"""
+        config = load_config(self.path)
+        self.mtime = os.path.getmtime(self.path)
+        self.max_calls = config['max_calls']
+        self.call_limit = threading.BoundedSemaphore(self.max_calls)
+        self.apply(config)
+
+        try:
+            while not self.stop_event.wait(config['reload_interval']):
+                try:
+                    mtime = os.path.getmtime(self.path)
+                    if mtime == self.mtime:
+                        continue
+                    self.mtime = mtime
+                    config = load_config(self.path)
+                except Exception as e:
+                    # Keep running the last good config
+                    print(f"Error reloading {self.path}: {e}")
+                    continue
+                print(f"Reloading {self.path}")
+                if config['max_calls'] != self.max_calls:
+                    print(f"max_calls changed to {config['max_calls']}, takes effect on restart")
+                self.apply(config)
+        finally:
+            self.stop()
+
+    def apply(self, config):
+        """Start, stop and restart tables so the running set matches config"""
+        wanted = {table['table_name']: table for table in config['tables']}
+        with self.lock:
+            changed = [name for name, running in self.running.items()
+                       if wanted.get(name) != running.config]
+        for name in changed:
+            self.stop_table(name)
+        for name, table in wanted.items():
+            if name not in self.running and not self.stop_event.is_set():
+                self.start_table(table)
+
+    def start_table(self, config):
+        name = config['table_name']
+        table = self.dynamodb.Table(name)
+        client = LimitedClient(self.streams_client,
+                               threading.BoundedSemaphore(config['concurrency']), self.call_limit)
+        sink = self.make_sink(config)
+        stop_event = threading.Event()
+        thread = threading.Thread(target=self.run_table,
+                                  args=(client, table, config, sink, stop_event),
+                                  name=f"table-{name}")
+        with self.lock:
+            self.running[name] = _Running(config, thread, stop_event, sink)
+        thread.start()
+        print(f"Started pipeline for {name} -> {config['bucket_name']}/{config['prefix']}")
+
+    def stop_table(self, name):
+        with self.lock:
+            running = self.running.pop(name, None)
+        if running is None:
+            return
+        running.stop_event.set()
+        running.thread.join()
+        running.sink.flush()
+        print(f"Stopped pipeline for {name}")
+
+    def stop(self):
+        """Stop every table and flush its sink"""
+        self.stop_event.set()
+        for name in list(self.running):
+            self.stop_table(name)
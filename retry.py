@@ -0,0 +1,153 @@
+import random
+import time
+
+from metrics import REGISTRY, error_reason
+
+THROTTLE_CODES = {
+    'ProvisionedThroughputExceededException', 'ThrottlingException',
+    'LimitExceededException', 'RequestLimitExceeded', 'SlowDown'
+}
+FATAL_CODES = {
+    'ValidationException', 'AccessDeniedException', 'UnrecognizedClientException',
+    'InvalidSignatureException', 'ExpiredTokenException'
+}
+
+RECOVERIES = REGISTRY.counter(
+    'datalake_shard_recoveries_total', 'Shard read failures recovered from, by kind', ('kind',))
+RECOVERY_SECONDS = REGISTRY.histogram(
+    'datalake_shard_recovery_seconds',
+    'Time from the first failed call to the next successful get_records', ('kind',))
+
+
+def classify(error):
+    """Return how a failed stream call should be retried
+
+    throttle: back off for milliseconds to seconds; expired: rebuild the
+    iterator from the last processed record; trimmed: the position is gone,
+    restart at TRIM_HORIZON; missing: the shard left the stream, treat it as
+    drained; fatal: give up on the shard; transient: anything else.
+    """
+    code = error_reason(error)
+    if code in THROTTLE_CODES:
+        return 'throttle'
+    if code == 'ExpiredIteratorException':
+        return 'expired'
+    if code == 'TrimmedDataAccessException':
+        return 'trimmed'
+    if code == 'ResourceNotFoundException':
+        return 'missing'
+    if code in FATAL_CODES:
+        return 'fatal'
+    return 'transient'
+
+
+class Backoff:
+    """Full-jitter exponential backoff: a random delay up to base * 2^attempt, capped"""
+
+    def __init__(self, base, cap):
+        self.base = base
+        self.cap = cap
+        self.attempt = 0
+
+    def next_delay(self):
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** self.attempt))
+        self.attempt += 1
+        return delay
+
+    def reset(self):
+        self.attempt = 0
+
+
+class ShardCursor:
+    """Where we are in a shard, and how to get back there after a failed call
+
+    The iterator is (re)built lazily by refresh(): from the last processed
+    SequenceNumber with AFTER_SEQUENCE_NUMBER once we have one, otherwise
+    from the position the shard was started at.
+    """
+
+    def __init__(self, stream_arn, shard_id, iterator_type, sequence_number=None,
+                 throttle_backoff=(0.05, 5), error_backoff=(1, 30)):
+        self.stream_arn = stream_arn
+        self.shard_id = shard_id
+        self.iterator_type = iterator_type
+        self.sequence_number = sequence_number
+        self.last_sequence = None
+        self.iterator = None
+        self.stale = True            # the iterator has to be fetched before the next read
+        self.drained = False         # the shard is closed and fully read, or gone
+        self.throttle = Backoff(*throttle_backoff)
+        self.errors = Backoff(*error_backoff)
+        self.failed_since = None
+        self.failure_kind = None
+
+    def position(self):
+        """Return (iterator type, sequence number) to resume from"""
+        if self.last_sequence is not None:
+            return 'AFTER_SEQUENCE_NUMBER', self.last_sequence
+        return self.iterator_type, self.sequence_number
+
+    def refresh(self, dynamodb_client):
+        """Fetch a new iterator for the current position"""
+        iterator_type, sequence_number = self.position()
+        kwargs = {
+            'StreamArn': self.stream_arn,
+            'ShardId': self.shard_id,
+            'ShardIteratorType': iterator_type
+        }
+        if sequence_number is not None:
+            kwargs['SequenceNumber'] = sequence_number
+        self.iterator = dynamodb_client.get_shard_iterator(**kwargs)['ShardIterator']
+        self.stale = False
+
+    def advance(self, response):
+        """Move past a successful get_records page"""
+        records = response['Records']
+        if records:
+            self.last_sequence = records[-1]['dynamodb']['SequenceNumber']
+        self.iterator = response.get('NextShardIterator')
+        # NextShardIterator is absent once a closed shard has been fully read
+        self.drained = self.iterator is None
+
+        if self.failed_since is not None:
+            RECOVERY_SECONDS.observe(time.monotonic() - self.failed_since, kind=self.failure_kind)
+            RECOVERIES.inc(kind=self.failure_kind)
+            self.failed_since = None
+        self.throttle.reset()
+        self.errors.reset()
+
+    def failed(self, error):
+        """Handle a failed call; return the seconds to wait before the next one
+
+        Raises the error again when it cannot be retried.
+        """
+        kind = classify(error)
+        if kind == 'fatal':
+            raise error
+        if self.failed_since is None:
+            self.failed_since = time.monotonic()
+            self.failure_kind = kind
+
+        if kind == 'throttle':
+            return self.throttle.next_delay()
+        if kind == 'expired':
+            # Iterators live 15 minutes; a fresh one from our position loses nothing
+            self.stale = True
+            return 0
+        if kind == 'trimmed':
+            print(f"Shard {self.shard_id}: position {self.position()} is past the stream's "
+                  f"24h retention, restarting at TRIM_HORIZON; older records are lost")
+            self.iterator_type, self.sequence_number = 'TRIM_HORIZON', None
+            self.last_sequence = None
+            self.stale = True
+            return 0
+        if kind == 'missing':
+            # The shard aged out of the stream; its children can go ahead
+            print(f"Shard {self.shard_id} no longer exists, handing off to its children")
+            RECOVERIES.inc(kind=kind)
+            self.iterator = None
+            self.drained = True
+            return 0
+
+        # The iterator is still good for anything else, e.g. a dropped connection
+        return self.errors.next_delay()
@@ -4,6 +4,8 @@ import time
 from decimal import Decimal
 import datetime
 from tzlocal import get_localzone
+from clients import get_s3_client
+from registry import table_config
 
 # Custom JSON encoder for Decimal and datetime serialization
 class DecimalEncoder(json.JSONEncoder):
@@ -135,15 +137,16 @@ def insert_sample_item(table,sample_no):
 '''
     
 # Initialize the S3 client
-s3_client = boto3.client('s3')
+s3_client = get_s3_client()
 
-# Your S3 bucket name
-bucket_name = 'quarkstail-datalake-s3-bucket'  
+# Bucket and prefix come from the Customer pipeline in pipelines.yaml
+customer_config = table_config('Customer')
+bucket_name = customer_config['bucket_name']
 def upload_to_s3(record):
         # Upload the JSON string to S3 as an object
     try:
         record_json = json.dumps(record, indent=2, cls=DecimalEncoder)
-        s3_key = f"customers/{record['eventID']}.json"
+        s3_key = f"{customer_config['prefix']}/{record['eventID']}.json"
         response = s3_client.put_object(
             Bucket=bucket_name,
             Key=s3_key,
@@ -0,0 +1,238 @@
+import contextlib
+import logging
+import threading
+
+from checkpoint import sequence_key
+from metrics import RECORDS_READ, RETRIES, STAGE_SECONDS, error_reason
+from poller import AdaptivePoller, PollMetrics
+from retry import ShardCursor
+
+logger = logging.getLogger(__name__)
+
+
+def list_shards(dynamodb_client, stream_arn):
+    """Page through describe_stream and return every shard of the stream"""
+    shards = []
+    kwargs = {'StreamArn': stream_arn}
+    while True:
+        description = dynamodb_client.describe_stream(**kwargs)['StreamDescription']
+        shards.extend(description['Shards'])
+
+        # describe_stream returns at most 100 shards per call
+        last_shard_id = description.get('LastEvaluatedShardId')
+        if not last_shard_id:
+            return shards
+        kwargs['ExclusiveStartShardId'] = last_shard_id
+
+
+def is_closed(shard):
+    """A shard is closed once it has an ending sequence number"""
+    return 'EndingSequenceNumber' in shard.get('SequenceNumberRange', {})
+
+
+def read_page(dynamodb_client, shard_iterator, limit, name):
+    """Call get_records once, recording its latency, record count and failures"""
+    try:
+        with STAGE_SECONDS.time(stage='get_records'):
+            response = dynamodb_client.get_records(ShardIterator=shard_iterator, Limit=limit)
+    except Exception as e:
+        RETRIES.inc(operation='get_records', reason=error_reason(e))
+        raise
+    RECORDS_READ.inc(len(response['Records']), table=name)
+    logger.debug('get_records response for %s: %s', name, response)
+    return response
+
+
+def start_position(shard, checkpointed, initial):
+    """Return (iterator type, sequence number) for a newly seen shard, or None to skip it"""
+    sequence_number = checkpointed.get(shard['ShardId'])
+    if sequence_number:
+        ending = shard['SequenceNumberRange'].get('EndingSequenceNumber')
+        if ending and sequence_key(sequence_number) >= sequence_key(ending):
+            return None
+        return ('AFTER_SEQUENCE_NUMBER', sequence_number)
+
+    # Shards appearing after startup, or while we were down, are read from their first record
+    if not initial or checkpointed:
+        return ('TRIM_HORIZON', None)
+
+    # First run against this stream: only follow new changes
+    if is_closed(shard):
+        return None
+    return ('LATEST', None)
+
+
+def process_shard(dynamodb_client, stream_arn, shard_id, iterator_type,
+                  handle_records, name, stop_event, poller=None, metrics=None,
+                  sequence_number=None, cursor=None, calls=None):
+    """Read a single shard until it is closed or the consumer is stopped
+
+    Returns True once the shard is drained, so its children can be read.
+    Pass a cursor to know where to resume if handle_records raises, and a
+    semaphore as calls to share a cap on get_records calls in flight.
+    """
+    cursor = cursor or ShardCursor(stream_arn, shard_id, iterator_type, sequence_number)
+    poller = poller or AdaptivePoller()
+    print(f"\nWatching shard {shard_id} for {name} records...")
+
+    while not cursor.drained and not stop_event.is_set():
+        try:
+            with calls or contextlib.nullcontext():
+                if cursor.stale:
+                    cursor.refresh(dynamodb_client)
+                response = read_page(dynamodb_client, cursor.iterator, poller.limit, name)
+        except Exception as e:
+            # Raises again for errors retrying can't fix
+            delay = cursor.failed(e)
+            print(f"Error reading shard {shard_id} for {name}, retrying in {delay:.2f}s: {e}")
+            if delay:
+                stop_event.wait(delay)
+            continue
+
+        records = response['Records']
+        # Called on empty pages too so time-based work keeps moving
+        handle_records(shard_id, records)
+        # Only move on once the page is in the sink, so a rebuilt iterator resumes after it
+        cursor.advance(response)
+        if metrics:
+            metrics.observe(shard_id, records)
+            metrics.maybe_report()
+
+        delay = poller.next_delay(len(records))
+        if not cursor.drained and delay:
+            stop_event.wait(delay)
+
+    return cursor.drained
+
+
+class ShardConsumer:
+    """Consume every shard of a stream, reading children only after their parent is drained
+
+    Every shard being read has a thread of its own, so however many shards
+    are open they all keep moving; max_workers caps how many of them can be
+    in a get_records call at once. on_drained, if given, is called with a
+    shard's id once it is drained and before its children are read, e.g. to
+    hand pages still in flight to the sink.
+    """
+
+    def __init__(self, dynamodb_client, stream_arn, handle_records, name=None,
+                 max_workers=8, discovery_interval=60, stop_event=None,
+                 poller_options=None, checkpoints=None, on_drained=None):
+        self.dynamodb_client = dynamodb_client
+        self.stream_arn = stream_arn
+        self.handle_records = handle_records
+        self.name = name or stream_arn
+        self.max_workers = max_workers
+        self.discovery_interval = discovery_interval
+        self.stop_event = stop_event or threading.Event()
+        # Passed to AdaptivePoller: limit, min_interval, max_interval, ...
+        self.poller_options = poller_options or {}
+        self.on_drained = on_drained
+        self.metrics = PollMetrics(self.name)
+        self.checkpoints = checkpoints
+
+        self.shards = {}      # shard_id -> shard description
+        self.pending = {}     # shard_id -> (iterator type, sequence number), waiting on parent or a worker
+        self.running = {}     # shard_id -> thread reading it
+        self.finished = set()
+        self.lock = threading.Lock()
+        self.calls = threading.BoundedSemaphore(max_workers)
+        self.started = False
+
+    def run(self):
+        """Discover shards and keep workers running until stopped"""
+        self.started = True
+        initial = True
+        while not self.stop_event.is_set():
+            try:
+                self.discover(initial)
+                initial = False
+            except Exception as e:
+                print(f"Error discovering shards for {self.name}: {e}")
+            self.stop_event.wait(self.discovery_interval)
+
+        with self.lock:
+            threads = list(self.running.values())
+        for thread in threads:
+            thread.join()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def discover(self, initial=False):
+        """Pick up shards we have not seen yet and schedule the ones that are ready"""
+        checkpointed = {}
+        if self.checkpoints:
+            checkpointed = self.checkpoints.get_all(self.stream_arn)
+
+        for shard in list_shards(self.dynamodb_client, self.stream_arn):
+            shard_id = shard['ShardId']
+            with self.lock:
+                if shard_id in self.shards:
+                    continue
+                self.shards[shard_id] = shard
+
+                position = start_position(shard, checkpointed, initial)
+                if position is None:
+                    # Nothing left on this shard for us to read
+                    self.finished.add(shard_id)
+                    continue
+                self.pending[shard_id] = position
+
+        self.schedule()
+
+    def schedule(self):
+        """Submit every pending shard whose parent has been drained"""
+        with self.lock:
+            if self.stop_event.is_set() or not self.started:
+                return
+            for shard_id in list(self.pending):
+                parent_id = self.shards[shard_id].get('ParentShardId')
+                # A parent missing from the stream has been trimmed already
+                if parent_id in self.shards and parent_id not in self.finished:
+                    continue
+
+                iterator_type, sequence_number = self.pending.pop(shard_id)
+                thread = threading.Thread(target=self._run_shard,
+                                          args=(shard_id, iterator_type, sequence_number),
+                                          name=f"shard-{self.name}-{shard_id}", daemon=True)
+                self.running[shard_id] = thread
+                thread.start()
+
+    def _run_shard(self, shard_id, iterator_type, sequence_number=None):
+        drained = False
+        cursor = ShardCursor(self.stream_arn, shard_id, iterator_type, sequence_number)
+        try:
+            drained = process_shard(
+                self.dynamodb_client,
+                self.stream_arn,
+                shard_id,
+                iterator_type,
+                self.handle_records,
+                self.name,
+                self.stop_event,
+                poller=AdaptivePoller(**self.poller_options),
+                metrics=self.metrics,
+                cursor=cursor,
+                calls=self.calls
+            )
+            if drained and self.on_drained:
+                self.on_drained(shard_id)
+        except Exception as e:
+            print(f"Shard {shard_id} for {self.name} stopped: {e}")
+            # Children keep waiting, the next discovery pass runs the shard out again
+            drained = False
+        finally:
+            with self.lock:
+                self.running.pop(shard_id, None)
+                if drained:
+                    self.finished.add(shard_id)
+                else:
+                    # Stay registered so children keep waiting; the next
+                    # discovery pass resumes from the last page handled
+                    self.pending[shard_id] = cursor.position()
+
+        if drained:
+            print(f"Shard {shard_id} for {self.name} is drained")
+            self.metrics.drained(shard_id)
+            self.schedule()
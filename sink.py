@@ -0,0 +1,384 @@
+import datetime
+import json
+import threading
+import time
+import uuid
+
+from checkpoint import sequence_key
+from encoder import get_encoder
+from metrics import (BYTES_WRITTEN, COMPACTION_RATIO, RECORDS_COMPACTED, RECORDS_DEAD_LETTERED,
+                     RECORDS_WRITTEN, RETRIES, STAGE_SECONDS, error_reason)
+from unmarshal import Unmarshaller
+
+
+def event_time(record):
+    """Return the UTC creation time of a stream record, falling back to now"""
+    created = record.get('dynamodb', {}).get('ApproximateCreationDateTime')
+    if isinstance(created, datetime.datetime):
+        if created.tzinfo is None:
+            return created.replace(tzinfo=datetime.timezone.utc)
+        return created.astimezone(datetime.timezone.utc)
+    if isinstance(created, (int, float)):
+        return datetime.datetime.fromtimestamp(created, datetime.timezone.utc)
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def record_key(record):
+    """Identify the item a stream record is about: its table and primary key"""
+    keys = record['dynamodb']['Keys']
+    return (record.get('eventSourceARN'),
+            tuple(sorted((name, tuple(value.items())) for name, value in keys.items())))
+
+
+# Directory layout under a prefix for each partition scheme
+PARTITION_SCHEMES = {
+    'hour': 'dt=%Y-%m-%d/hour=%H/',
+    'day': 'dt=%Y-%m-%d/',
+    'none': ''
+}
+
+
+DEAD_LETTER_DIR = '_dead_letter'
+
+
+def partition_path(timestamp, scheme='hour'):
+    """Return the partition directories for a time, such as dt=2024-11-28/hour=14/"""
+    return timestamp.strftime(PARTITION_SCHEMES[scheme])
+
+
+def partition_key(prefix, timestamp, extension, scheme='hour'):
+    """Build a time-partitioned object key such as orders/dt=2024-11-28/hour=14/..."""
+    return (f"{prefix}/{partition_path(timestamp, scheme)}"
+            f"{timestamp:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:12]}{extension}")
+
+
+class NdjsonFormat:
+    """Write each record as one line of JSON"""
+
+    extension = '.ndjson'
+    content_type = 'application/x-ndjson'
+
+    def __init__(self, serialize):
+        self.serialize = serialize
+
+    def encode_record(self, record):
+        """Return the buffered item for a record and its size in bytes"""
+        line = self.serialize(record)
+        if isinstance(line, str):
+            line = line.encode('utf-8')
+        line += b'\n'
+        return line, len(line)
+
+    def build(self, items):
+        """Return the object body for a buffer of items"""
+        return b''.join(items)
+
+
+# Decoders compiled per table, shared by every sink; numbers come out as ints
+# and floats where those are exact and as Decimals otherwise, so the encoders
+# write the digits DynamoDB had and only the rare long number takes the slow path
+unmarshaller = Unmarshaller(numbers='native')
+
+
+def make_record_format(format_name, table_name=None, unmarshal=False):
+    """Return the sink format for a table's 'format' setting"""
+    if format_name == 'parquet':
+        # pyarrow is only needed when a table asks for parquet
+        from parquet_sink import ParquetFormat
+        return ParquetFormat()
+    if unmarshal and table_name:
+        # Write plain values instead of DynamoDB-typed images
+        return get_encoder(unmarshal=True, image_decoder=unmarshaller.image_decoder(table_name))
+    return get_encoder()
+
+
+def dead_letter_body(items):
+    """One JSON line per buffered item, whatever the format buffers"""
+    lines = []
+    for item in items:
+        if isinstance(item, bytes):
+            lines.append(item if item.endswith(b'\n') else item + b'\n')
+        else:
+            lines.append(json.dumps(item, default=str).encode('utf-8') + b'\n')
+    return b''.join(lines)
+
+
+def _add_stats(holder, stats, count):
+    """Fold an item's ObjectStats into a buffer's or stream's; count is for items without any"""
+    if stats is None:
+        holder.unindexed += count
+    elif holder.stats is None:
+        holder.stats = stats
+    else:
+        holder.stats.merge(stats)
+
+
+def _add_positions(holder, positions):
+    """Record the newest sequence number per shard in a buffer or stream, and the oldest one"""
+    holder.positions.update(positions)
+    for position, sequence_number in positions.items():
+        holder.oldest.setdefault(position, sequence_number)
+
+
+def _older_pending(position, sequence_number, holders):
+    """Whether any of holders still has records of a shard from before sequence_number"""
+    return any(position in holder.oldest
+               and sequence_key(holder.oldest[position]) < sequence_key(sequence_number)
+               for holder in holders)
+
+
+class _Buffer:
+    def __init__(self):
+        self.items = []
+        self.records = 0
+        self.size = 0
+        self.opened = time.monotonic()
+        self.first_event_time = None
+        self.positions = {}      # (stream_arn, shard_id) -> last SequenceNumber buffered
+        self.oldest = {}         # (stream_arn, shard_id) -> first SequenceNumber buffered
+        self.received = 0        # records added, before compaction
+        self.latest = {}         # record key -> (sequence, index in items, size) when compacting
+        self.stats = None        # lake_index.ObjectStats of what was added, when indexing
+        self.unindexed = 0       # records added without stats
+
+    def add(self, item, size, count, compact_key=None):
+        self.received += count
+        if compact_key is not None:
+            key, sequence = compact_key
+            previous = self.latest.get(key)
+            if previous is not None:
+                previous_sequence, index, previous_size = previous
+                if sequence < previous_sequence:
+                    return  # older than the image we already hold
+                # Blank the slot so the rest of the batch stays in arrival order
+                self.items[index] = None
+                self.records -= 1
+                self.size -= previous_size
+            self.latest[key] = (sequence, len(self.items), size)
+        self.items.append(item)
+        self.records += count
+        self.size += size
+
+
+class S3BatchWriter:
+    """Buffer stream records per bucket/prefix/partition and write each buffer as one object
+
+    record_format is either a format object (NdjsonFormat, ParquetFormat) or a
+    serialize callable, which is written as newline-delimited JSON.
+
+    With compact=True only the latest image per primary key (by SequenceNumber)
+    is kept within each buffer, so a key updated several times in one window
+    lands as a single row; REMOVE events are kept as tombstones.
+
+    A buffer is flushed as soon as it reaches max_bytes, max_records or
+    max_age seconds, whichever comes first. Callers drive age-based flushes
+    through flush_due() and must call flush() on shutdown so nothing is left
+    behind. After every successful upload on_flush is called with the last
+    sequence number written per (stream_arn, shard_id), which is what gets
+    checkpointed; a shard whose older records still sit in another partition's
+    buffer is held back until that one is written too. With an indexer (lake_index.LakeIndex) every object also
+    gets an index entry describing its rows.
+    """
+
+    def __init__(self, s3_client, record_format, max_bytes=8 * 1024 * 1024,
+                 max_records=5000, max_age=60, on_flush=None, compact=False, partition='hour',
+                 indexer=None):
+        self.s3_client = s3_client
+        if not hasattr(record_format, 'encode_record'):
+            record_format = NdjsonFormat(record_format)
+        self.format = record_format
+        self.max_bytes = max_bytes
+        self.max_records = max_records
+        self.max_age = max_age
+        self.on_flush = on_flush
+        self.compact = compact
+        self.partition = partition
+        self.indexer = indexer
+
+        self.buffers = {}        # (bucket_name, prefix, partition) -> _Buffer
+        self.flush_locks = {}    # (bucket_name, prefix, partition) -> lock keeping flushes in order
+        self.flushing = []       # buffers taken out for upload and not yet accounted for
+        self.held_back = {}      # position -> newest sequence number waiting on an older buffer
+        self.lock = threading.Lock()
+
+    def add(self, record, bucket_name, prefix, position=None):
+        """Buffer a record, flushing its buffer if it is full"""
+        started = time.perf_counter()
+        item, size = self.format.encode_record(record)
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage='serialize')
+        positions = None
+        if position is not None:
+            positions = {position: record['dynamodb']['SequenceNumber']}
+        compact_key = None
+        if self.compact:
+            compact_key = (record_key(record), sequence_key(record['dynamodb']['SequenceNumber']))
+        stats = self.indexer.stats(record) if self.indexer else None
+        self.add_encoded(item, size, 1, bucket_name, prefix, event_time(record), positions,
+                         compact_key, stats)
+
+    def add_encoded(self, item, size, count, bucket_name, prefix, first_event_time, positions=None,
+                    compact_key=None, stats=None):
+        """Buffer an item the caller already encoded for this sink's format
+
+        Used when records are encoded elsewhere (e.g. on a process pool); count
+        is how many records the item holds. Only single-record items with a
+        compact_key of (record_key, sequence) take part in compaction. stats
+        are the item's ObjectStats; without them its object is indexed as
+        incomplete. The item goes in the partition of first_event_time, so
+        items of several records must not span partitions.
+        """
+        target = (bucket_name, prefix, partition_path(first_event_time, self.partition))
+
+        with self.lock:
+            buffer = self.buffers.get(target)
+            if buffer is None:
+                buffer = self.buffers[target] = _Buffer()
+                self.flush_locks.setdefault(target, threading.Lock())
+            if buffer.first_event_time is None:
+                buffer.first_event_time = first_event_time
+            buffer.add(item, size, count, compact_key)
+            if positions:
+                _add_positions(buffer, positions)
+            if self.indexer:
+                _add_stats(buffer, stats, count)
+            full = buffer.size >= self.max_bytes or buffer.records >= self.max_records
+
+        if full:
+            self._flush(target)
+
+    def flush_due(self):
+        """Flush every buffer that has been open for longer than max_age"""
+        now = time.monotonic()
+        with self.lock:
+            due = [target for target, buffer in self.buffers.items()
+                   if buffer.items and now - buffer.opened >= self.max_age]
+        for target in due:
+            self._flush(target)
+
+    def flush(self):
+        """Flush every non-empty buffer"""
+        with self.lock:
+            targets = [target for target, buffer in self.buffers.items() if buffer.items]
+        for target in targets:
+            self._flush(target)
+
+    def _flush(self, target):
+        with self.flush_locks[target]:
+            with self.lock:
+                buffer = self.buffers.get(target)
+                if buffer is None or not buffer.items:
+                    return
+                self.buffers[target] = _Buffer()
+                self.flushing.append(buffer)
+
+            bucket_name, prefix, _ = target
+            s3_key = partition_key(prefix, buffer.first_event_time, self.format.extension,
+                                   self.partition)
+            # Compacted-away images leave None behind
+            items = [item for item in buffer.items if item is not None]
+            try:
+                with STAGE_SECONDS.time(stage='build'):
+                    body = self.format.build(items)
+            except Exception as e:
+                # Building it again would fail the same way, so don't retry the batch
+                self._dead_letter(target, buffer, items, e)
+                return
+            try:
+                with STAGE_SECONDS.time(stage='put_object'):
+                    self.s3_client.put_object(
+                        Bucket=bucket_name,
+                        Key=s3_key,
+                        Body=body,
+                        ContentType=self.format.content_type
+                    )
+                print(f"Successfully uploaded {buffer.records} records to {bucket_name}/{s3_key}")
+            except Exception as e:
+                print(f"Error uploading to S3: {e}")
+                # The batch goes back in the buffer and is retried on the next flush
+                RETRIES.inc(operation='put_object', reason=error_reason(e))
+                self._requeue(target, buffer)
+                return
+
+            RECORDS_WRITTEN.inc(buffer.records, prefix=prefix)
+            BYTES_WRITTEN.inc(len(body), prefix=prefix)
+            if self.compact:
+                RECORDS_COMPACTED.inc(buffer.received - buffer.records, prefix=prefix)
+                COMPACTION_RATIO.set(buffer.received / buffer.records, prefix=prefix)
+            if self.indexer:
+                self.indexer.write(bucket_name, prefix, s3_key, buffer.records, len(body),
+                                   buffer.stats, buffer.unindexed == 0, buffer.first_event_time)
+
+            self._checkpoint(buffer)
+
+    def _dead_letter(self, target, buffer, items, error):
+        # Park a batch that can't be built under prefix/_dead_letter/ as JSON lines
+        bucket_name, prefix, _ = target
+        s3_key = partition_key(f"{prefix}/{DEAD_LETTER_DIR}", buffer.first_event_time, '.ndjson',
+                               self.partition)
+        print(f"Error building a batch of {buffer.records} records for {bucket_name}/{prefix}: {error}")
+        try:
+            self.s3_client.put_object(Bucket=bucket_name, Key=s3_key, Body=dead_letter_body(items),
+                                      ContentType='application/x-ndjson')
+        except Exception as e:
+            print(f"Error dead-lettering to S3: {e}")
+            # Retried on the next flush, which fails to build and lands here again
+            RETRIES.inc(operation='put_object', reason=error_reason(e))
+            self._requeue(target, buffer)
+            return
+        print(f"Dead-lettered {buffer.records} records to {bucket_name}/{s3_key}")
+        RECORDS_DEAD_LETTERED.inc(buffer.records, prefix=prefix)
+        # The records are accounted for, so the shards can move past them
+        self._checkpoint(buffer)
+
+    def _checkpoint(self, buffer):
+        with self.lock:
+            self.flushing.remove(buffer)
+            pending = list(self.buffers.values()) + self.flushing
+            positions = {}
+            for position, sequence_number in buffer.positions.items():
+                held = self.held_back.pop(position, sequence_number)
+                newest = max(held, sequence_number, key=sequence_key)
+                # Checkpointing past records still waiting in another partition would lose them
+                if _older_pending(position, newest, pending):
+                    self.held_back[position] = newest
+                else:
+                    positions[position] = newest
+        if self.on_flush and positions:
+            try:
+                self.on_flush(positions)
+            except Exception as e:
+                # The data is in S3, a restart just replays from the previous checkpoint
+                print(f"Error saving checkpoints: {e}")
+
+    def _requeue(self, target, buffer):
+        # Put the failed batch back in front of anything buffered since
+        with self.lock:
+            current = self.buffers[target]
+            offset = len(buffer.items)
+            # A key in both batches keeps only its newest image, as within one batch
+            for key, (sequence, index, size) in current.latest.items():
+                previous = buffer.latest.get(key)
+                if previous is not None:
+                    previous_sequence, previous_index, previous_size = previous
+                    if sequence < previous_sequence:
+                        current.items[index] = None
+                        current.records -= 1
+                        current.size -= size
+                        continue
+                    buffer.items[previous_index] = None
+                    buffer.records -= 1
+                    buffer.size -= previous_size
+                buffer.latest[key] = (sequence, index + offset, size)
+            buffer.items.extend(current.items)
+            buffer.records += current.records
+            buffer.received += current.received
+            buffer.size += current.size
+            buffer.first_event_time = buffer.first_event_time or current.first_event_time
+            buffer.positions.update(current.positions)
+            for position, sequence_number in current.oldest.items():
+                buffer.oldest.setdefault(position, sequence_number)
+            if current.stats is not None:
+                _add_stats(buffer, current.stats, 0)
+            buffer.unindexed += current.unindexed
+            self.buffers[target] = buffer
+            self.flushing.remove(buffer)
@@ -0,0 +1,201 @@
+import argparse
+import datetime
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+from backfill import backfill
+from checkpoint import open_checkpoint_store
+from clients import get_s3_client
+from registry import DEFAULTS
+from sink import S3BatchWriter, make_record_format
+
+
+class CapacityLimiter:
+    """Token bucket in capacity units per second, shared by every scan segment
+
+    Scan only reports what a page cost after the fact, so the bucket is
+    allowed to go into debt and callers sleep until it is paid back.
+    """
+
+    def __init__(self, units_per_second):
+        self.rate = units_per_second
+        self.tokens = units_per_second
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, units):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= units
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+def snapshot_record(table_name, item, key_names, started, region):
+    """Wrap a scanned item as a stream-shaped record so the lake sinks can write it"""
+    keys = {name: item[name] for name in key_names if name in item}
+    event_id = hashlib.md5(json.dumps(keys, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return {
+        'eventID': f"snapshot-{event_id}",
+        'eventName': 'SNAPSHOT',
+        'eventSource': 'aws:dynamodb',
+        'eventSourceARN': f"arn:aws:dynamodb:{region}::table/{table_name}/snapshot",
+        'awsRegion': region,
+        'dynamodb': {
+            'ApproximateCreationDateTime': started,
+            'Keys': keys,
+            'NewImage': item,
+            # Sorts before every real stream record
+            'SequenceNumber': '0',
+            'SizeBytes': len(json.dumps(item, default=str)),
+            'StreamViewType': 'NEW_IMAGE'
+        }
+    }
+
+
+def scan_segment(dynamodb_client, table_name, segment, total_segments, limiter,
+                 handle_items, page_size=100):
+    """Scan one segment page by page; returns (items, consumed RCU)"""
+    kwargs = {
+        'TableName': table_name,
+        'Segment': segment,
+        'TotalSegments': total_segments,
+        'Limit': page_size,
+        'ReturnConsumedCapacity': 'TOTAL'
+    }
+    count = 0
+    consumed = 0.0
+    while True:
+        response = dynamodb_client.scan(**kwargs)
+        units = response.get('ConsumedCapacity', {}).get('CapacityUnits', 0)
+        consumed += units
+        handle_items(response['Items'])
+        count += len(response['Items'])
+        limiter.consume(units)
+
+        if 'LastEvaluatedKey' not in response:
+            return count, consumed
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def stream_watermark(streams_client, stream_arn, workers=8):
+    """Return {shard_id: last sequence number} for every shard as of now"""
+    watermark = {}
+    lock = threading.Lock()
+
+    def track(shard_id, records):
+        if records:
+            with lock:
+                watermark[shard_id] = records[-1]['dynamodb']['SequenceNumber']
+
+    backfill(streams_client, stream_arn, track, workers=workers)
+    return watermark
+
+
+def snapshot_table(table_name, bucket_name, prefix, sink, segments=4, rcu=None,
+                   rcu_fraction=0.5, page_size=100, checkpoints=None):
+    """Export a whole table through the sink and record the stream watermark it started at"""
+    dynamodb = boto3.resource('dynamodb')
+    # The plain client keeps items DynamoDB-typed, the shape stream images have
+    dynamodb_client = boto3.client('dynamodb')
+    streams_client = boto3.client('dynamodbstreams')
+    table = dynamodb.Table(table_name)
+    key_names = [key['AttributeName'] for key in table.key_schema]
+    region = dynamodb_client.meta.region_name
+    stream_arn = table.latest_stream_arn
+
+    if rcu is None:
+        provisioned = table.provisioned_throughput or {}
+        rcu = provisioned.get('ReadCapacityUnits', 0) * rcu_fraction
+    limiter = CapacityLimiter(rcu)
+
+    # Taken before the scan: replaying from here covers every write the scan may have missed
+    started = datetime.datetime.now(datetime.timezone.utc)
+    watermark = stream_watermark(streams_client, stream_arn) if stream_arn else {}
+    print(f"Snapshot of {table_name}: {segments} segments, {rcu or 'unlimited'} RCU/s, "
+          f"watermark on {len(watermark)} shards")
+
+    def handle_items(items):
+        for item in items:
+            sink.add(snapshot_record(table_name, item, key_names, started, region),
+                     bucket_name, prefix)
+        sink.flush_due()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        futures = [executor.submit(scan_segment, dynamodb_client, table_name, segment,
+                                   segments, limiter, handle_items, page_size)
+                   for segment in range(segments)]
+        results = [future.result() for future in futures]
+    sink.flush()
+    elapsed = time.perf_counter() - start
+
+    items = sum(count for count, _ in results)
+    consumed = sum(units for _, units in results)
+    manifest = {
+        'table_name': table_name,
+        'stream_arn': stream_arn,
+        'started_at': started.isoformat(),
+        'finished_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'items': items,
+        'consumed_rcu': consumed,
+        'segments': segments,
+        'watermark': watermark
+    }
+    key = f"{prefix}/_snapshots/{started:%Y%m%dT%H%M%S}.json"
+    sink.s3_client.put_object(Bucket=bucket_name, Key=key,
+                              Body=json.dumps(manifest, indent=2),
+                              ContentType='application/json')
+
+    if checkpoints and watermark:
+        # final.py resumes AFTER_SEQUENCE_NUMBER from here
+        checkpoints.save({(stream_arn, shard_id): sequence_number
+                          for shard_id, sequence_number in watermark.items()})
+
+    print(f"Exported {items} items from {table_name} in {elapsed:.1f}s, "
+          f"{consumed:.1f} RCU consumed, manifest at {bucket_name}/{key}")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a whole table into the lake with parallel Scan')
+    parser.add_argument('table_name', help='e.g. Customer or Order')
+    parser.add_argument('--bucket', default=DEFAULTS['bucket_name'])
+    parser.add_argument('--prefix', help='defaults to the lower-cased table name plus "s"')
+    parser.add_argument('--format', default='ndjson', choices=['ndjson', 'parquet'])
+    parser.add_argument('--segments', type=int, default=4)
+    parser.add_argument('--rcu', type=float, help='read capacity per second to stay under')
+    parser.add_argument('--rcu-fraction', type=float, default=0.5,
+                        help='share of provisioned RCU to use when --rcu is not given')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='save the watermark as the stream checkpoint for final.py')
+    parser.add_argument('--checkpoint-table',
+                        help='DynamoDB table to checkpoint in, as given to final.py '
+                             '(implies --checkpoint), instead of checkpoints.db')
+    args = parser.parse_args()
+
+    prefix = args.prefix or f"{args.table_name.lower()}s"
+    checkpoints = None
+    if args.checkpoint or args.checkpoint_table:
+        checkpoints = open_checkpoint_store(boto3.resource('dynamodb'), args.checkpoint_table)
+    sink = S3BatchWriter(get_s3_client(), make_record_format(args.format))
+    try:
+        snapshot_table(args.table_name, args.bucket, prefix, sink, segments=args.segments,
+                       rcu=args.rcu, rcu_fraction=args.rcu_fraction, checkpoints=checkpoints)
+    finally:
+        if checkpoints:
+            checkpoints.close()
+
+
+if __name__ == '__main__':
+    main()
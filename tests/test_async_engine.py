@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+import pytest
+
+from async_engine import AsyncStreamEngine
+from dedup import Deduplicator
+from fakeaws import FakeStreamsClient
+
+ARN = 'arn:aws:dynamodb:ap-south-1:000000000000:table/Order/stream/fake'
+PARENT = 'shardId-Order-0000'
+
+
+class StartFromTrimHorizon:
+    """A checkpoint store with an entry for some other shard, so every shard is read from its start"""
+
+    def get_all(self, stream_arn):
+        return {'shardId-elsewhere': '1'}
+
+
+class FlakySink:
+    """Keeps what it is given, but rejects the fail_at'th record once"""
+
+    def __init__(self, fail_at):
+        self.fail_at = fail_at
+        self.added = []
+        self.calls = 0
+
+    def add(self, record, bucket_name, prefix, position=None):
+        self.calls += 1
+        if self.calls == self.fail_at:
+            raise RuntimeError('upload failed')
+        self.added.append((position[1], record['dynamodb']['SequenceNumber']))
+
+    def flush_due(self):
+        pass
+
+    def flush(self):
+        pass
+
+
+def run(streams, pipeline, until, seconds=10):
+    engine = AsyncStreamEngine(streams, [pipeline], checkpoints=StartFromTrimHorizon(),
+                               max_calls=4, discovery_interval=0.1)
+
+    async def main():
+        task = asyncio.create_task(engine.run())
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline and not until():
+            await asyncio.sleep(0.05)
+        engine.stop()
+        await task
+
+    asyncio.run(main())
+    return engine
+
+
+@pytest.mark.parametrize('where', ['page start', 'mid page', 'last record'])
+def test_rejected_page_is_read_again_without_losing_or_repeating_records(tmp_path, where):
+    streams = FakeStreamsClient(tables=('Order',), shard_count=1, rate=1000)
+    time.sleep(0.3)
+    (child,) = streams.split(ARN, PARENT)
+    expected = [record['dynamodb']['SequenceNumber']
+                for record in streams.get_records(f"{ARN}|{PARENT}|0")['Records']]
+    # Pages are 50 records long
+    sink = FlakySink({'page start': 101, 'mid page': 120, 'last record': len(expected)}[where])
+    pipeline = dict(table_name='Order', stream_arn=ARN, bucket_name='bucket', prefix='orders',
+                    sink=sink, dedup=Deduplicator(str(tmp_path / 'dedup.db')),
+                    poller={'limit': 50, 'min_interval': 0.01, 'max_interval': 0.05})
+
+    def parent_records():
+        return [sequence for shard_id, sequence in sink.added if shard_id == PARENT]
+
+    engine = run(streams, pipeline, until=lambda: any(
+        shard_id == child for shard_id, sequence in sink.added))
+    assert sink.calls > sink.fail_at
+    assert parent_records() == expected
+    (table,) = engine.pipelines
+    assert PARENT in table.finished
+    assert table.generations[PARENT] == 1
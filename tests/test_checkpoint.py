@@ -0,0 +1,44 @@
+import pytest
+
+from checkpoint import (DynamoDBCheckpointStore, SQLiteCheckpointStore, open_checkpoint_store,
+                        sequence_key)
+
+
+def test_positions_are_saved_per_stream_and_shard(tmp_path):
+    path = str(tmp_path / 'checkpoints.db')
+    store = SQLiteCheckpointStore(path)
+    store.save({('arn-a', 'shard-1'): '100', ('arn-a', 'shard-2'): '7', ('arn-b', 'shard-1'): '1'})
+    store.save({('arn-a', 'shard-1'): '250'})
+    store.close()
+
+    reopened = SQLiteCheckpointStore(path)
+    assert reopened.get('arn-a', 'shard-1') == '250'
+    assert reopened.get('arn-a', 'shard-9') is None
+    assert reopened.get_all('arn-a') == {'shard-1': '250', 'shard-2': '7'}
+    reopened.close()
+
+
+def test_sequence_numbers_order_as_numbers():
+    assert sequence_key('900') < sequence_key('1000')
+    assert max(['99', '100000000021053503235'], key=sequence_key) == '100000000021053503235'
+
+
+def test_a_checkpoint_table_is_created_and_shared(tmp_path, monkeypatch):
+    moto = pytest.importorskip('moto')
+    boto3 = pytest.importorskip('boto3')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'ap-south-1')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with moto.mock_aws():
+        dynamodb = boto3.resource('dynamodb')
+        store = open_checkpoint_store(dynamodb, 'StreamCheckpoints')
+        assert isinstance(store, DynamoDBCheckpointStore)
+        store.save({('arn-a', 'shard-1'): '100', ('arn-b', 'shard-1'): '1'})
+
+        # Another host opening the same table sees them
+        other = open_checkpoint_store(dynamodb, 'StreamCheckpoints')
+        assert other.get_all('arn-a') == {'shard-1': '100'}
+
+    local = open_checkpoint_store(None, path=str(tmp_path / 'checkpoints.db'))
+    assert isinstance(local, SQLiteCheckpointStore)
+    local.close()
@@ -0,0 +1,54 @@
+import datetime
+import gzip
+import json
+
+from clients import LocalS3Client
+from compact_lake import Compactor, list_keys
+from lake_index import LakeIndex
+from query import LakeQuery
+
+BUCKET = 'lake'
+
+
+def put_event(s3_client, event_id, sequence_number, hour, status):
+    # The shape script.py wrote: one pretty-printed record per eventID
+    record = {
+        'eventID': event_id,
+        'eventName': 'INSERT',
+        'dynamodb': {
+            'ApproximateCreationDateTime': datetime.datetime(2024, 11, 28, hour, 5).isoformat(),
+            'Keys': {'OrderId': {'S': event_id}},
+            'NewImage': {'OrderId': {'S': event_id}, 'OrderStatus': {'S': status}},
+            'SequenceNumber': str(sequence_number),
+        }
+    }
+    s3_client.put_object(Bucket=BUCKET, Key=f"orders/{event_id}.json", Body=json.dumps(record, indent=2))
+
+
+def test_events_are_merged_per_hour_and_originals_removed(tmp_path):
+    s3_client = LocalS3Client(str(tmp_path))
+    put_event(s3_client, 'a1', 3, 14, 'Shipped')
+    put_event(s3_client, 'b2', 1, 14, 'Pending')
+    put_event(s3_client, 'c3', 2, 15, 'Shipped')
+
+    compactor = Compactor(s3_client, BUCKET, 'orders', chunk_size=2, fetch_workers=2, list_workers=2,
+                          indexer=LakeIndex(s3_client))
+    assert compactor.run() == 3
+    assert list_keys(s3_client, BUCKET, 'orders', workers=2) == []
+
+    listing = s3_client.list_objects_v2(Bucket=BUCKET, Prefix='orders/dt=')['Contents']
+    merged = {}
+    for obj in listing:
+        body = gzip.decompress(s3_client.get_object(Bucket=BUCKET, Key=obj['Key'])['Body'].read())
+        merged[obj['Key']] = [json.loads(line)['eventID'] for line in body.splitlines()]
+    assert sorted(event for events in merged.values() for event in events) == ['a1', 'b2', 'c3']
+    # Within a file, records are in event time then sequence order
+    assert ['b2', 'a1'] in merged.values()
+
+    # Running again finds nothing left to do
+    assert compactor.run() == 0
+
+    # The merged files are indexed, so the query can prune on OrderStatus
+    query = LakeQuery(s3_client, BUCKET, 'orders', ['OrderStatus=Pending'], workers=2)
+    assert [row['OrderId'] for row in query.rows()] == ['b2']
+    assert query.pruned == 1
@@ -0,0 +1,45 @@
+import pytest
+
+from dedup import Deduplicator
+
+ARN = 'arn:stream'
+
+
+def page(*sequence_numbers):
+    return [{'dynamodb': {'SequenceNumber': str(number)}} for number in sequence_numbers]
+
+
+def numbers(records):
+    return [int(record['dynamodb']['SequenceNumber']) for record in records]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'dedup.db')
+
+
+def test_only_records_the_sink_took_are_dropped_on_replay(path):
+    dedup = Deduplicator(path)
+    records = page(1, 2, 3, 4)
+    assert numbers(dedup.filter(ARN, 'shard-1', records)) == [1, 2, 3, 4]
+
+    # The sink failed after two records; the retry has to let the rest through
+    dedup.accepted(ARN, 'shard-1', records[:2])
+    assert numbers(dedup.filter(ARN, 'shard-1', records)) == [3, 4]
+    # Other shards have their own sequence numbers
+    assert numbers(dedup.filter(ARN, 'shard-2', records)) == [1, 2, 3, 4]
+    dedup.close()
+
+
+def test_committed_keys_survive_a_restart(path):
+    dedup = Deduplicator(path)
+    records = page(5, 10, 100)
+    dedup.accepted(ARN, 'shard-1', dedup.filter(ARN, 'shard-1', records))
+    # Only the first two reached S3
+    dedup.committed({(ARN, 'shard-1'): '10'})
+    dedup.close()
+
+    restarted = Deduplicator(path)
+    assert numbers(restarted.filter(ARN, 'shard-1', records)) == [100]
+    assert restarted.hits == 2 and restarted.misses == 1
+    restarted.close()
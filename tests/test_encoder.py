@@ -0,0 +1,24 @@
+import pytest
+
+from encoder import get_encoder, orjson
+
+BACKENDS = ['compact', pytest.param('orjson', marks=pytest.mark.skipif(orjson is None,
+                                                                         reason='orjson not installed'))]
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_numbers_are_written_with_the_digits_dynamodb_had(backend):
+    encode = get_encoder(backend, unmarshal=True)
+    record = {
+        'eventID': '1',
+        'dynamodb': {
+            'NewImage': {'Big': {'N': '123456789012345678901234567890'},
+                         'Fine': {'N': '1.00000000000000000001'},
+                         'Tiny': {'N': '1E-130'},
+                         'Qty': {'N': '3'}, 'Price': {'N': '49.99'}},
+            'SequenceNumber': '1',
+        }
+    }
+    assert encode(record) == (b'{"eventID":"1","dynamodb":{"NewImage":{'
+                              b'"Big":123456789012345678901234567890,"Fine":1.00000000000000000001,'
+                              b'"Tiny":1E-130,"Qty":3,"Price":49.99},"SequenceNumber":"1"}}')
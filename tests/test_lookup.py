@@ -0,0 +1,85 @@
+from lookup import CustomerLookup
+
+ARN = 'arn:aws:dynamodb:ap-south-1:140023404813:table/{}/stream/2024-11-28T20:32:37.346'
+
+
+class FakeTable:
+    """Customer items by key, or one customer's orders through query(); counts the calls"""
+
+    def __init__(self, items=()):
+        self.items = list(items)
+        self.calls = 0
+
+    def get_item(self, Key, ConsistentRead=False):
+        self.calls += 1
+        for item in self.items:
+            if item['CustomerId'] == Key['CustomerId']:
+                return {'Item': dict(item)}
+        return {}
+
+    def query(self, Limit, ExclusiveStartKey=None, **kwargs):
+        self.calls += 1
+        start = ExclusiveStartKey or 0
+        response = {'Items': self.items[start:start + Limit]}
+        if start + Limit < len(self.items):
+            response['LastEvaluatedKey'] = start + Limit
+        return response
+
+
+class FakeDynamoDB:
+    def __init__(self, customers, orders):
+        self.tables = {'Customer': FakeTable(customers), 'Order': FakeTable(orders)}
+
+    def Table(self, name):
+        return self.tables[name]
+
+
+def event(table, customer_id):
+    return {'eventSourceARN': ARN.format(table), 'dynamodb': {'Keys': {'CustomerId': {'S': customer_id}}}}
+
+
+def orders(count):
+    return [{'OrderId': f"ORD{number}", 'CustomerId': 'CUST1'} for number in range(count)]
+
+
+def test_entries_are_served_from_memory_until_a_stream_event():
+    dynamodb = FakeDynamoDB([{'CustomerId': 'CUST1', 'Name': 'Ann'}], orders(2))
+    lookup = CustomerLookup(dynamodb)
+    customers = dynamodb.Table('Customer')
+    assert lookup.get_customer('CUST1')['Name'] == 'Ann'
+    customers.items[0]['Name'] = 'Anne'
+    assert lookup.get_customer('CUST1')['Name'] == 'Ann'
+    assert customers.calls == 1
+
+    # Events for other customers and tables leave the entry alone
+    lookup.invalidate([event('Customer', 'CUST2'), event('Order', 'CUST1')])
+    assert lookup.get_customer('CUST1')['Name'] == 'Ann'
+    lookup.invalidate([event('Customer', 'CUST1')])
+    assert lookup.get_customer('CUST1')['Name'] == 'Anne'
+    assert customers.calls == 2
+
+
+def test_orders_wait_for_the_index_before_being_cached_again():
+    dynamodb = FakeDynamoDB([], orders(2))
+    lookup = CustomerLookup(dynamodb, order_refill_delay=60)
+    order_table = dynamodb.Table('Order')
+    assert len(lookup.get_orders('CUST1')) == 2
+    assert len(lookup.get_orders('CUST1')) == 2
+    assert order_table.calls == 1
+
+    lookup.invalidate([event('Order', 'CUST1')])
+    order_table.items.append({'OrderId': 'ORD2', 'CustomerId': 'CUST1'})
+    assert len(lookup.get_orders('CUST1')) == 3
+    assert len(lookup.get_orders('CUST1')) == 3
+    assert order_table.calls == 3
+
+
+def test_customers_with_too_many_orders_are_read_once_and_not_cached():
+    dynamodb = FakeDynamoDB([], orders(250))
+    lookup = CustomerLookup(dynamodb, max_cached_orders=150)
+    order_table = dynamodb.Table('Order')
+    assert len(lookup.get_orders('CUST1')) == 250
+    # Three pages of 100, nothing read twice
+    assert order_table.calls == 3
+    assert len(lookup.get_orders('CUST1')) == 250
+    assert order_table.calls == 6
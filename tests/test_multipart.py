@@ -0,0 +1,74 @@
+import datetime
+import gzip
+import json
+
+import pytest
+
+from clients import LocalS3Client
+from encoder import get_encoder
+from multipart import StreamingS3Writer
+
+BUCKET = 'lake'
+
+
+class FlakyS3Client(LocalS3Client):
+    """Fails the next `failures` put_object calls"""
+
+    def __init__(self, root, failures=0):
+        super().__init__(root)
+        self.failures = failures
+
+    def put_object(self, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('S3 is down')
+        return super().put_object(**kwargs)
+
+
+def record(sequence_number):
+    return {
+        'eventID': f"event-{sequence_number}",
+        'eventName': 'INSERT',
+        'dynamodb': {
+            'ApproximateCreationDateTime': datetime.datetime(2024, 11, 28, 14, 30,
+                                                             tzinfo=datetime.timezone.utc),
+            'Keys': {'CustomerId': {'S': str(sequence_number)}},
+            'SequenceNumber': str(sequence_number),
+        }
+    }
+
+
+def stored_sequence_numbers(s3_client):
+    numbers = []
+    for obj in s3_client.list_objects_v2(Bucket=BUCKET, Prefix='customers/')['Contents']:
+        body = gzip.decompress(s3_client.get_object(Bucket=BUCKET, Key=obj['Key'])['Body'].read())
+        numbers += [json.loads(line)['dynamodb']['SequenceNumber'] for line in body.splitlines()]
+    return sorted(numbers, key=int)
+
+
+@pytest.fixture
+def writer(tmp_path):
+    flushed = []
+    s3_client = FlakyS3Client(str(tmp_path / 's3'), failures=2)
+    writer = StreamingS3Writer(s3_client, get_encoder(), on_flush=flushed.append,
+                               spill_dir=str(tmp_path))
+    yield writer, s3_client, flushed
+    writer.close()
+
+
+def test_failed_object_is_uploaded_again_and_shards_recover(writer):
+    writer, s3_client, flushed = writer
+    position = ('arn', 'shard-1')
+
+    writer.add(record(1), BUCKET, 'customers', position=position)
+    writer.flush()                    # upload fails, and so does the first retry
+    assert writer.failed_shards == {position}
+    assert flushed == []
+
+    writer.add(record(2), BUCKET, 'customers', position=position)
+    writer.flush()                    # reaches S3, the old object is retried too
+    assert writer.failed_shards == set()
+    assert writer.failed == []
+    assert stored_sequence_numbers(s3_client) == ['1', '2']
+    # Checkpointed up to the newest object, never behind it
+    assert flushed == [{position: '2'}]
@@ -0,0 +1,108 @@
+import datetime
+import io
+import json
+from decimal import Decimal
+
+import pytest
+
+pq = pytest.importorskip('pyarrow.parquet')
+
+from clients import LocalS3Client
+from parquet_sink import ParquetFormat
+from sink import DEAD_LETTER_DIR, S3BatchWriter
+
+BUCKET = 'lake'
+ORDER_ARN = 'arn:aws:dynamodb:ap-south-1:140023404813:table/Order/stream/2024-11-28T20:32:37.346'
+
+
+def order_record(sequence_number, total, price='49.99'):
+    return {
+        'eventID': f"event-{sequence_number}",
+        'eventName': 'INSERT',
+        'eventSourceARN': ORDER_ARN,
+        'dynamodb': {
+            'ApproximateCreationDateTime': datetime.datetime(2024, 11, 28, 14, 30,
+                                                             tzinfo=datetime.timezone.utc),
+            'Keys': {'OrderId': {'S': f"ORD{sequence_number}"}},
+            'NewImage': {
+                'OrderId': {'S': f"ORD{sequence_number}"},
+                'CustomerId': {'S': 'CUST1'},
+                'OrderTotal': {'N': total},
+                'Items': {'L': [{'M': {'ItemID': {'S': 'ITEM001'}, 'Quantity': {'N': '1'},
+                                       'Price': {'N': price}}}]},
+            },
+            'SequenceNumber': str(sequence_number),
+            'SizeBytes': 180,
+        }
+    }
+
+
+def objects(s3_client, prefix):
+    listing = s3_client.list_objects_v2(Bucket=BUCKET, Prefix=prefix)
+    return [obj['Key'] for obj in listing.get('Contents', [])]
+
+
+@pytest.fixture
+def s3_client(tmp_path):
+    return LocalS3Client(str(tmp_path))
+
+
+def read_rows(s3_client):
+    keys = objects(s3_client, 'orders/')
+    assert len(keys) == 1 and keys[0].endswith('.parquet')
+    body = s3_client.get_object(Bucket=BUCKET, Key=keys[0])['Body'].read()
+    return pq.read_table(io.BytesIO(body)).to_pylist()
+
+
+def test_money_that_would_be_rounded_is_kept_in_extra(s3_client):
+    sink = S3BatchWriter(s3_client, ParquetFormat())
+    sink.add(order_record(1, '49.999', price='0.005'), BUCKET, 'orders')
+    sink.add(order_record(2, '12'), BUCKET, 'orders')
+    sink.flush()
+
+    rows = read_rows(s3_client)
+    assert [row['OrderTotal'] for row in rows] == [None, Decimal('12.00')]
+    assert rows[0]['Items'] is None
+    extra = json.loads(rows[0]['_extra'])
+    assert str(extra['OrderTotal']) == '49.999'
+    assert str(extra['Items'][0]['Price']) == '0.005'
+    assert rows[1]['_extra'] is None
+
+
+def test_values_that_do_not_fit_their_column_are_kept_in_extra(s3_client):
+    sink = S3BatchWriter(s3_client, ParquetFormat())
+    record = order_record(1, '10')
+    image = record['dynamodb']['NewImage']
+    image['OrderDate'] = {'S': '28/11/2024'}
+    image['OrderStatus'] = {'N': '3'}
+    image['Items']['L'][0]['M']['Quantity'] = {'N': '1.5'}
+    sink.add(record, BUCKET, 'orders')
+    sink.flush()
+
+    (row,) = read_rows(s3_client)
+    assert (row['OrderDate'], row['OrderStatus'], row['Items']) == (None, None, None)
+    assert row['OrderTotal'] == Decimal('10.00')
+    extra = json.loads(row['_extra'])
+    assert extra['OrderDate'] == '28/11/2024' and extra['OrderStatus'] == 3
+    assert extra['Items'][0]['Quantity'] == 1.5
+
+
+def test_unbuildable_batch_is_dead_lettered_and_checkpointed(s3_client):
+    flushed = []
+    sink = S3BatchWriter(s3_client, ParquetFormat(), on_flush=flushed.append)
+    # Too many digits for decimal128(12, 2)
+    sink.add(order_record(1, '12345678901234'), BUCKET, 'orders', position=('arn', 'shard-1'))
+    sink.flush()
+
+    assert not [key for key in objects(s3_client, 'orders/') if key.endswith('.parquet')]
+    dead = objects(s3_client, f"orders/{DEAD_LETTER_DIR}/")
+    assert len(dead) == 1
+    body = s3_client.get_object(Bucket=BUCKET, Key=dead[0])['Body'].read()
+    (line,) = body.splitlines()
+    assert json.loads(line)[1]['OrderId'] == 'ORD1'
+    assert flushed == [{('arn', 'shard-1'): '1'}]
+
+    # Nothing was requeued, later batches go through on their own
+    sink.add(order_record(2, '10.00'), BUCKET, 'orders')
+    sink.flush()
+    assert len([key for key in objects(s3_client, 'orders/') if key.endswith('.parquet')]) == 1
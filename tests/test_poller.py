@@ -0,0 +1,63 @@
+import random
+import threading
+import time
+
+from fakeaws import FakeStreamsClient
+from poller import AdaptivePoller
+from shards import process_shard
+
+ARN = 'arn:aws:dynamodb:ap-south-1:000000000000:table/Order/stream/fake'
+SHARD_ID = 'shardId-Order-0000'
+
+
+def test_full_pages_are_followed_up_at_once_and_partial_ones_wait_the_floor():
+    poller = AdaptivePoller(limit=100, min_interval=0.5, max_interval=15)
+    assert poller.next_delay(100) == 0
+    assert poller.next_delay(1) == 0.5
+    assert poller.next_delay(99) == 0.5
+
+
+def test_empty_pages_back_off_up_to_the_ceiling_and_reset_on_records():
+    poller = AdaptivePoller(min_interval=0.5, max_interval=5, jitter=0)
+    assert [poller.next_delay(0) for _ in range(6)] == [0.5, 1, 2, 4, 5, 5]
+    assert poller.next_delay(3) == 0.5
+    assert poller.next_delay(0) == 0.5
+
+
+def test_jitter_only_shortens_the_delay():
+    random.seed(7)
+    poller = AdaptivePoller(min_interval=1, max_interval=1, jitter=0.5)
+    delays = [poller.next_delay(0) for _ in range(200)]
+    assert all(0.5 <= delay <= 1 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_idle_shard_is_polled_less_and_less_often():
+    streams = FakeStreamsClient(tables=('Order',), shard_count=1, rate=0)
+    stop_event = threading.Event()
+    poller = AdaptivePoller(min_interval=0.01, max_interval=0.2, jitter=0)
+    thread = threading.Thread(target=process_shard, args=(
+        streams, ARN, SHARD_ID, 'TRIM_HORIZON', lambda shard_id, records: None,
+        'Order', stop_event, poller))
+    thread.start()
+    time.sleep(1)
+    stop_event.set()
+    thread.join(timeout=5)
+    # 0.01, 0.02, 0.04, ... 0.2 apart: about 9 calls a second, not the 100 a fixed floor would make
+    assert 5 <= streams.calls['get_records'] <= 15
+
+
+def test_backlog_is_read_without_waiting_between_full_pages():
+    streams = FakeStreamsClient(tables=('Order',), shard_count=1, rate=1000)
+    time.sleep(0.3)
+    streams.split(ARN, SHARD_ID)
+    handled = []
+    poller = AdaptivePoller(limit=50, min_interval=5)
+    started = time.monotonic()
+    drained = process_shard(streams, ARN, SHARD_ID, 'TRIM_HORIZON',
+                            lambda shard_id, records: handled.extend(records),
+                            'Order', threading.Event(), poller)
+    assert drained
+    assert time.monotonic() - started < 2
+    assert len(handled) >= 200
+    assert streams.calls['get_records'] >= 4
@@ -0,0 +1,110 @@
+import datetime
+
+from clients import LocalS3Client
+from encoder import get_encoder
+from lake_index import LakeIndex, ObjectStats
+from query import LakeQuery, might_match, parse_filter, parse_time, row_matches
+from sink import S3BatchWriter
+
+
+def entry_for(*images, sequence_numbers=()):
+    stats = ObjectStats()
+    for number, image in zip(sequence_numbers or range(1, len(images) + 1), images):
+        stats.observe({'dynamodb': {'NewImage': image, 'SequenceNumber': str(number)}})
+    entry = stats.to_dict()
+    entry['complete'] = True
+    return entry
+
+
+def filters(*texts):
+    return [parse_filter(text) for text in texts]
+
+
+def test_prunes_on_column_ranges_and_absence():
+    entry = entry_for({'OrderStatus': 'Shipped', 'Total': 10, 'Ship': {'Zone': 3}},
+                      {'OrderStatus': 'Pending', 'Total': 30, 'Ship': {'Zone': 5}})
+    assert might_match(entry, filters('Total>=20'))
+    assert not might_match(entry, filters('Total>30'))
+    assert not might_match(entry, filters('Ship.Zone=9'))
+    assert not might_match(entry, filters('GiftWrap=true'))
+    assert not might_match(entry, filters('Ship.Carrier=UPS'))
+
+
+def test_never_prunes_on_columns_the_index_cannot_hold():
+    entry = entry_for({'Ship': {'Geo': {'Zone': 1}}, 'Tags': ['a', 'b']})
+    # Deeper than one map level, and lists, aren't indexed
+    assert might_match(entry, filters('Ship.Geo.Zone=1'))
+    assert might_match(entry, filters('Tags!=x'))
+    assert row_matches({'Ship': {'Geo': {'Zone': 1}}}, filters('Ship.Geo.Zone=1'))
+
+
+def test_prunes_on_sequence_numbers_as_numbers():
+    entry = entry_for({'Id': 'a'}, {'Id': 'b'}, sequence_numbers=(900, 1100))
+    assert might_match(entry, filters('sequence_number>=1000'))
+    assert not might_match(entry, filters('sequence_number>1100'))
+    assert not might_match(entry, filters('sequence_number<900'))
+    # A string compare would put '1000' before '900'
+    assert row_matches({'sequence_number': '1100'}, filters('sequence_number>900'))
+
+
+def order(sequence_number, day, status, total, at=datetime.time(12)):
+    return {
+        'eventID': f"event-{sequence_number}",
+        'eventName': 'INSERT',
+        'dynamodb': {
+            'ApproximateCreationDateTime': datetime.datetime.combine(
+                datetime.date(2024, 11, day), at, tzinfo=datetime.timezone.utc),
+            'Keys': {'OrderId': {'S': f"ORD{sequence_number}"}},
+            'NewImage': {'OrderId': {'S': f"ORD{sequence_number}"},
+                         'OrderStatus': {'S': status}, 'OrderTotal': {'N': total}},
+            'SequenceNumber': str(sequence_number),
+        }
+    }
+
+
+def test_query_filters_projects_and_prunes_over_the_lake(tmp_path):
+    s3_client = LocalS3Client(str(tmp_path))
+    sink = S3BatchWriter(s3_client, get_encoder(unmarshal=True), indexer=LakeIndex(s3_client))
+    for record in (order(1, 27, 'Shipped', '10'), order(2, 27, 'Cancelled', '25')):
+        sink.add(record, 'lake', 'orders')
+    sink.flush()
+    for record in (order(3, 28, 'Cancelled', '40'), order(4, 28, 'Shipped', '5')):
+        sink.add(record, 'lake', 'orders')
+    sink.flush()
+
+    query = LakeQuery(s3_client, 'lake', 'orders', ['OrderStatus=Cancelled', 'OrderTotal>30'],
+                      select=['OrderId', 'OrderTotal'], workers=2)
+    assert list(query.rows()) == [{'OrderId': 'ORD3', 'OrderTotal': 40}]
+    assert (query.scanned, query.pruned) == (1, 1)
+
+    # A time range only lists the partitions of the days it covers
+    since = parse_time('2024-11-27')
+    query = LakeQuery(s3_client, 'lake', 'orders', ['OrderStatus=Cancelled'], since=since,
+                      until=since + datetime.timedelta(days=1), workers=2)
+    assert [row['OrderId'] for row in query.rows()] == ['ORD2']
+    assert query.scanned == 1
+
+
+def test_date_query_reads_rows_filed_under_the_previous_day(tmp_path):
+    s3_client = LocalS3Client(str(tmp_path))
+    index = LakeIndex(s3_client)
+    # Older sinks filed a whole batch under its first record's partition
+    batch = [order(1, 27, 'Shipped', '10', at=datetime.time(23, 59, 40)),
+             order(2, 28, 'Cancelled', '25', at=datetime.time(0, 0, 20))]
+    encode = get_encoder(unmarshal=True)
+    body = b''.join(encode(record) + b'\n' for record in batch)
+    key = 'orders/dt=2024-11-27/hour=23/20241127T235940-old.ndjson'
+    s3_client.put_object(Bucket='lake', Key=key, Body=body)
+    index.write('lake', 'orders', key, 2, len(body), index.stats(*batch))
+    # An earlier object from that hour can't reach the 28th and is pruned
+    early = order(3, 27, 'Cancelled', '40', at=datetime.time(23, 10))
+    body = encode(early) + b'\n'
+    key = 'orders/dt=2024-11-27/hour=23/20241127T231000-old.ndjson'
+    s3_client.put_object(Bucket='lake', Key=key, Body=body)
+    index.write('lake', 'orders', key, 1, len(body), index.stats(early))
+
+    since = parse_time('2024-11-28')
+    query = LakeQuery(s3_client, 'lake', 'orders', ['OrderStatus=Cancelled'], since=since,
+                      until=since + datetime.timedelta(days=1), workers=2)
+    assert [row['OrderId'] for row in query.rows()] == ['ORD2']
+    assert (query.scanned, query.pruned) == (1, 1)
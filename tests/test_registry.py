@@ -0,0 +1,74 @@
+import os
+import threading
+import time
+
+from registry import DEFAULT_CONFIG, DEFAULTS, PipelineRegistry, table_config
+
+
+class FakeDynamoDB:
+    def Table(self, name):
+        return name
+
+
+class FakeSink:
+    def __init__(self):
+        self.flushed = False
+
+    def flush(self):
+        self.flushed = True
+
+
+def write_config(path, tables):
+    path.write_text('reload_interval: 0.05\ntables:\n' + ''.join(
+        f"  - {{table_name: {name}, max_age: {max_age}}}\n" for name, max_age in tables))
+    # Move the mtime on, however coarse the filesystem's clock
+    stamp = time.time() + len(tables) + sum(max_age for _, max_age in tables)
+    os.utime(path, (stamp, stamp))
+
+
+def wait_for(condition, seconds=5):
+    deadline = time.monotonic() + seconds
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert condition()
+
+
+def test_table_config_works_from_any_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert os.path.isabs(DEFAULT_CONFIG)
+    assert table_config('Customer')['prefix'] == 'customers'
+    # No file at all, just the defaults
+    config = table_config('Customer', str(tmp_path / 'missing.yaml'))
+    assert config['bucket_name'] == DEFAULTS['bucket_name'] and config['prefix'] == 'customers'
+
+
+def test_reload_starts_stops_and_restarts_tables(tmp_path):
+    path = tmp_path / 'pipelines.yaml'
+    write_config(path, [('Customer', 60), ('Order', 60)])
+    started = []
+    sinks = []
+
+    def make_sink(config):
+        sinks.append((config['table_name'], FakeSink()))
+        return sinks[-1][1]
+
+    def run_table(client, table, config, sink, stop_event):
+        started.append((table, config['max_age']))
+        stop_event.wait()
+
+    registry = PipelineRegistry(str(path), FakeDynamoDB(), object(), make_sink, run_table)
+    thread = threading.Thread(target=registry.run)
+    thread.start()
+    try:
+        wait_for(lambda: len(started) == 2)
+        write_config(path, [('Customer', 5)])
+        wait_for(lambda: ('Customer', 5) in started and 'Order' not in registry.running)
+        assert sorted(registry.running) == ['Customer']
+        # Stopped tables were flushed, the restarted one got a new sink
+        assert [name for name, sink in sinks if sink.flushed] == ['Customer', 'Order']
+        assert len(sinks) == 3
+    finally:
+        registry.stop_event.set()
+        thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert all(sink.flushed for _, sink in sinks)
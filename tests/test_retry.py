@@ -0,0 +1,110 @@
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from fakeaws import FakeStreamsClient, _error
+from poller import AdaptivePoller
+from retry import ShardCursor, classify
+from shards import process_shard
+
+ARN = 'arn:aws:dynamodb:ap-south-1:000000000000:table/Order/stream/fake'
+SHARD_ID = 'shardId-Order-0000'
+
+
+@pytest.mark.parametrize('code, kind', [
+    ('ProvisionedThroughputExceededException', 'throttle'),
+    ('LimitExceededException', 'throttle'),
+    ('ExpiredIteratorException', 'expired'),
+    ('TrimmedDataAccessException', 'trimmed'),
+    ('ResourceNotFoundException', 'missing'),
+    ('AccessDeniedException', 'fatal'),
+    ('ValidationException', 'fatal'),
+    ('InternalServerError', 'transient'),
+])
+def test_classify(code, kind):
+    assert classify(_error(code, 'GetRecords')) == kind
+
+
+def test_errors_without_a_code_are_transient():
+    assert classify(ConnectionError('reset by peer')) == 'transient'
+
+
+def closed_shard(seconds=0.3):
+    """A one-shard stream with a backlog of records, closed so reading it ends"""
+    streams = FakeStreamsClient(tables=('Order',), shard_count=1, rate=1000)
+    time.sleep(seconds)
+    streams.split(ARN, SHARD_ID)
+    expected = [record['dynamodb']['SequenceNumber']
+                for record in streams.get_records(f"{ARN}|{SHARD_ID}|0")['Records']]
+    streams.calls['get_records'] = 0
+    return streams, expected
+
+
+def read(streams, on_page=None):
+    """Read the shard to its end in 50-record pages, returning the sequence numbers handled"""
+    handled = []
+
+    def handle_records(shard_id, records):
+        handled.extend(record['dynamodb']['SequenceNumber'] for record in records)
+        if on_page:
+            on_page(len(handled))
+
+    cursor = ShardCursor(ARN, SHARD_ID, 'TRIM_HORIZON',
+                         throttle_backoff=(0.01, 0.05), error_backoff=(0.01, 0.05))
+    poller = AdaptivePoller(limit=50, min_interval=0.01, max_interval=0.05)
+    drained = process_shard(streams, ARN, SHARD_ID, 'TRIM_HORIZON', handle_records,
+                            'Order', threading.Event(), poller, cursor=cursor)
+    return drained, handled
+
+
+def test_expired_iterator_resumes_after_the_last_record():
+    streams, expected = closed_shard()
+
+    def expire_once(count):
+        if count == 100:
+            streams.fail('get_records', 'ExpiredIteratorException')
+
+    drained, handled = read(streams, expire_once)
+    assert drained
+    assert handled == expected
+    assert streams.calls['get_shard_iterator'] == 2
+
+
+def test_throttled_reads_keep_their_iterator():
+    streams, expected = closed_shard()
+    streams.fail('get_records', 'ProvisionedThroughputExceededException',
+                 'ThrottlingException', 'InternalServerError')
+    drained, handled = read(streams)
+    assert drained
+    assert handled == expected
+    assert streams.calls['get_shard_iterator'] == 1
+
+
+def test_trimmed_position_restarts_at_trim_horizon():
+    streams, expected = closed_shard()
+
+    def trim_once(count):
+        if count == 50:
+            streams.fail('get_records', 'TrimmedDataAccessException')
+
+    drained, handled = read(streams, trim_once)
+    assert drained
+    assert handled == expected[:50] + expected
+    assert streams.calls['get_shard_iterator'] == 2
+
+
+def test_missing_shard_counts_as_drained():
+    streams, expected = closed_shard()
+    streams.fail('get_records', 'ResourceNotFoundException')
+    drained, handled = read(streams)
+    assert drained
+    assert handled == []
+
+
+def test_fatal_errors_are_raised():
+    streams, expected = closed_shard()
+    streams.fail('get_shard_iterator', 'AccessDeniedException')
+    with pytest.raises(ClientError):
+        read(streams)
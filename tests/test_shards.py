@@ -0,0 +1,92 @@
+import threading
+import time
+
+from fakeaws import FakeStreamsClient
+from metrics import SHARD_LAG
+from shards import ShardConsumer
+
+ARN = 'arn:aws:dynamodb:ap-south-1:000000000000:table/Order/stream/fake'
+FAST_POLLING = {'min_interval': 0.01, 'max_interval': 0.05}
+
+
+class StartFromTrimHorizon:
+    """A checkpoint store with an entry for some other shard, so every shard is read from its start"""
+
+    def get_all(self, stream_arn):
+        return {'shardId-elsewhere': '1'}
+
+
+def consume(streams, handle_records, seconds, max_workers=8, until=None, on_drained=None):
+    stop_event = threading.Event()
+    consumer = ShardConsumer(streams, ARN, handle_records, max_workers=max_workers,
+                             discovery_interval=0.1, stop_event=stop_event,
+                             poller_options=FAST_POLLING, checkpoints=StartFromTrimHorizon(),
+                             on_drained=on_drained)
+    thread = threading.Thread(target=consumer.run)
+    thread.start()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline and not (until and until()):
+        time.sleep(0.05)
+    stop_event.set()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    return consumer
+
+
+def test_every_open_shard_is_read_with_more_shards_than_workers():
+    streams = FakeStreamsClient(tables=('Order',), shard_count=4, rate=200)
+    seen = {}
+    lock = threading.Lock()
+
+    def handle_records(shard_id, records):
+        with lock:
+            seen[shard_id] = seen.get(shard_id, 0) + len(records)
+
+    consume(streams, handle_records, 5, max_workers=2,
+            until=lambda: len([count for count in seen.values() if count]) == 4)
+    assert len([count for count in seen.values() if count]) == 4
+
+
+def test_children_wait_for_their_parent_even_when_it_fails():
+    streams = FakeStreamsClient(tables=('Order',), shard_count=1, rate=500)
+    time.sleep(0.2)
+    (child,) = streams.split(ARN, 'shardId-Order-0000')
+    time.sleep(0.1)
+    handled = []
+    failures = [1]
+
+    def handle_records(shard_id, records):
+        if shard_id == 'shardId-Order-0000' and records and failures:
+            failures.pop()
+            raise RuntimeError('sink is down')
+        handled.extend((shard_id, record['dynamodb']['SequenceNumber']) for record in records)
+
+    parent_records = len(streams.streams[ARN][0].records)
+    consumer = consume(streams, handle_records, 5,
+                       until=lambda: any(shard_id == child for shard_id, _ in handled))
+
+    order = [shard_id for shard_id, _ in handled]
+    assert order.count('shardId-Order-0000') == parent_records
+    # Every parent record went to the sink before the first child record
+    assert child in order
+    assert order.index(child) == parent_records
+    assert 'shardId-Order-0000' in consumer.finished
+
+
+def test_a_drained_shard_is_finished_off_before_its_children_are_read():
+    streams = FakeStreamsClient(tables=('Order',), shard_count=1, rate=500)
+    time.sleep(0.1)
+    (child,) = streams.split(ARN, 'shardId-Order-0000')
+    events = []
+
+    def handle_records(shard_id, records):
+        if records:
+            events.append(shard_id)
+
+    consume(streams, handle_records, 5, until=lambda: child in events,
+            on_drained=lambda shard_id: events.append(f"drained {shard_id}"))
+    assert events.count('drained shardId-Order-0000') == 1
+    assert events.index('drained shardId-Order-0000') < events.index(child)
+    # Its lag series goes with it, the child's stays
+    shards = [key for _, key, _ in SHARD_LAG.samples()]
+    assert (ARN, 'shardId-Order-0000') not in shards and (ARN, child) in shards
@@ -0,0 +1,160 @@
+import datetime
+import json
+
+import pytest
+
+from checkpoint import SQLiteCheckpointStore
+from clients import LocalS3Client
+from encoder import get_encoder
+from lake_index import LakeIndex, index_key
+from sink import S3BatchWriter
+
+BUCKET = 'lake'
+CUSTOMER_ARN = 'arn:aws:dynamodb:ap-south-1:140023404813:table/Customer/stream/2024-11-28T20:32:37.346'
+
+
+def record(sequence_number, customer_id='CUST1', name='Ann', event_name='MODIFY',
+           created=datetime.datetime(2024, 11, 28, 14, 30, tzinfo=datetime.timezone.utc)):
+    return {
+        'eventID': f"event-{sequence_number}",
+        'eventName': event_name,
+        'eventSourceARN': CUSTOMER_ARN,
+        'dynamodb': {
+            'ApproximateCreationDateTime': created,
+            'Keys': {'CustomerId': {'S': customer_id}},
+            'NewImage': {'CustomerId': {'S': customer_id}, 'Name': {'S': name}},
+            'SequenceNumber': str(sequence_number),
+        }
+    }
+
+
+class FlakyS3Client(LocalS3Client):
+    """Fails the next `failures` put_object calls"""
+
+    def __init__(self, root, failures=0):
+        super().__init__(root)
+        self.failures = failures
+
+    def put_object(self, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('S3 is down')
+        return super().put_object(**kwargs)
+
+
+def data_objects(s3_client, prefix='customers/'):
+    listing = s3_client.list_objects_v2(Bucket=BUCKET, Prefix=prefix)
+    return [obj['Key'] for obj in listing.get('Contents', []) if '/_' not in obj['Key']]
+
+
+def read_lines(s3_client, key):
+    body = s3_client.get_object(Bucket=BUCKET, Key=key)['Body'].read()
+    return [json.loads(line) for line in body.splitlines()]
+
+
+@pytest.fixture
+def checkpoints(tmp_path):
+    store = SQLiteCheckpointStore(str(tmp_path / 'checkpoints.db'))
+    yield store
+    store.close()
+
+
+def test_full_batches_are_written_partitioned_and_checkpointed(tmp_path, checkpoints):
+    s3_client = LocalS3Client(str(tmp_path / 's3'))
+    sink = S3BatchWriter(s3_client, get_encoder(), max_records=2, on_flush=checkpoints.save)
+    for sequence_number in (1, 2, 3):
+        sink.add(record(sequence_number), BUCKET, 'customers', position=('arn', 'shard-1'))
+
+    (key,) = data_objects(s3_client)
+    assert key.startswith('customers/dt=2024-11-28/hour=14/') and key.endswith('.ndjson')
+    assert [line['eventID'] for line in read_lines(s3_client, key)] == ['event-1', 'event-2']
+    assert checkpoints.get('arn', 'shard-1') == '2'
+
+    sink.flush()
+    assert len(data_objects(s3_client)) == 2
+    assert checkpoints.get_all('arn') == {'shard-1': '3'}
+
+
+def test_failed_upload_is_retried_before_checkpointing(tmp_path, checkpoints):
+    s3_client = FlakyS3Client(str(tmp_path / 's3'), failures=1)
+    sink = S3BatchWriter(s3_client, get_encoder(), on_flush=checkpoints.save)
+    sink.add(record(1), BUCKET, 'customers', position=('arn', 'shard-1'))
+    sink.flush()
+    assert data_objects(s3_client) == []
+    assert checkpoints.get('arn', 'shard-1') is None
+
+    sink.add(record(2), BUCKET, 'customers', position=('arn', 'shard-1'))
+    sink.flush()
+    (key,) = data_objects(s3_client)
+    assert [line['eventID'] for line in read_lines(s3_client, key)] == ['event-1', 'event-2']
+    assert checkpoints.get('arn', 'shard-1') == '2'
+
+
+def test_records_are_written_in_their_own_partition(tmp_path, checkpoints):
+    s3_client = LocalS3Client(str(tmp_path / 's3'))
+    sink = S3BatchWriter(s3_client, get_encoder(), max_records=2, on_flush=checkpoints.save)
+    hour = datetime.datetime(2024, 11, 28, 15, tzinfo=datetime.timezone.utc)
+    for sequence_number, created in ((1, hour - datetime.timedelta(seconds=10)),
+                                     (2, hour + datetime.timedelta(seconds=10)),
+                                     (3, hour + datetime.timedelta(seconds=20))):
+        sink.add(record(sequence_number, created=created), BUCKET, 'customers',
+                 position=('arn', 'shard-1'))
+
+    # The 15:00 batch is full and written, but record 1 is still buffered for 14:00
+    (key,) = data_objects(s3_client)
+    assert key.startswith('customers/dt=2024-11-28/hour=15/')
+    assert checkpoints.get('arn', 'shard-1') is None
+
+    sink.flush()
+    partitions = sorted(key.split('/')[2] for key in data_objects(s3_client))
+    assert partitions == ['hour=14', 'hour=15']
+    assert checkpoints.get('arn', 'shard-1') == '3'
+
+
+def test_compaction_keeps_the_latest_image_per_key(tmp_path):
+    s3_client = LocalS3Client(str(tmp_path / 's3'))
+    sink = S3BatchWriter(s3_client, get_encoder(), compact=True)
+    sink.add(record(1, name='Ann'), BUCKET, 'customers')
+    sink.add(record(2, customer_id='CUST2', name='Bob'), BUCKET, 'customers')
+    sink.add(record(3, name='Anne'), BUCKET, 'customers')
+    sink.flush()
+
+    (key,) = data_objects(s3_client)
+    names = {line['dynamodb']['Keys']['CustomerId']['S']: line['dynamodb']['NewImage']['Name']['S']
+             for line in read_lines(s3_client, key)}
+    assert names == {'CUST1': 'Anne', 'CUST2': 'Bob'}
+
+
+def test_compaction_spans_a_failed_batch_and_the_one_after_it(tmp_path):
+    class AddWhileFailing(FlakyS3Client):
+        def put_object(self, **kwargs):
+            if self.failures:
+                # Another shard's thread buffers a newer image while this upload fails
+                sink.add(record(3, name='Anne'), BUCKET, 'customers')
+            return super().put_object(**kwargs)
+
+    s3_client = AddWhileFailing(str(tmp_path / 's3'), failures=1)
+    sink = S3BatchWriter(s3_client, get_encoder(), compact=True)
+    sink.add(record(1, name='Ann'), BUCKET, 'customers')
+    sink.add(record(2, customer_id='CUST2', name='Bob'), BUCKET, 'customers')
+    sink.flush()
+    sink.flush()
+
+    (key,) = data_objects(s3_client)
+    names = [(line['dynamodb']['Keys']['CustomerId']['S'], line['dynamodb']['NewImage']['Name']['S'])
+             for line in read_lines(s3_client, key)]
+    assert names == [('CUST2', 'Bob'), ('CUST1', 'Anne')]
+
+
+def test_objects_get_index_entries(tmp_path):
+    s3_client = LocalS3Client(str(tmp_path / 's3'))
+    sink = S3BatchWriter(s3_client, get_encoder(), indexer=LakeIndex(s3_client))
+    sink.add(record(7, name='Ann'), BUCKET, 'customers')
+    sink.add(record(9, customer_id='CUST2', name='Bob'), BUCKET, 'customers')
+    sink.flush()
+
+    (key,) = data_objects(s3_client)
+    entry = json.loads(s3_client.get_object(Bucket=BUCKET, Key=index_key('customers', key))['Body'].read())
+    assert entry['complete'] and entry['records'] == 2
+    assert (entry['min_sequence_number'], entry['max_sequence_number']) == ('7', '9')
+    assert entry['columns']['Name'] == ['Ann', 'Bob']
@@ -0,0 +1,43 @@
+import json
+
+from encoder import get_encoder
+from unmarshal import Unmarshaller
+
+
+def test_inferred_schema_widens_past_the_keys_image():
+    unmarshaller = Unmarshaller(schemas={}, numbers='native')
+    encode = get_encoder('compact', unmarshal=True, image_decoder=unmarshaller.image_decoder('Thing'))
+    record = {
+        'eventID': '1',
+        'dynamodb': {
+            'Keys': {'Id': {'S': 'a'}},
+            'NewImage': {'Id': {'S': 'a'}, 'Qty': {'N': '3'}, 'Where': {'M': {'City': {'S': 'X'}}}},
+            'SequenceNumber': '1',
+        }
+    }
+
+    stream = json.loads(encode(record))['dynamodb']
+    assert stream['Keys'] == {'Id': 'a'}
+    assert stream['NewImage'] == {'Id': 'a', 'Qty': 3, 'Where': {'City': 'X'}}
+    # Keys came first, the NewImage attributes were compiled in afterwards
+    assert unmarshaller.decoder('Thing').schema == {'Id': 'S', 'Qty': 'N', 'Where': {'City': 'S'}}
+
+
+def test_native_numbers_keep_every_digit():
+    unmarshaller = Unmarshaller(numbers='native')
+    encode = get_encoder(unmarshal=True, image_decoder=unmarshaller.image_decoder('Order'))
+    record = {
+        'eventID': '1',
+        'dynamodb': {
+            'NewImage': {'OrderId': {'S': 'ORD1'},
+                         'OrderTotal': {'N': '123456789012345678901234567890'},
+                         'Items': {'L': [{'M': {'ItemID': {'S': 'ITEM1'}, 'Quantity': {'N': '2'},
+                                                'Price': {'N': '1.00000000000000000001'}}}]}},
+            'SequenceNumber': '1',
+        }
+    }
+
+    line = encode(record)
+    assert b'"OrderTotal":123456789012345678901234567890' in line
+    assert b'"Price":1.00000000000000000001' in line
+    assert json.loads(line)['dynamodb']['NewImage']['Items'][0]['Quantity'] == 2
@@ -1,8 +1,9 @@
-import boto3
 import json
 import datetime
 from tzlocal import get_localzone
 from decimal import Decimal
+from clients import get_s3_client
+from registry import table_config
 
 # Custom JSON encoder for Decimal and datetime serialization
 class DecimalEncoder(json.JSONEncoder):
@@ -14,10 +15,10 @@ class DecimalEncoder(json.JSONEncoder):
         return super(DecimalEncoder, self).default(obj)
 
 # Initialize the S3 client
-s3_client = boto3.client('s3')
+s3_client = get_s3_client()
 
-# Your S3 bucket name
-bucket_name = 'quarkstail-datalake-s3-bucket'
+# Your S3 bucket name, from pipelines.yaml
+bucket_name = table_config('Customer')['bucket_name']
 
 # Define your record (the entry you provided)
 def tzlocal():
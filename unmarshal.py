@@ -0,0 +1,240 @@
+import threading
+from decimal import Decimal
+
+from encoder import _number
+
+# Declared shapes of the tables created in insert.py. A spec is a DynamoDB
+# type tag, a dict of field specs for an M value, or a one-element list
+# holding the spec of every element of an L value.
+SCHEMAS = {
+    'Customer': {
+        'CustomerId': 'S',
+        'Name': 'S',
+        'Email': 'S',
+        'Phone': 'S',
+        'Address': {'Street': 'S', 'City': 'S', 'State': 'S', 'ZIP': 'S'},
+        'IsPrimeMember': 'BOOL',
+    },
+    'Order': {
+        'OrderId': 'S',
+        'CustomerId': 'S',
+        'OrderDate': 'S',
+        'OrderTotal': 'N',
+        'OrderStatus': 'S',
+        'Items': [{'ItemID': 'S', 'Quantity': 'N', 'Price': 'N'}],
+    },
+}
+
+NUMBER_PARSERS = {'decimal': Decimal, 'native': _number}
+# Recompiles allowed for an inferred schema before it stays as it is
+MAX_WIDENINGS = 16
+
+
+def generic_value(typed, number=Decimal):
+    """Slow path: unmarshal any typed value, the way boto3's TypeDeserializer does"""
+    (tag, value), = typed.items()
+    if tag == 'S' or tag == 'BOOL' or tag == 'B':
+        return value
+    if tag == 'N':
+        return number(value)
+    if tag == 'M':
+        return {name: generic_value(item, number) for name, item in value.items()}
+    if tag == 'L':
+        return [generic_value(item, number) for item in value]
+    if tag == 'NULL':
+        return None
+    if tag == 'SS' or tag == 'BS':
+        return set(value)
+    if tag == 'NS':
+        return {number(item) for item in value}
+    raise ValueError(f"Unknown DynamoDB type {tag}")
+
+
+def infer_spec(typed):
+    """Return the spec of a typed value, for schemas inferred from sample images"""
+    (tag, value), = typed.items()
+    if tag == 'M':
+        return {name: infer_spec(item) for name, item in value.items()}
+    if tag == 'L':
+        specs = [infer_spec(item) for item in value]
+        # Only lists whose elements all look alike get an element decoder
+        if specs and all(spec == specs[0] for spec in specs):
+            return [specs[0]]
+        return 'L'
+    return tag
+
+
+def infer_schema(images):
+    """Merge the specs of sample images; attributes that disagree fall back to the slow path"""
+    schema = {}
+    for image in images:
+        for name, typed in image.items():
+            spec = infer_spec(typed)
+            if schema.setdefault(name, spec) != spec:
+                schema[name] = None
+    return {name: spec for name, spec in schema.items() if spec is not None}
+
+
+class _Compiler:
+    """Generate the source of one straight-line decoder function for a schema"""
+
+    def __init__(self, flatten):
+        self.flatten = flatten
+        self.helpers = []        # source of element decoders, defined before the main one
+        self.counter = 0
+
+    def name(self, prefix):
+        self.counter += 1
+        return f"{prefix}{self.counter}"
+
+    def function(self, name, fields, indent='    '):
+        lines = [f"def {name}(image):", f"{indent}row = {{}}", f"{indent}matched = 0"]
+        self.fields(lines, fields, 'image', 'row', '', indent, counted=True)
+        # Anything the schema doesn't know goes through the slow path
+        lines.append(f"{indent}if matched != len(image):")
+        lines.append(f"{indent}    for name in image.keys() - {set(fields)!r}:")
+        lines.append(f"{indent}        row[name] = generic(image[name], number)")
+        lines.append(f"{indent}return row")
+        return lines
+
+    def fields(self, lines, fields, source, row, prefix, indent, counted=False, present=False):
+        # present: the caller checked source has exactly these keys
+        for field, spec in fields.items():
+            value = self.name('v')
+            if present:
+                lines.append(f"{indent}{value} = {source}[{field!r}]")
+                self.value(lines, spec, value, row, prefix + field, indent)
+                continue
+            lines.append(f"{indent}{value} = {source}.get({field!r})")
+            lines.append(f"{indent}if {value} is not None:")
+            if counted:
+                lines.append(f"{indent}    matched += 1")
+            self.value(lines, spec, value, row, prefix + field, indent + '    ')
+
+    def value(self, lines, spec, value, row, column, indent):
+        target = f"{row}[{column!r}]"
+        if isinstance(spec, dict):
+            inner = self.name('m')
+            lines.append(f"{indent}{inner} = {value}.get('M')")
+            lines.append(f"{indent}if {inner} is not None and {inner}.keys() == {set(spec)!r}:")
+            if self.flatten:
+                self.fields(lines, spec, inner, row, column + '.', indent + '    ', present=True)
+            else:
+                nested = self.name('r')
+                lines.append(f"{indent}    {nested} = {{}}")
+                self.fields(lines, spec, inner, nested, '', indent + '    ', present=True)
+                lines.append(f"{indent}    {target} = {nested}")
+            lines.append(f"{indent}else:")
+            lines.append(f"{indent}    {target} = generic({value}, number)")
+        elif isinstance(spec, list):
+            element = self.name('element')
+            self.helpers.extend(self.element(element, spec[0]))
+            items = self.name('l')
+            lines.append(f"{indent}{items} = {value}.get('L')")
+            lines.append(f"{indent}{target} = [{element}(item) for item in {items}] "
+                         f"if {items} is not None else generic({value}, number)")
+        elif spec == 'S' or spec == 'BOOL' or spec == 'B':
+            lines.append(f"{indent}try:")
+            lines.append(f"{indent}    {target} = {value}[{spec!r}]")
+            lines.append(f"{indent}except KeyError:")
+            lines.append(f"{indent}    {target} = generic({value}, number)")
+        elif spec == 'N':
+            lines.append(f"{indent}try:")
+            lines.append(f"{indent}    {target} = number({value}['N'])")
+            lines.append(f"{indent}except KeyError:")
+            lines.append(f"{indent}    {target} = generic({value}, number)")
+        else:
+            lines.append(f"{indent}{target} = generic({value}, number)")
+
+    def element(self, name, spec):
+        # List elements are always nested, flattening a list makes no sense
+        flatten, self.flatten = self.flatten, False
+        lines = [f"def {name}(typed):"]
+        if isinstance(spec, dict):
+            lines += ["    image = typed.get('M')",
+                      f"    if image is None or image.keys() != {set(spec)!r}:",
+                      "        return generic(typed, number)",
+                      "    row = {}"]
+            self.fields(lines, spec, 'image', 'row', '', '    ', present=True)
+            lines.append("    return row")
+        else:
+            lines += ["    row = {}"]
+            self.value(lines, spec, 'typed', 'row', 'value', '    ')
+            lines.append("    return row['value']")
+        self.flatten = flatten
+        return lines
+
+
+def compile_decoder(schema, numbers='decimal', flatten=False):
+    """Build a function turning a typed image into a native row in one pass
+
+    numbers is 'decimal' (always a Decimal, like TypeDeserializer) or 'native'
+    (an int or float, or a Decimal where neither holds the number exactly,
+    which the record encoders write digit for digit). With flatten=True nested maps become dotted
+    columns such as Address.City.
+    """
+    compiler = _Compiler(flatten)
+    main = compiler.function('decode', schema)
+    source = '\n'.join(compiler.helpers + main)
+    namespace = {'generic': generic_value, 'number': NUMBER_PARSERS[numbers]}
+    exec(compile(source, f"<decoder {sorted(schema)}>", 'exec'), namespace)
+    decode = namespace['decode']
+    decode.source = source
+    return decode
+
+
+class Unmarshaller:
+    """Per-table decoders, compiled on first use from SCHEMAS or inferred from the images seen
+
+    An inferred schema starts from the first image, which is usually a
+    record's Keys, and is widened (the decoder recompiled) whenever an image
+    has attributes it doesn't know, up to MAX_WIDENINGS times. Images that
+    don't match their schema still decode correctly, just through
+    generic_value for the attributes that differ.
+    """
+
+    def __init__(self, schemas=None, numbers='decimal', flatten=False, infer=True):
+        self.schemas = dict(SCHEMAS if schemas is None else schemas)
+        self.numbers = numbers
+        self.flatten = flatten
+        self.infer = infer
+        self.decoders = {}
+        self.lock = threading.Lock()
+
+    def decoder(self, table_name, sample=None):
+        """Return the compiled decoder for a table"""
+        decode = self.decoders.get(table_name)
+        if decode is None or self._widens(decode, sample):
+            with self.lock:
+                decode = self.decoders.get(table_name)
+                if decode is None or self._widens(decode, sample):
+                    decode = self.decoders[table_name] = self._compile(table_name, decode, sample)
+        return decode
+
+    def _widens(self, decode, sample):
+        # widenings is None once a schema is fixed: declared, or widened often enough
+        return (decode.widenings is not None and sample is not None
+                and not sample.keys() <= decode.schema.keys())
+
+    def _compile(self, table_name, previous, sample):
+        schema = self.schemas.get(table_name)
+        widenings = None
+        if schema is None:
+            schema = dict(previous.schema) if previous is not None else {}
+            widenings = previous.widenings + 1 if previous is not None else 0
+            if self.infer and sample:
+                for name, spec in infer_schema([sample]).items():
+                    schema.setdefault(name, spec)
+            if not self.infer or widenings >= MAX_WIDENINGS:
+                widenings = None
+        decode = compile_decoder(schema, self.numbers, self.flatten)
+        decode.schema = schema
+        decode.widenings = widenings
+        return decode
+
+    def image(self, table_name, image):
+        return self.decoder(table_name, image)(image)
+
+    def image_decoder(self, table_name):
+        """A callable for encoder.get_encoder(image_decoder=...)"""
+        return lambda image: self.image(table_name, image)